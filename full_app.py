@@ -1,14 +1,53 @@
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'heliostat_ui'))
+import startup_profile
+startup_profile.enable_from_argv()
+
 from enum import Enum
-import pynmea2
-import PySpin
 import signal
-import sys
+import time
 from PyQt5 import QtGui, QtCore, QtWidgets
 from PyQt5.QtSerialPort import QSerialPort
-import astropy.coordinates as coord
-from astropy.time import Time
-import astropy.units as u
 
+import camera_source
+import camera_thread
+from camera_thread import CameraThread, LatestFrame
+import frame_pipeline
+from frame_pipeline import FramePipeline
+import grbl
+from grbl_stream import GrblStreamer
+from gps_worker import GPSLatency, REPORT_EVERY, start_gps_thread
+from jog import Jogger
+from log_sink import LogSink
+import mirror
+from moves import MoveCoalescer
+from realtime import RealtimeControl
+from auto_exposure import ExposureController
+import sun_spot
+import tracking
+
+# Direction (alt, az) of the receiver as seen from the mirror, for example
+# mirror.offset_to_altaz(east, north, up) of its position in metres.  None
+# points the mirror at the sun itself.
+TARGET = None
+# Rotating on-disk copy of the Grbl terminal, e.g. "grbl.log"; None for none.
+TERMINAL_LOG = None
+# Directory for the daily tracking error CSVs; None for none.
+TRACKING_LOG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs")
+# Camera-side binning (2 halves the frame each way before it leaves the
+# camera); 1 leaves the full frame to FramePipeline.
+CAMERA_BINNING = 1
+
+# Imported when the camera is first opened, see PySpinCamera.
+PySpin = None
+# How long GetNextImage waits for a frame, in ms; the camera thread checks
+# for a stop request in between.
+GRAB_TIMEOUT_MS = 1000
+# With the exposure slider at 0, True runs auto_exposure's histogram loop
+# (keeps the sun below saturation); False uses the camera's own auto
+# exposure, which aims for mid grey and saturates the sun.
+SOFTWARE_AUTO_EXPOSURE = True
 
 class State(Enum):
     INITIAL = 0
@@ -21,6 +60,8 @@ class State(Enum):
 
 class PySpinCamera:
     def __init__(self):
+        global PySpin
+        import PySpin
         # Retrieve singleton reference to system object
         self.system = PySpin.System.GetInstance()
         self.cam_list = self.system.GetCameras()
@@ -35,6 +76,12 @@ class PySpinCamera:
         self.nodemap_tldevice = self.cam.GetTLDeviceNodeMap()
         self.cam.Init()
         self.nodemap = self.cam.GetNodeMap()
+        # Exposure state, see exposure_nodes: the nodes are checked and their
+        # limits read once, not on every write.
+        self.exposure_writable = None
+        self.exposure_limits = None
+        self.exposure_auto = None
+        self.exposure_time = None
         
     def enter_acquisition_mode(self):
         node_acquisition_mode = PySpin.CEnumerationPtr(self.nodemap.GetNode('AcquisitionMode'))
@@ -48,20 +95,90 @@ class PySpinCamera:
         acquisition_mode_continuous = node_acquisition_mode_continuous.GetValue()
         node_acquisition_mode.SetIntValue(acquisition_mode_continuous)
         print('Acquisition mode set to continuous...')
+        self.configure_buffers()
         self.cam.BeginAcquisition()
 
-    def acquire_image(self):
-        image_result = self.cam.GetNextImage()
-        if image_result.IsIncomplete():
-            print('Image incomplete with image status %d ...' % image_result.GetImageStatus())
-        else:
-            width = image_result.GetWidth()
-            height = image_result.GetHeight()
-            stride = image_result.GetStride()
-            d = image_result.GetData()
-            image = QtGui.QImage(d, width, height, stride, QtGui.QImage.Format_Indexed8)
-            # image = image.scaledToHeight(512)
-            return image
+    def configure_buffers(self, count=frame_pipeline.BUFFER_COUNT):
+        # A few stream buffers, newest frame first: when the reader falls
+        # behind, the camera overwrites old frames instead of queueing them.
+        s_nodemap = self.cam.GetTLStreamNodeMap()
+        node_handling = PySpin.CEnumerationPtr(s_nodemap.GetNode('StreamBufferHandlingMode'))
+        node_count_mode = PySpin.CEnumerationPtr(s_nodemap.GetNode('StreamBufferCountMode'))
+        node_count = PySpin.CIntegerPtr(s_nodemap.GetNode('StreamBufferCountManual'))
+        for node in (node_handling, node_count_mode, node_count):
+            if not PySpin.IsAvailable(node) or not PySpin.IsWritable(node):
+                print('Unable to set stream buffers, leaving the defaults...')
+                return False
+        node_handling.SetIntValue(node_handling.GetEntryByName('NewestOnly').GetValue())
+        node_count_mode.SetIntValue(node_count_mode.GetEntryByName('Manual').GetValue())
+        node_count.SetValue(max(node_count.GetMin(), min(node_count.GetMax(), count)))
+        print('Stream buffers: %d, newest only...' % node_count.GetValue())
+        return True
+
+    def formats(self):
+        """The camera_source formats this camera can deliver."""
+        node_pixel_format = PySpin.CEnumerationPtr(self.nodemap.GetNode('PixelFormat'))
+        if not PySpin.IsAvailable(node_pixel_format) or not PySpin.IsReadable(node_pixel_format):
+            return ('gray',)
+        names = set()
+        for entry in node_pixel_format.GetEntries():
+            entry = PySpin.CEnumEntryPtr(entry)
+            if PySpin.IsAvailable(entry) and PySpin.IsReadable(entry):
+                names.add(entry.GetSymbolic())
+        return tuple(fmt for fmt, name in camera_source.SPIN_PIXEL_FORMATS.items() if name in names)
+
+    def set_format(self, fmt):
+        # Only while not acquiring.
+        node_pixel_format = PySpin.CEnumerationPtr(self.nodemap.GetNode('PixelFormat'))
+        if not PySpin.IsAvailable(node_pixel_format) or not PySpin.IsWritable(node_pixel_format):
+            print('Unable to set pixel format. Aborting...')
+            return False
+        node_pixel_format.SetIntValue(node_pixel_format.GetEntryByName(camera_source.SPIN_PIXEL_FORMATS[fmt]).GetValue())
+        print('Pixel format set to %s...' % camera_source.SPIN_PIXEL_FORMATS[fmt])
+        return True
+
+    def configure_binning(self, factor):
+        # Only while not acquiring.
+        try:
+            for node in (self.cam.BinningVertical, self.cam.BinningHorizontal):
+                if node.GetAccessMode() != PySpin.RW:
+                    print('Unable to set binning. Aborting...')
+                    return False
+                node.SetValue(max(node.GetMin(), min(node.GetMax(), factor)))
+        except PySpin.SpinnakerException as ex:
+            print('Error: %s' % ex)
+            return False
+        return True
+
+    def configure_frame_rate(self, fps):
+        try:
+            if self.cam.AcquisitionFrameRateEnable.GetAccessMode() != PySpin.RW:
+                print('Unable to enable frame rate control. Aborting...')
+                return False
+            self.cam.AcquisitionFrameRateEnable.SetValue(True)
+            if self.cam.AcquisitionFrameRate.GetAccessMode() != PySpin.RW:
+                print('Unable to set frame rate. Aborting...')
+                return False
+            node = self.cam.AcquisitionFrameRate
+            node.SetValue(max(node.GetMin(), min(node.GetMax(), fps)))
+            print('Frame rate set to %.1f...' % node.GetValue())
+            # The longest exposure depends on the frame rate.
+            self.exposure_limits = None
+        except PySpin.SpinnakerException as ex:
+            print('Error: %s' % ex)
+            return False
+        return True
+
+    def acquire_image(self, pipeline):
+        """The next frame through pipeline, which releases the buffer; None
+        if it was incomplete or didn't come within GRAB_TIMEOUT_MS."""
+        t_requested = time.perf_counter()
+        try:
+            image_result = self.cam.GetNextImage(GRAB_TIMEOUT_MS)
+        except PySpin.SpinnakerException as ex:
+            print('Error: %s' % ex)
+            return None
+        return pipeline.process(image_result, t_requested)
 
     def leave_acquisition_mode(self):
         self.cam.EndAcquisition()
@@ -74,32 +191,52 @@ class PySpinCamera:
         self.system.ReleaseInstance()
 
 
+    def exposure_nodes(self):
+        """Check the exposure nodes and read ExposureTime's limits, once; returns
+        True if both are writable."""
+        if self.exposure_writable is None:
+            self.exposure_writable = (self.cam.ExposureAuto.GetAccessMode() == PySpin.RW and
+                                      self.cam.ExposureTime.GetAccessMode() == PySpin.RW)
+            if not self.exposure_writable:
+                print('Unable to control exposure. Aborting...')
+        if self.exposure_writable and self.exposure_limits is None:
+            self.exposure_limits = (self.cam.ExposureTime.GetMin(), self.cam.ExposureTime.GetMax())
+            print('Exposure time limits %.0f-%.0f us...' % self.exposure_limits)
+        return self.exposure_writable
+
     def configure_exposure(self, value):
+        """Set a fixed exposure time (us), clamped to the camera's limits;
+        returns the time set, or None."""
         try:
-            result = True
+            if not self.exposure_nodes():
+                return None
             # Turn off automatic exposure mode
-            if self.cam.ExposureAuto.GetAccessMode() != PySpin.RW:
-                print('Unable to disable automatic exposure. Aborting...')
-                return False
-
-            self.cam.ExposureAuto.SetValue(PySpin.ExposureAuto_Off)
-            print('Automatic exposure disabled...')
+            if self.exposure_auto is not False:
+                self.cam.ExposureAuto.SetValue(PySpin.ExposureAuto_Off)
+                self.exposure_auto = False
+                print('Automatic exposure disabled...')
 
             # Set exposure time manually; exposure time recorded in microseconds
-            if self.cam.ExposureTime.GetAccessMode() != PySpin.RW:
-                print('Unable to set exposure time. Aborting...')
-                return False
+            value = max(self.exposure_limits[0], min(self.exposure_limits[1], value))
+            if value != self.exposure_time:
+                self.cam.ExposureTime.SetValue(value)
+                self.exposure_time = value
+        except PySpin.SpinnakerException as ex:
+            print('Error: %s' % ex)
+            return None
 
-            # Ensure desired exposure time does not exceed the maximum
-            exposure_time_to_set = value
-            exposure_time_to_set = min(self.cam.ExposureTime.GetMax(), exposure_time_to_set)
-            self.cam.ExposureTime.SetValue(exposure_time_to_set)
+        return value
 
+    def read_exposure(self):
+        """The exposure time (us) the camera is using now, e.g. under its own
+        auto exposure, or None."""
+        try:
+            if not self.exposure_nodes():
+                return None
+            return self.cam.ExposureTime.GetValue()
         except PySpin.SpinnakerException as ex:
             print('Error: %s' % ex)
-            result = False
-
-        return result
+            return None
 
     def reset_exposure(self):
         """
@@ -109,30 +246,34 @@ class PySpinCamera:
         :rtype: bool
         """
         try:
-            result = True
-
             # Turn automatic exposure back on
             #
             # *** NOTES ***
             # Automatic exposure is turned on in order to return the camera to its
             # default state.
 
-            if self.cam.ExposureAuto.GetAccessMode() != PySpin.RW:
+            if not self.exposure_nodes():
                 print('Unable to enable automatic exposure (node retrieval). Non-fatal error...')
                 return False
 
-            self.cam.ExposureAuto.SetValue(PySpin.ExposureAuto_Continuous)
-
-            print('Automatic exposure enabled...')
+            if self.exposure_auto is not True:
+                self.cam.ExposureAuto.SetValue(PySpin.ExposureAuto_Continuous)
+                self.exposure_auto = True
+                # The camera now changes it by itself.
+                self.exposure_time = None
+                print('Automatic exposure enabled...')
 
         except PySpin.SpinnakerException as ex:
             print('Error: %s' % ex)
-            result = False
+            return False
 
-        return result
+        return True
 
 
 class SpinWidget(QtWidgets.QWidget):
+    # The sun (a sun_spot.Spot) as seen in the newest frame.
+    spotSignal = QtCore.pyqtSignal(object)
+
     def __init__(self, *args, **kwargs):
         super(SpinWidget, self).__init__(*args, **kwargs)
 
@@ -141,13 +282,25 @@ class SpinWidget(QtWidgets.QWidget):
         self.label = QtWidgets.QLabel()
         self.layout.addWidget(self.label)
 
-        self.camera = PySpinCamera()
-        self.camera.enter_acquisition_mode()
-
+        # Opening the camera (and importing PySpin) takes a while, so it is
+        # left until the window is up, see open_camera.
+        self.camera = None
+        self.camera_thread = None
+        self.pipeline = FramePipeline()
+        # The frame on screen; see camera_callback.
+        self.shown = None
+        # Runs on the camera thread, on every frame.
+        self.spot_finder = sun_spot.SpotFinder()
+        # Software auto exposure, when on; it also runs on the camera thread
+        # but leaves the (slow) Spinnaker write to camera_callback, as a
+        # (controller, exposure) pair in exposure_requests.
+        self.exposure_controller = None
+        self.exposure_requests = LatestFrame()
+        # Frames are read on camera_thread; this only puts the newest one on
+        # screen.
         self.timer = QtCore.QTimer()
         self.timer.timeout.connect(self.camera_callback)
-        self.timer.start(0) 
-        
+
         self.sp = QtWidgets.QSlider(QtCore.Qt.Horizontal)
         self.sp.valueChanged.connect(self.exposure_change)
         self.sp.setMinimum(0)
@@ -157,8 +310,53 @@ class SpinWidget(QtWidgets.QWidget):
         self.sp.setTickInterval(5000)
         self.layout.addWidget(self.sp)
 
+    def open_camera(self):
+        with startup_profile.section("PySpinCamera"):
+            self.camera = PySpinCamera()
+            if CAMERA_BINNING > 1:
+                self.camera.configure_binning(CAMERA_BINNING)
+            if camera_thread.ACQUISITION_FPS is not None:
+                self.camera.configure_frame_rate(camera_thread.ACQUISITION_FPS)
+            # Every Spinnaker format has a QImage format, so there's never a
+            # conversion to do.
+            try:
+                fmt = camera_source.negotiate(self.camera.formats())[0]
+            except ValueError as ex:
+                # e.g. a Bayer-only or Mono16 camera; left as it is.
+                print('Leaving the pixel format alone:', ex)
+            else:
+                if self.camera.set_format(fmt):
+                    self.pipeline.fmt = fmt
+            self.camera.enter_acquisition_mode()
+        self.exposure_change(self.sp.value())
+        self.camera_thread = CameraThread(self.camera.acquire_image, self.pipeline, self.analyse_frame)
+        QtWidgets.QApplication.instance().aboutToQuit.connect(self.close_camera)
+        self.camera_thread.start()
+        self.timer.start(camera_thread.display_interval())
+
+    def close_camera(self):
+        self.timer.stop()
+        if self.camera_thread is not None:
+            self.camera_thread.stop()
+            print("camera:", self.camera_thread.summary())
+            if self.exposure_controller is not None:
+                print("exposure:", self.exposure_controller.summary())
+            self.camera_thread = None
+            self.camera.leave_acquisition_mode()
+
     def exposure_change(self, value):
-        if value == 0:
+        if self.camera is None:
+            return True
+        self.exposure_controller = None
+        if value == 0 and SOFTWARE_AUTO_EXPOSURE:
+            print("enable software auto")
+            # Starting from wherever the camera is now.
+            exposure = self.camera.read_exposure()
+            if exposure is not None:
+                exposure = self.camera.configure_exposure(exposure)
+            if exposure is not None:
+                self.exposure_controller = ExposureController(exposure, *self.camera.exposure_limits)
+        elif value == 0:
             print("enable auto")
             self.camera.reset_exposure()
         else:
@@ -166,10 +364,41 @@ class SpinWidget(QtWidgets.QWidget):
             self.camera.configure_exposure(value)
         return True
 
+    def analyse_frame(self, frame):
+        # On the camera thread.
+        controller = self.exposure_controller
+        if controller is not None:
+            exposure = controller.update(frame.data, frame.t_acquired)
+            if exposure is not None:
+                self.exposure_requests.put((controller, exposure))
+        return self.spot_finder.find(frame.data, frame.t_acquired)
+
     def camera_callback(self):
-        image = self.camera.acquire_image()
-        pixmap = QtGui.QPixmap.fromImage(image)
-        self.label.setPixmap(pixmap.scaledToHeight(512))
+        spot = self.camera_thread.results.take()
+        if spot is not None:
+            self.spotSignal.emit(spot)
+        request = self.exposure_requests.take()
+        # Dropped if the slider has been moved since.
+        if request is not None and request[0] is self.exposure_controller:
+            exposure = self.camera.configure_exposure(request[1])
+            if exposure is not None and exposure != request[1]:
+                request[0].set_exposure(exposure)
+        frame = self.camera_thread.latest.take()
+        if frame is None:
+            return
+        # Already display sized; the pixmap is the frame's only other copy,
+        # or for RGB32 shares it, so the frame is only recycled once the
+        # label has moved on to the next one.
+        self.label.setPixmap(QtGui.QPixmap.fromImage(frame.image()))
+        if self.shown is not None:
+            self.pipeline.recycle(self.shown)
+        self.shown = frame
+        stats = self.pipeline.stats
+        stats.add(frame)
+        if stats.count % frame_pipeline.REPORT_EVERY == 0:
+            print("camera:", stats.summary())
+            if self.exposure_controller is not None:
+                print("exposure:", self.exposure_controller.summary())
 
 
 class StateMachine:
@@ -178,62 +407,112 @@ class StateMachine:
         self.qgrbl_terminal = qgrbl_terminal
         self.qgrbl_terminal.state_machine = self
         self.qgps_info = qgps_info
+        self.qgps_info.gps_worker.fixSignal.connect(self.on_fix)
+        self.parser = grbl.GrblParser()
+        self.position = None
+        # Status arrives several times a second; log the error once a second.
+        self.tracking_log = tracking.TrackingLog(TRACKING_LOG_DIR, interval=1.0)
+        self.scheduler = tracking.TrackingScheduler(mirror.FULL_APP_MOUNT.joints,
+                                                    log=self.tracking_log, target=TARGET)
+        # Closed-loop correction of the tracking from the camera's view of
+        # the sun, when switched on.
+        self.camera_correction = False
+        self.corrector = sun_spot.OffsetCorrector()
+        # The offset the last tracking move was sent with.
+        self.moved_offset = self.scheduler.offset
+
+        # Tracking moves are sent when the scheduler says they are due.
+        self.track_timer = QtCore.QTimer()
+        self.track_timer.setSingleShot(True)
+        self.track_timer.timeout.connect(self.track)
         self.setState(State.INITIAL)
 
-        self.timer = QtCore.QTimer()
-        self.timer.timeout.connect(self.tick)
-        self.timer.start(1000)
-
     def setState(self, state):
         self.state = state
         self.state_label.setText(self.state.name)
+        if state == State.TRACKING:
+            self.track_timer.start(0)
+        else:
+            self.track_timer.stop()
+            # Homing, a jog or stopping tracking moves the mirror off what
+            # the correction was learned against.
+            self.reset_correction()
+
+    def set_camera_correction(self, enabled):
+        self.camera_correction = enabled
+        if not enabled:
+            self.reset_correction()
+
+    def reset_correction(self):
+        self.corrector.reset()
+        self.scheduler.offset = (0.0, 0.0)
+        self.moved_offset = self.scheduler.offset
+
+    def on_fix(self, fix):
+        self.scheduler.set_fix(fix.latitude, fix.longitude, fix.datetime)
+
+    def on_spot(self, spot):
+        if self.state != State.TRACKING or not self.camera_correction:
+            return
+        if not self.corrector.update(spot):
+            return
+        self.scheduler.offset = tuple(self.corrector.offset)
+        # Tracking moves can be minutes apart; move now once the correction
+        # is worth a move of its own.
+        if max(abs(o - m) for o, m in zip(self.scheduler.offset, self.moved_offset)) >= self.scheduler.tolerance:
+            self.track_timer.start(0)
 
     def gotLine(self, line):
-        if line.startswith("<"):
-            s = line[1:-1].split("|")
-            state = s[0]
-            mpos = s[1]
-            ps = mpos.split(":")
-            xpos, ypos, zpos = ps[1].split(",")
-            sw = s[2]
-            self.qgrbl_terminal.state_label.setText(state)
-            self.qgrbl_terminal.pos_x_value.setText(xpos)
-            self.qgrbl_terminal.pos_y_value.setText(ypos)
+        record = self.parser.parse_line(line)
+        if isinstance(record, grbl.StatusReport):
+            pos = record.wpos or record.mpos
+            self.qgrbl_terminal.state_label.setText(record.state)
+            if pos is not None:
+                self.position = pos[:2]
+                self.qgrbl_terminal.moves.set_position(self.position)
+                self.qgrbl_terminal.pos_x_value.setText("%.3f" % pos[0])
+                self.qgrbl_terminal.pos_y_value.setText("%.3f" % pos[1])
+                if self.state == State.TRACKING:
+                    self.scheduler.observe(self.position)
+            self.qgrbl_terminal.jogger.on_status(record)
+            self.qgrbl_terminal.realtime.on_status(record)
 
         if self.state == State.INITIAL:
             pass
             # if line == "[MSG:'$H'|'$X' to unlock]":
             #     self.setState(State.HOMING)
             #     self.qgrbl_terminal.send_line("$H")
-        elif self.state == State.HOMING and line == 'ok':
+        elif self.state == State.HOMING and record is grbl.OK:
+            self.qgrbl_terminal.moves.reset()
+            self.scheduler.reset()
             self.setState(State.HOMED)
 
-    def tick(self):
-        if self.state != State.HOMING and self.state != State.INITIAL:
-            cmd = "?"
-            self.qgrbl_terminal.send_line(cmd)
-        if self.state == State.TRACKING:
-            az = self.qgps_info.altaz_az_value.text()
-            alt = self.qgps_info.altaz_alt_value.text()
-            if az == '' or alt == '':
-                print("No valid az or alt")
-            try:
-                pos_x = - (90+float(az))
-                pos_y = -(90-float(alt))
-            except ValueError:
-                print("No valid az or alt")
-            else:
-                cmd = "G0 X%.3f" % pos_x
-                self.qgrbl_terminal.send_line(cmd)
-                cmd = "G0 Y%.3f" % pos_y
-                self.qgrbl_terminal.send_line(cmd)
-        
+    def track(self):
+        if self.state != State.TRACKING:
+            return
+        if not self.scheduler.ready():
+            print("No GPS fix yet")
+            self.track_timer.start(1000)
+            return
+        move = self.scheduler.plan(self.position, self.qgrbl_terminal.streamer.latency)
+        if move is None:
+            print("No mirror direction for the sun and target, trying again")
+            self.track_timer.start(int(self.scheduler.min_interval * 1000))
+            return
+        self.qgrbl_terminal.moves.move_to(*move.target)
+        self.moved_offset = self.scheduler.offset
+        self.track_timer.start(int(move.interval * 1000))
+        if self.scheduler.moves % 60 == 0:
+            print("Tracking error:", self.tracking_log.summary())
+            print("Moves:", self.qgrbl_terminal.moves.summary())
+            if self.camera_correction:
+                print("Camera correction:", self.corrector.summary())
+
 class QGrblTerminal(QtWidgets.QWidget):
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, port="/dev/grblserial", **kwargs):
         super(QtWidgets.QWidget, self).__init__(*args, **kwargs)
 
         self.serial = QSerialPort()
-        port = "/dev/grblserial"
         self.serial.setPortName(port)
         if self.serial.open(QtCore.QIODevice.ReadWrite):
             self.serial.setDataTerminalReady(True)
@@ -281,6 +560,7 @@ class QGrblTerminal(QtWidgets.QWidget):
         self.text.setFont(font)
         self.text.setReadOnly(True)
         self.layout.addWidget(self.text)
+        self.log = LogSink(self.text, path=TERMINAL_LOG, parent=self)
         
         self.input = QtWidgets.QLineEdit()
         self.input.setMinimumWidth(500)
@@ -288,53 +568,51 @@ class QGrblTerminal(QtWidgets.QWidget):
         self.layout.addWidget(self.input)
 
 
-        self.buffer = None
+        self.lines = grbl.LineBuffer()
+        self.streamer = GrblStreamer(self.serial.write, is_open=self.serial.isOpen)
+        # Tracking and jog moves go through here rather than send_line.
+        self.moves = MoveCoalescer(self.send_line, busy=lambda: self.streamer.queue)
+        # The jog buttons; a jog leaves the axes somewhere the coalescer
+        # didn't send them.
+        self.jogger = Jogger(self.streamer, self.send_realtime, parent=self)
+        self.jogger.stoppedSignal.connect(self.on_jog_stopped)
+        # Status polls, feed hold and overrides skip the line queue and the
+        # log.
+        self.realtime = RealtimeControl(self.send_realtime, parent=self)
+        self.realtime.start()
         self.state_machine = None
     
     def line_entered(self):
         self.send_line(self.input.text())
         
     def send_line(self, line):
-        self.text.appendPlainText("Sent: " + line)
-        b = bytearray(line + '\r', 'utf-8')
-        self.serial.writeData(b)
-        
-    def on_serial_read(self, *args):
-        data = self.serial.readAll()
-        if self.buffer:
-            decoded = self.buffer + data.data().decode('US_ASCII')
-        else:
-            decoded = data.data().decode('US_ASCII')
-        self.buffer = None
-        lines = decoded.split("\r\n")
-        for i, line in enumerate(lines):
-            if i < len(lines) - 1:
-                self.text.appendPlainText(line)
-                if self.state_machine:
-                    self.state_machine.gotLine(line)
-            else:
-                self.buffer = line
+        self.log.add("Sent: " + line)
+        self.streamer.send(line)
+
+    def send_realtime(self, data):
+        self.serial.write(data)
 
-def getSunPos(latitude, longitude, t):
-    loc = coord.EarthLocation(lon=longitude * u.deg,
-                              lat=latitude * u.deg)
-    now = Time(t)
-    altaz = coord.AltAz(location=loc, obstime=now)
-    sun = coord.get_sun(now)
-    result = sun.transform_to(altaz)
-    return result
+    def on_jog_stopped(self, latency):
+        self.moves.reset()
+        print("Jog stopped in %.0f ms (%s)" % (latency * 1e3, self.jogger.summary()))
+
+    def on_serial_read(self, *args):
+        for line in self.lines.feed(self.serial.readAll().data()):
+            self.streamer.on_line(line)
+            self.moves.flush()
+            self.log.add(line)
+            if self.state_machine:
+                self.state_machine.gotLine(line)
 
 class QGPSInfo(QtWidgets.QWidget):
     def __init__(self, *args, **kwargs):
         super(QtWidgets.QWidget, self).__init__(*args, **kwargs)
 
-        self.serial = QSerialPort()
-        port = "/dev/gpsserial"
-        self.serial.setPortName(port)
-        if self.serial.open(QtCore.QIODevice.ReadWrite):
-            self.serial.setDataTerminalReady(True)
-            self.serial.setBaudRate(4800)
-            self.serial.readyRead.connect(self.on_serial_read)
+        # NMEA parsing and the sun position run on the worker's thread; this
+        # widget only updates labels.
+        self.latency = GPSLatency()
+        self.gps_thread, self.gps_worker = start_gps_thread("/dev/gpsserial", 4800)
+        self.gps_worker.fixSignal.connect(self.on_fix)
 
         self.layout = QtWidgets.QVBoxLayout(self)
 
@@ -394,19 +672,15 @@ class QGPSInfo(QtWidgets.QWidget):
         self.altaz_az_value.setFont(f)
         self.altaz_layout.addWidget(self.altaz_az_value)
 
-    def on_serial_read(self, *args):
-        if self.serial.canReadLine():
-            line = self.serial.readLine()
-            decoded = line.data().decode('US_ASCII')
-            msg = pynmea2.parse(decoded)
-            if (msg.sentence_type == 'RMC'):
-                if msg.latitude != 0.0 and msg.longitude != 0.0:
-                    self.latlon_lat_value.setText("%8.3f" % msg.latitude)
-                    self.latlon_lon_value.setText("%8.3f" % msg.longitude)
-                    self.timestamp_value.setText("%s" % (msg.datetime))
-                    result = getSunPos(msg.latitude, msg.longitude, msg.datetime)
-                    self.altaz_alt_value.setText("%8.3f" % result.alt.degree)
-                    self.altaz_az_value.setText("%8.3f" % result.az.degree)
+    def on_fix(self, fix):
+        self.latency.add(fix)
+        self.latlon_lat_value.setText("%8.3f" % fix.latitude)
+        self.latlon_lon_value.setText("%8.3f" % fix.longitude)
+        self.timestamp_value.setText("%s" % (fix.datetime))
+        self.altaz_alt_value.setText("%8.3f" % fix.alt)
+        self.altaz_az_value.setText("%8.3f" % fix.az)
+        if self.latency.count % REPORT_EVERY == 0:
+            print("GPS latency:", self.latency.summary())
 
 class MainWindow(QtWidgets.QMainWindow):
     def __init__(self, *args, **kwargs):
@@ -416,10 +690,14 @@ class MainWindow(QtWidgets.QMainWindow):
         f = QtGui.QFont(self.font())
         f.setPointSize(36)
         self.state_label.setFont(f)
-        self.qgps_info = QGPSInfo(self)
-        self.qgrbl_terminal = QGrblTerminal(self)
-        self.spin_widget = SpinWidget(self)
+        with startup_profile.section("QGPSInfo"):
+            self.qgps_info = QGPSInfo(self)
+        with startup_profile.section("QGrblTerminal"):
+            self.qgrbl_terminal = QGrblTerminal(self)
+        with startup_profile.section("SpinWidget"):
+            self.spin_widget = SpinWidget(self)
         self.state_machine = StateMachine(self.state_label, self.qgrbl_terminal, self.qgps_info)
+        self.spin_widget.spotSignal.connect(self.state_machine.on_spot)
 
         self.main_widget = QtWidgets.QWidget(self)
         self.main_layout = QtWidgets.QVBoxLayout(self.main_widget)
@@ -437,17 +715,30 @@ class MainWindow(QtWidgets.QMainWindow):
         self.track_button = QtWidgets.QPushButton("Track")
         self.track_button.clicked.connect(self.track_clicked)
         self.button_layout.addWidget(self.track_button)
+        self.correction_box = QtWidgets.QCheckBox("Camera correction")
+        self.correction_box.toggled.connect(self.correction_toggled)
+        self.button_layout.addWidget(self.correction_box)
+        self.hold_button = QtWidgets.QPushButton("Hold")
+        self.hold_button.clicked.connect(self.qgrbl_terminal.realtime.feed_hold)
+        self.button_layout.addWidget(self.hold_button)
+        self.resume_button = QtWidgets.QPushButton("Resume")
+        self.resume_button.clicked.connect(self.qgrbl_terminal.realtime.resume)
+        self.button_layout.addWidget(self.resume_button)
         self.up_button = QtWidgets.QPushButton("Up")
-        self.up_button.clicked.connect(self.up_clicked)
+        self.up_button.pressed.connect(self.up_pressed)
+        self.up_button.released.connect(self.jog_released)
         self.button_layout.addWidget(self.up_button)
         self.down_button = QtWidgets.QPushButton("Down")
-        self.down_button.clicked.connect(self.down_clicked)
+        self.down_button.pressed.connect(self.down_pressed)
+        self.down_button.released.connect(self.jog_released)
         self.button_layout.addWidget(self.down_button)
         self.left_button = QtWidgets.QPushButton("Left")
-        self.left_button.clicked.connect(self.left_clicked)
+        self.left_button.pressed.connect(self.left_pressed)
+        self.left_button.released.connect(self.jog_released)
         self.button_layout.addWidget(self.left_button)
         self.right_button = QtWidgets.QPushButton("Right")
-        self.right_button.clicked.connect(self.right_clicked)
+        self.right_button.pressed.connect(self.right_pressed)
+        self.right_button.released.connect(self.jog_released)
         self.button_layout.addWidget(self.right_button)
         self.view_layout.addLayout(self.button_layout)
 
@@ -464,49 +755,39 @@ class MainWindow(QtWidgets.QMainWindow):
         print("track_clicked")
         self.state_machine.setState(State.TRACKING)
 
-    def up_clicked(self, *args, **kwargs):
-        print("up_clicked")
-        self.state_machine.setState(State.MANUAL)
-        pos_y = float(self.qgrbl_terminal.pos_y_value.text())
-        pos_y += 1
-        self.qgrbl_terminal.pos_y_value.setText(str(pos_y))
-        cmd = "G0 Y%.3f" % pos_y
-        self.qgrbl_terminal.send_line(cmd)
-        
-    def down_clicked(self, *args, **kwargs):
-        print("down_clicked")
-        self.state_machine.setState(State.MANUAL)
-        pos_y = float(self.qgrbl_terminal.pos_y_value.text())
-        pos_y -= 1
-        self.qgrbl_terminal.pos_y_value.setText(str(pos_y))
-        cmd = "G0 Y%.3f" % pos_y
-        self.qgrbl_terminal.send_line(cmd)
-
-    def left_clicked(self, *args, **kwargs):
-        print("left_clicked")
-        self.state_machine.setState(State.MANUAL)
-        pos_x = float(self.qgrbl_terminal.pos_x_value.text())
-        pos_x -= 1
-        self.qgrbl_terminal.pos_x_value.setText(str(pos_x))
-        cmd = "G0 X%.3f" % pos_x
-        self.qgrbl_terminal.send_line(cmd)
-
-    def right_clicked(self, *args, **kwargs):
-        print("right_clicked")
+    def correction_toggled(self, checked):
+        print("camera correction", checked)
+        self.state_machine.set_camera_correction(checked)
+
+    def up_pressed(self):
+        self.jog_pressed(y=1)
+
+    def down_pressed(self):
+        self.jog_pressed(y=-1)
+
+    def left_pressed(self):
+        self.jog_pressed(x=-1)
+
+    def right_pressed(self):
+        self.jog_pressed(x=1)
+
+    def jog_pressed(self, **direction):
+        print("jog", direction)
         self.state_machine.setState(State.MANUAL)
-        pos_x = float(self.qgrbl_terminal.pos_x_value.text())
-        pos_x += 1
-        self.qgrbl_terminal.pos_x_value.setText(str(pos_x))
-        cmd = "G0 X%.3f" % pos_x
-        self.qgrbl_terminal.send_line(cmd)
-        
-        
-        
+        self.qgrbl_terminal.jogger.start(**direction)
+
+    def jog_released(self):
+        self.qgrbl_terminal.jogger.stop()
+
+
 class QApplication(QtWidgets.QApplication):
     def __init__(self, *args, **kwargs):
         super(QApplication, self).__init__(*args, **kwargs)
-        self.main_window = MainWindow()
+        with startup_profile.section("MainWindow"):
+            self.main_window = MainWindow()
         self.main_window.show()
+        QtCore.QTimer.singleShot(0, startup_profile.report)
+        QtCore.QTimer.singleShot(0, self.main_window.spin_widget.open_camera)
         
 
 if __name__ == '__main__':
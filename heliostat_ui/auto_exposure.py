@@ -0,0 +1,176 @@
+# Software auto exposure for looking at the sun.
+#
+# A camera's own auto exposure aims for a mid-grey average, so with the sun
+# in the frame it leaves the sun itself a saturated blob.  ExposureController
+# instead looks at the top of the histogram: it shortens the exposure while
+# more than SATURATION of the pixels are saturated, and otherwise lengthens
+# it until the brightest SATURATION of them reach LEVEL.  Brightness is
+# proportional to exposure time, so each step is a ratio, damped by GAIN and
+# capped at MAX_STEP.  It decides at most every INTERVAL seconds, which also
+# gives the camera time to deliver frames taken with the last setting.
+import math
+
+import numpy as np
+
+# Fraction of pixels allowed to be saturated: a few, so the sun's disk
+# itself (~0.1% of the frame) stays just below saturation.
+SATURATION = 0.0001
+# Pixel values from here up count as saturated.
+SATURATED = 250
+# Where the brightest SATURATION of the pixels should sit.
+LEVEL = 200
+# Histogram every SUBSAMPLE-th pixel of every SUBSAMPLE-th row.
+SUBSAMPLE = 4
+# Seconds between decisions (and so between exposure writes).
+INTERVAL = 0.25
+# Exponent on the correction ratio; below 1 damps it.
+GAIN = 0.7
+# Largest change per step, as a factor.
+MAX_STEP = 2.0
+# Changes smaller than this fraction aren't worth a write.
+MIN_CHANGE = 0.05
+
+
+class ExposureController:
+    def __init__(self, exposure, minimum, maximum, saturation=SATURATION, saturated=SATURATED,
+                 level=LEVEL, subsample=SUBSAMPLE, interval=INTERVAL, gain=GAIN,
+                 max_step=MAX_STEP, min_change=MIN_CHANGE):
+        # Exposure times in whatever unit the camera uses (PySpin: us).
+        self.exposure = exposure
+        self.minimum = minimum
+        self.maximum = maximum
+        self.saturation = saturation
+        self.saturated = saturated
+        self.level = level
+        self.subsample = subsample
+        self.interval = interval
+        self.gain = gain
+        self.max_step = max_step
+        self.min_change = min_change
+        self.last = None
+        self.frames = 0
+        self.evaluations = 0
+        self.changes = 0
+        self.saturated_fraction = None
+
+    def set_exposure(self, exposure):
+        """Tell the controller about an exposure set by someone else."""
+        self.exposure = exposure
+
+    def update(self, frame, t):
+        """Look at frame (a 2-D array, or colour with channels last, of which
+        green is used; taken at time t in seconds); returns a new exposure to
+        write, or None."""
+        self.frames += 1
+        if self.last is not None and t - self.last < self.interval:
+            return None
+        self.last = t
+        self.evaluations += 1
+        sample = frame[::self.subsample, ::self.subsample]
+        if sample.ndim == 3:
+            sample = sample[..., 1]
+        hist = np.bincount(sample.ravel(), minlength=256)
+        # Pixels at or above each value.
+        above = np.cumsum(hist[::-1])[::-1]
+        allowed = self.saturation * sample.size
+        self.saturated_fraction = above[self.saturated] / float(sample.size)
+        if above[self.saturated] > allowed:
+            # How far over isn't visible, so the ratio of counts stands in.
+            factor = (allowed / above[self.saturated]) ** self.gain
+        else:
+            # The value the brightest `allowed` pixels reach.
+            top = int(np.count_nonzero(above > allowed))
+            factor = (self.level / max(top, 1.0)) ** self.gain
+        factor = max(1.0 / self.max_step, min(self.max_step, factor))
+        exposure = max(self.minimum, min(self.maximum, self.exposure * factor))
+        if abs(math.log(exposure / self.exposure)) < math.log1p(self.min_change):
+            return None
+        self.exposure = exposure
+        self.changes += 1
+        return exposure
+
+    def summary(self):
+        return "exposure %.0f, %d frames, %d looked at, %d changes, %s saturated" % (
+            self.exposure, self.frames, self.evaluations, self.changes,
+            "%.3f%%" % (self.saturated_fraction * 100) if self.saturated_fraction is not None else '-')
+
+
+def simulated_frame(exposure, width=682, height=512, sun=(300.0, 200.0, 12.0), sun_radiance=40.0,
+                    sky=0.004, noise=2.0, rng=None):
+    """A frame of a scene with a bright sun disk on a dim sky, as a linear
+    sensor would see it at exposure (us): value = radiance * exposure,
+    clipped at 255."""
+    if rng is None:
+        rng = np.random.default_rng(0)
+    yy, xx = np.mgrid[0:height, 0:width]
+    disk = np.clip(sun[2] + 0.5 - np.hypot(xx - sun[0], yy - sun[1]), 0.0, 1.0)
+    radiance = sky * (1.0 + 0.5 * xx / width) + sun_radiance * disk
+    return np.clip(radiance * exposure + rng.normal(0.0, noise, disk.shape), 0, 255).astype(np.uint8)
+
+
+def check():
+    """Convergence checks on simulated frames; raises AssertionError on
+    failure."""
+    rng = np.random.default_rng(0)
+    # From far too long and far too short, it settles with the sun just
+    # below saturation, never stepping more than MAX_STEP or more often than
+    # INTERVAL.
+    for start in (20000.0, 5.0):
+        controller = ExposureController(start, 1.0, 30000.0)
+        exposure = start
+        writes = []
+        for i in range(200):
+            t = i / 30.0
+            new = controller.update(simulated_frame(exposure, rng=rng), t)
+            if new is not None:
+                assert max(new / exposure, exposure / new) <= MAX_STEP + 1e-9
+                writes.append(t)
+                exposure = new
+        assert all(b - a >= INTERVAL - 1e-9 for a, b in zip(writes, writes[1:]))
+        frame = simulated_frame(exposure, rng=rng)
+        sun = frame[200 - 8:200 + 9, 300 - 8:300 + 9]
+        assert sun.max() < SATURATED and sun.max() > LEVEL * 0.8, (start, exposure, sun.max())
+        assert controller.update(simulated_frame(exposure, rng=rng), 100.0) is None
+    # Limits are respected: a dark scene runs up to the maximum and stops.
+    controller = ExposureController(100.0, 1.0, 1000.0)
+    for i in range(100):
+        new = controller.update(np.zeros((64, 64), dtype=np.uint8), float(i))
+    assert controller.exposure == 1000.0 and new is None
+    # Colour frames use the green channel.
+    frame = np.repeat(simulated_frame(20000.0, rng=rng)[..., None], 4, axis=2)
+    assert ExposureController(20000.0, 1.0, 30000.0).update(frame, 0.0) == 20000.0 / MAX_STEP
+
+
+if __name__ == '__main__':
+    import time
+
+    check()
+    print("auto exposure checks passed")
+
+    # Cost per frame when a decision is due, on a display-sized frame.
+    frame = simulated_frame(200.0)
+    controller = ExposureController(200.0, 1.0, 30000.0, interval=0.0)
+    n = 1000
+    t0 = time.perf_counter()
+    for i in range(n):
+        controller.update(frame, float(i))
+        controller.exposure = 200.0
+    print("%.3f ms per decision on %dx%d" % ((time.perf_counter() - t0) / n * 1e3, frame.shape[1],
+                                             frame.shape[0]))
+
+    # Against a mean-targeting auto exposure like the camera's: the sun
+    # saturates.
+    rng = np.random.default_rng(1)
+    mean_exposure = 128 / simulated_frame(1.0, noise=0.0).astype(float).mean()
+    controller = ExposureController(5000.0, 1.0, 30000.0)
+    exposure = 5000.0
+    for i in range(300):
+        new = controller.update(simulated_frame(exposure, rng=rng), i / 30.0)
+        if new is not None:
+            exposure = new
+    for name, value in (("mean grey", mean_exposure), ("histogram", exposure)):
+        frame = simulated_frame(value, rng=rng)
+        sun = frame[188:213, 288:313]
+        print("%-9s exposure %7.1f us: sun peak %d, %.1f%% of the sun disk saturated" % (
+            name, value, sun.max(), 100.0 * np.count_nonzero(sun >= SATURATED) / (np.pi * 12 ** 2)))
+    print(controller.summary())
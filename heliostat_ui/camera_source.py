@@ -0,0 +1,230 @@
+# Pixel formats shared by the camera backends (PySpin, picamera) and the Qt
+# display.
+#
+# Every backend can deliver several formats itself, at no cost to us; Qt can
+# wrap some of them in a QImage directly, and paints some far more cheaply
+# than others.  negotiate() picks the capture format so that no per-frame
+# colour conversion is needed (and none is done in Qt), falling back to a
+# NumPy conversion only when the camera and the display have nothing in
+# common, e.g. a BGR-only camera with a Qt older than 5.14.
+import numpy as np
+from PyQt5 import QtGui
+
+# Format name: (QImage format, bytes per pixel).  'bgra' is B, G, R, A in
+# memory, which is what QImage's 0xAARRGGBB RGB32 is on a little-endian CPU;
+# its alpha byte is ignored.
+FORMATS = {
+    'gray': ('Format_Grayscale8', 1),
+    'rgb': ('Format_RGB888', 3),
+    'bgr': ('Format_BGR888', 3),
+    'bgra': ('Format_RGB32', 4),
+    'rgba': ('Format_RGBX8888', 4),
+}
+# Display preference, cheapest to convert and paint first (see the benchmark
+# below): RGB32 is the screen's own format and isn't even copied, so a frame
+# shown that way must stay untouched until its pixmap is replaced.  It takes
+# about 0.2 ms per 800x480 frame, the others 0.35-0.7 ms.
+DISPLAY_FORMATS = ('bgra', 'rgb', 'rgba', 'gray', 'bgr')
+# Formats QPixmap.fromImage shares rather than copies.
+SHARED_FORMATS = ('bgra',)
+
+# What each backend can capture natively, cheapest for it first.
+PICAMERA_FORMATS = ('bgra', 'rgba', 'rgb', 'bgr', 'yuv')
+# Spinnaker PixelFormat entries for each format.
+SPIN_PIXEL_FORMATS = {
+    'gray': 'Mono8',
+    'rgb': 'RGB8',
+    'bgr': 'BGR8',
+    'bgra': 'BGRa8',
+    'rgba': 'RGBa8',
+}
+
+
+def display_formats():
+    """DISPLAY_FORMATS this Qt has a QImage format for."""
+    return tuple(fmt for fmt in DISPLAY_FORMATS if hasattr(QtGui.QImage, FORMATS[fmt][0]))
+
+
+def qimage_format(fmt):
+    return getattr(QtGui.QImage, FORMATS[fmt][0])
+
+
+def to_qimage(array, fmt, width=None, height=None):
+    """A QImage over array, which must be contiguous, without copying it.
+    width and height crop off padding, e.g. picamera's."""
+    if height is None:
+        height = array.shape[0]
+    if width is None:
+        width = array.shape[1]
+    return QtGui.QImage(array.data, width, height, array.strides[0], qimage_format(fmt))
+
+
+def bgr_to_bgra(array):
+    out = np.empty(array.shape[:2] + (4,), dtype=np.uint8)
+    out[..., :3] = array
+    out[..., 3] = 255
+    return out
+
+
+def bgr_to_rgb(array):
+    return np.ascontiguousarray(array[..., ::-1])
+
+
+def yuv_to_gray(array):
+    # I420 is the full-size Y plane followed by quarter-size U and V planes,
+    # here as a (height * 3 / 2, width) array: Y is simply the top rows.
+    return array[:array.shape[0] * 2 // 3]
+
+
+def yuv_to_bgra(array):
+    # BT.601 limited range, in integer arithmetic.
+    height = array.shape[0] * 2 // 3
+    width = array.shape[1]
+    y = array[:height].astype(np.int32) - 16
+    chroma = array[height:].reshape(-1)
+    u = chroma[:height * width // 4].reshape(height // 2, width // 2).astype(np.int32) - 128
+    v = chroma[height * width // 4:].reshape(height // 2, width // 2).astype(np.int32) - 128
+    u = u.repeat(2, axis=0).repeat(2, axis=1)
+    v = v.repeat(2, axis=0).repeat(2, axis=1)
+    out = np.empty((height, width, 4), dtype=np.uint8)
+    y = 298 * y + 128
+    np.clip((y + 516 * u) >> 8, 0, 255, out=out[..., 0], casting='unsafe')
+    np.clip((y - 100 * u - 208 * v) >> 8, 0, 255, out=out[..., 1], casting='unsafe')
+    np.clip((y + 409 * v) >> 8, 0, 255, out=out[..., 2], casting='unsafe')
+    out[..., 3] = 255
+    return out
+
+
+# (capture format, display format): function from one to the other,
+# cheapest first.
+CONVERSIONS = {
+    ('yuv', 'gray'): yuv_to_gray,
+    ('bgr', 'rgb'): bgr_to_rgb,
+    ('bgr', 'bgra'): bgr_to_bgra,
+    ('yuv', 'bgra'): yuv_to_bgra,
+}
+
+
+def negotiate(offered, accepted=None):
+    """Pick formats for a camera that can capture the formats in offered.
+
+    Returns (capture, display, convert): capture is what to ask the camera
+    for and display what to give to_qimage(); convert is None when they are
+    the same, otherwise a function from one to the other.
+    """
+    if accepted is None:
+        accepted = display_formats()
+    for fmt in accepted:
+        if fmt in offered:
+            return fmt, fmt, None
+    for (capture, fmt), convert in CONVERSIONS.items():
+        if capture in offered and fmt in accepted:
+            return capture, fmt, convert
+    raise ValueError("no display format for any of %s" % (offered,))
+
+
+def _check():
+    rng = np.random.default_rng(0)
+    bgr = rng.integers(0, 256, (4, 6, 3), dtype=np.uint8)
+    assert (bgr_to_rgb(bgr)[..., 0] == bgr[..., 2]).all()
+    assert (bgr_to_bgra(bgr)[..., :3] == bgr).all()
+    # to_qimage reads bgra as RGB32: pixel() is 0xAARRGGBB.
+    bgra = bgr_to_bgra(bgr)
+    b, g, r = (int(c) for c in bgr[1, 2])
+    assert to_qimage(bgra, 'bgra').pixel(2, 1) == 0xff000000 | r << 16 | g << 8 | b
+    # Mid grey with no colour is mid grey.
+    yuv = np.full((6, 4), 128, dtype=np.uint8)
+    yuv[:4] = 126
+    out = yuv_to_bgra(yuv)
+    assert out.shape == (4, 4, 4) and (np.abs(out[..., :3].astype(int) - 128) <= 1).all()
+    assert yuv_to_gray(yuv).shape == (4, 4)
+    assert negotiate(('gray',))[:2] == ('gray', 'gray')
+    assert negotiate(PICAMERA_FORMATS)[:2] == ('bgra', 'bgra')
+    # Without Qt 5.14's BGR888, BGR frames need converting.
+    assert negotiate(('bgr',), ('bgra', 'gray', 'rgb', 'rgba')) == ('bgr', 'rgb', bgr_to_rgb)
+    assert negotiate(('bgr',), ('bgra',)) == ('bgr', 'bgra', bgr_to_bgra)
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    from PyQt5 import QtWidgets
+
+    app = QtWidgets.QApplication(sys.argv)
+    _check()
+    print("format checks passed")
+    rng = np.random.default_rng(0)
+    n = 200
+
+    def frames(width, height, fmt):
+        if fmt == 'yuv':
+            return rng.integers(0, 256, (height * 3 // 2, width), dtype=np.uint8)
+        channels = FORMATS[fmt][1]
+        shape = (height, width) if channels == 1 else (height, width, channels)
+        return rng.integers(0, 256, shape, dtype=np.uint8)
+
+    def fps(show):
+        t0 = time.perf_counter()
+        for i in range(n):
+            show()
+        return n / (time.perf_counter() - t0)
+
+    # What a QLabel does with its pixmap: each frame is painted, so formats
+    # that are cheap to wrap but slow to draw don't look better than they are.
+    targets = {}
+
+    def paint(pixmap):
+        size = (pixmap.width(), pixmap.height())
+        if size not in targets:
+            targets[size] = QtGui.QPixmap(*size)
+        painter = QtGui.QPainter(targets[size])
+        painter.drawPixmap(0, 0, pixmap)
+        painter.end()
+
+    def display(array, capture, accepted):
+        capture, fmt, convert = negotiate((capture,), accepted)
+        def show():
+            data = array if convert is None else convert(array)
+            paint(QtGui.QPixmap.fromImage(to_qimage(data, fmt)))
+        return fmt, fps(show)
+
+    # Display throughput per backend and capture format, with the frame sizes
+    # each one delivers: PySpin after FramePipeline and the Pi camera at
+    # ramps_gui's resolution.
+    available = display_formats()
+    for backend, offered, (width, height) in (('pyspin', tuple(SPIN_PIXEL_FORMATS), (682, 512)),
+                                              ('picamera', PICAMERA_FORMATS, (800, 480))):
+        chosen = negotiate(offered)[0]
+        results = []
+        for capture in offered:
+            array = frames(width, height, capture)
+            fmt, rate = display(array, capture, available)
+            results.append("%s%s->%s %.0f" % ('*' if capture == chosen else '', capture, fmt, rate))
+        print("%s %dx%d fps: %s" % (backend, width, height, ", ".join(results)))
+        if backend == 'pyspin':
+            # Qt < 5.14 has no BGR888, so BGR frames are converted.
+            array = frames(width, height, 'bgr')
+            print("  without BGR888: bgr->%s %.0f, bgr->%s %.0f" % (
+                display(array, 'bgr', ('bgra',)) + display(array, 'bgr', ('rgb',))))
+
+    # What ramps_gui and full_app did before: BGR bytes copied into an RGB888
+    # QImage (red and blue swapped), and a full PySpin frame as Indexed8
+    # scaled by Qt.
+    bgr = frames(800, 480, 'bgr').tobytes()
+    qimage = QtGui.QImage(800, 480, QtGui.QImage.Format_RGB888)
+
+    def old_picamera():
+        bits = qimage.bits()
+        bits.setsize(800 * 480 * 3)
+        bits[:] = bgr
+        paint(QtGui.QPixmap(qimage))
+
+    full = frames(2048, 1536, 'gray')
+
+    def old_pyspin():
+        image = QtGui.QImage(full.data, 2048, 1536, 2048, QtGui.QImage.Format_Indexed8)
+        paint(QtGui.QPixmap.fromImage(image).scaledToHeight(512))
+
+    print("before: picamera bgr bytes into RGB888 %.0f fps, pyspin Indexed8 + scaling %.0f fps" % (
+        fps(old_picamera), fps(old_pyspin)))
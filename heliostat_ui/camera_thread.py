@@ -0,0 +1,209 @@
+# Camera acquisition off the GUI thread.
+#
+# GetNextImage() blocks until the camera has a frame, so calling it from a
+# 0 ms QTimer ran the whole UI at the camera's frame cadence and froze it
+# whenever the camera stalled.  CameraThread waits for frames and downsamples
+# them on its own thread and leaves only the newest in a LatestFrame; the GUI
+# picks that up on a timer at the screen's refresh rate, so a frame the
+# screen could never show is never drawn.
+import threading
+import time
+
+from PyQt5 import QtCore, QtGui
+
+# Frames per second the camera is asked for; None leaves its own setting.
+ACQUISITION_FPS = None
+# Redraw rate; None for the screen's refresh rate.
+DISPLAY_FPS = None
+# Pause after a failed read before trying again.
+ERROR_BACKOFF = 0.5
+
+
+class LatestFrame:
+    """A one-frame queue shared by two threads: put() replaces whatever the
+    reader hasn't taken yet."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.frame = None
+        self.put_count = 0
+        self.overwritten = 0
+
+    def put(self, frame):
+        """Store frame; returns the frame it replaced, if any."""
+        with self.lock:
+            old = self.frame
+            self.frame = frame
+            self.put_count += 1
+            if old is not None:
+                self.overwritten += 1
+            return old
+
+    def take(self):
+        with self.lock:
+            frame = self.frame
+            self.frame = None
+            return frame
+
+
+class CameraThread(QtCore.QThread):
+    def __init__(self, acquire, pipeline, analyse=None, parent=None):
+        super(CameraThread, self).__init__(parent)
+        # acquire(pipeline) blocks for the next frame and returns it, or None
+        # after an incomplete frame or timeout.  It should time out now and
+        # then, so that stop() doesn't wait on a camera that has gone quiet.
+        self.acquire = acquire
+        self.pipeline = pipeline
+        self.latest = LatestFrame()
+        # analyse(frame) is run on every frame, shown or not, in this thread;
+        # the newest result that isn't None waits in results.
+        self.analyse = analyse
+        self.results = LatestFrame()
+        self.errors = 0
+
+    def run(self):
+        while not self.isInterruptionRequested():
+            try:
+                frame = self.acquire(self.pipeline)
+            except Exception as ex:
+                self.errors += 1
+                print("camera:", ex)
+                time.sleep(ERROR_BACKOFF)
+                continue
+            if frame is None:
+                continue
+            if self.analyse is not None:
+                result = self.analyse(frame)
+                if result is not None:
+                    self.results.put(result)
+            old = self.latest.put(frame)
+            if old is not None:
+                self.pipeline.recycle(old)
+
+    def stop(self):
+        self.requestInterruption()
+        self.wait()
+
+    def summary(self):
+        return "%d frames acquired, %d never shown, %d errors" % (
+            self.latest.put_count, self.latest.overwritten, self.errors)
+
+
+def display_interval(fps=DISPLAY_FPS):
+    """Display timer interval in ms for fps, or for the screen's refresh
+    rate when fps is None."""
+    if fps is None:
+        screen = QtGui.QGuiApplication.primaryScreen()
+        fps = screen.refreshRate() if screen is not None and screen.refreshRate() > 0 else 60.0
+    return max(1, int(1000 / fps))
+
+
+class SyntheticCamera:
+    """A camera for the benchmark below: frames of a fixed array at fps, with
+    GetNextImage()'s blocking wait and optional long stalls."""
+
+    def __init__(self, array, fps=60.0, stall_every=None, stall=0.5):
+        self.array = array
+        self.interval = 1.0 / fps
+        self.stall_every = stall_every
+        self.stall = stall
+        self.frame_id = 0
+        self.next = time.perf_counter()
+
+    def acquire(self, pipeline):
+        from frame_pipeline import SyntheticImage
+        t_requested = time.perf_counter()
+        self.next += self.interval
+        if self.stall_every and self.frame_id and self.frame_id % self.stall_every == 0:
+            self.next += self.stall
+        delay = self.next - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            self.next = time.perf_counter()
+        self.frame_id += 1
+        return pipeline.process(SyntheticImage(self.array, self.frame_id), t_requested)
+
+
+if __name__ == '__main__':
+    import sys
+
+    import numpy as np
+    from PyQt5 import QtWidgets
+
+    from frame_pipeline import FramePipeline
+
+    # How late a 5 ms GUI timer fires while 2048x1536 frames stream at 60 fps,
+    # with a half-second camera stall every 60 frames.
+    PROBE_MS = 5
+    DURATION = 3.0
+
+    app = QtWidgets.QApplication(sys.argv)
+    label = QtWidgets.QLabel()
+    label.show()
+    full = np.random.default_rng(0).integers(0, 256, (1536, 2048), dtype=np.uint8)
+
+    def measure(start, stop):
+        lateness = []
+        last = [time.perf_counter()]
+
+        def probe():
+            now = time.perf_counter()
+            lateness.append(max(0.0, now - last[0] - PROBE_MS / 1000.0))
+            last[0] = now
+
+        probe_timer = QtCore.QTimer()
+        probe_timer.timeout.connect(probe)
+        probe_timer.start(PROBE_MS)
+        start()
+        end = time.perf_counter() + DURATION
+        while time.perf_counter() < end:
+            app.processEvents(QtCore.QEventLoop.AllEvents, 10)
+        stop()
+        probe_timer.stop()
+        lateness.sort()
+        return "GUI timer lateness mean %.1f, p99 %.1f, max %.1f ms" % (
+            sum(lateness) / len(lateness) * 1e3, lateness[int(len(lateness) * 0.99)] * 1e3,
+            lateness[-1] * 1e3)
+
+    def show(frame, pipeline):
+        label.setPixmap(QtGui.QPixmap.fromImage(frame.image()))
+        pipeline.stats.add(frame)
+        pipeline.recycle(frame)
+
+    # The old way: a 0 ms timer reading the camera on the GUI thread.
+    camera = SyntheticCamera(full, stall_every=60)
+    pipeline = FramePipeline()
+    timer = QtCore.QTimer()
+
+    def callback():
+        frame = camera.acquire(pipeline)
+        if frame is not None:
+            show(frame, pipeline)
+
+    timer.timeout.connect(callback)
+    result = measure(lambda: timer.start(0), timer.stop)
+    print("GUI thread: %s; %s" % (result, pipeline.stats.summary()))
+
+    camera = SyntheticCamera(full, stall_every=60)
+    pipeline = FramePipeline()
+    thread = CameraThread(camera.acquire, pipeline)
+    display_timer = QtCore.QTimer()
+
+    def display():
+        frame = thread.latest.take()
+        if frame is not None:
+            show(frame, pipeline)
+
+    display_timer.timeout.connect(display)
+
+    def start():
+        thread.start()
+        display_timer.start(display_interval())
+
+    def stop():
+        display_timer.stop()
+        thread.stop()
+
+    result = measure(start, stop)
+    print("camera thread: %s; %s; %s" % (result, pipeline.stats.summary(), thread.summary()))
@@ -3,7 +3,12 @@ from PyQt5 import QtCore
 import pynmea2
 import datetime
 import signal
-from sun_pos import getSunPos
+import nmea
+from nmea import NMEAFramer
+from sun_table import getSunAltAz
+
+PORT = "COM14"
+
 class GPSQObject(QtCore.QObject):
     messageSignal = QtCore.pyqtSignal(str)
 
@@ -11,22 +16,16 @@ class GPSQObject(QtCore.QObject):
         super(QtCore.QObject, self).__init__(*args, **kwargs)
 
         self.serial = QSerialPort()
-        port = "COM14"
-        self.serial.setPortName(port)
+        self.serial.setPortName(PORT)
         if self.serial.open(QtCore.QIODevice.ReadWrite):
             self.serial.setDataTerminalReady(True)
             self.serial.setBaudRate(4800)
             self.serial.readyRead.connect(self.on_serial_read)
+        self.framer = NMEAFramer()
 
     def on_serial_read(self, *args):
-        if self.serial.canReadLine():
-            line = self.serial.readLine()
-            try:
-                decoded = bytes(line).decode()
-            except UnicodeDecodeError:
-                pass
-            else:
-                self.messageSignal.emit(decoded)
+        for line in self.framer.feed(self.serial.readAll().data()):
+            self.messageSignal.emit(line)
 
 
     
@@ -42,13 +41,13 @@ class Tui(QtCore.QObject):
 
     def on_serial_read(self, data):
         try:
-            msg = pynmea2.parse(data)
+            msg = nmea.parse(data)
         except pynmea2.ParseError:
             print("failed to parse")
         else:
-            if (msg.sentence_type == 'RMC'):
-                result = getSunPos(msg.latitude, msg.longitude, msg.datetime)
-                print(msg.latitude, msg.longitude, msg.datetime, result.alt.degree, result.az.degree)
+            if msg.sentence_type == 'RMC' and msg.datetime is not None:
+                alt, az = getSunAltAz(msg.latitude, msg.longitude, msg.datetime)
+                print(msg.latitude, msg.longitude, msg.datetime, alt, az)
 
 if __name__ == "__main__":
     import sys
@@ -0,0 +1,140 @@
+import datetime
+import time
+
+from PyQt5 import QtCore
+from PyQt5.QtSerialPort import QSerialPort
+import pynmea2
+
+import nmea
+from nmea import NMEAFramer
+from sun_table import getSunAltAz
+
+# Print a latency summary every this many fixes.
+REPORT_EVERY = 60
+
+
+class GPSFix:
+    """A parsed RMC fix plus the sun position, with perf_counter timestamps
+    for each stage so the receiver can work out where time went.
+
+    backlog is how many complete lines were drained in the read that
+    produced this fix, and age how old (in seconds) the fix's own timestamp
+    was when it was parsed.
+    """
+    __slots__ = ('latitude', 'longitude', 'datetime', 'alt', 'az',
+                 't_read', 't_parsed', 't_solved', 'backlog', 'age')
+
+    def __init__(self, latitude, longitude, datetime, alt, az, t_read, t_parsed, t_solved,
+                 backlog=1, age=0.0):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.datetime = datetime
+        self.alt = alt
+        self.az = az
+        self.t_read = t_read
+        self.t_parsed = t_parsed
+        self.t_solved = t_solved
+        self.backlog = backlog
+        self.age = age
+
+
+class GPSLatency:
+    """Mean/max per-stage latency over the fixes seen so far."""
+    STAGES = ('parse', 'sun', 'deliver')
+
+    def __init__(self):
+        self.count = 0
+        self.total = dict.fromkeys(self.STAGES, 0.0)
+        self.worst = dict.fromkeys(self.STAGES, 0.0)
+        self.max_backlog = 0
+        self.age_total = 0.0
+        self.age_worst = 0.0
+
+    def add(self, fix, t_delivered=None):
+        if t_delivered is None:
+            t_delivered = time.perf_counter()
+        self.count += 1
+        for stage, elapsed in zip(self.STAGES, (fix.t_parsed - fix.t_read,
+                                                fix.t_solved - fix.t_parsed,
+                                                t_delivered - fix.t_solved)):
+            self.total[stage] += elapsed
+            self.worst[stage] = max(self.worst[stage], elapsed)
+        self.max_backlog = max(self.max_backlog, fix.backlog)
+        self.age_total += fix.age
+        self.age_worst = max(self.age_worst, fix.age)
+
+    def summary(self):
+        if not self.count:
+            return "no fixes"
+        return "%d fixes, " % self.count + ", ".join(
+            "%s %.2f/%.2f ms" % (stage, self.total[stage] / self.count * 1e3, self.worst[stage] * 1e3)
+            for stage in self.STAGES) + ", fix age %.2f/%.2f s (mean/max), backlog max %d" % (
+            self.age_total / self.count, self.age_worst, self.max_backlog)
+
+
+class GPSWorker(QtCore.QObject):
+    """Reads NMEA from a serial port and computes the sun position, all in
+    whatever thread the object lives in; results arrive as fixSignal."""
+    fixSignal = QtCore.pyqtSignal(object)
+
+    def __init__(self, port, baud_rate=4800):
+        super(GPSWorker, self).__init__()
+        self.port = port
+        self.baud_rate = baud_rate
+        self.serial = None
+        self.framer = NMEAFramer()
+
+    @QtCore.pyqtSlot()
+    def start(self):
+        # Created here rather than in __init__ so the port belongs to the
+        # worker thread.
+        self.serial = QSerialPort(self)
+        self.serial.setPortName(self.port)
+        if self.serial.open(QtCore.QIODevice.ReadWrite):
+            self.serial.setDataTerminalReady(True)
+            self.serial.setBaudRate(self.baud_rate)
+            self.serial.readyRead.connect(self.on_serial_read)
+        else:
+            print("Failed to open GPS serial port", self.port)
+
+    def on_serial_read(self, *args):
+        t_read = time.perf_counter()
+        lines = self.framer.feed(self.serial.readAll().data())
+        for line in lines:
+            self.process_line(line, t_read, self.framer.backlog)
+
+    def process_line(self, line, t_read, backlog=1):
+        try:
+            msg = nmea.parse(line)
+        except pynmea2.ParseError:
+            print("failed to parse")
+            return
+        if msg.sentence_type != 'RMC' or msg.datetime is None:
+            return
+        if msg.latitude == 0 and msg.longitude == 0:
+            return
+        t_parsed = time.perf_counter()
+        fix_time = msg.datetime
+        if fix_time.tzinfo is None:
+            fix_time = fix_time.replace(tzinfo=datetime.timezone.utc)
+        age = time.time() - fix_time.timestamp()
+        alt, az = getSunAltAz(msg.latitude, msg.longitude, msg.datetime)
+        self.fixSignal.emit(GPSFix(msg.latitude, msg.longitude, msg.datetime, alt, az,
+                                   t_read, t_parsed, time.perf_counter(), backlog, age))
+
+
+def start_gps_thread(port, baud_rate=4800):
+    """Start a GPSWorker on its own QThread, stopped when the app quits.
+
+    Returns (thread, worker); connect to worker.fixSignal for results.
+    """
+    thread = QtCore.QThread()
+    worker = GPSWorker(port, baud_rate)
+    worker.moveToThread(thread)
+    thread.started.connect(worker.start)
+    app = QtCore.QCoreApplication.instance()
+    if app is not None:
+        app.aboutToQuit.connect(thread.quit)
+        app.aboutToQuit.connect(thread.wait)
+    thread.start()
+    return thread, worker
@@ -0,0 +1,348 @@
+# Grbl 1.1 serial protocol: splitting the response stream into lines and
+# turning each line into a small typed record.
+import time
+
+# Realtime command bytes (grbl/config.h).  Grbl acts on these as soon as they
+# arrive, without a newline and without an 'ok'.
+CMD_RESET = b'\x18'
+CMD_STATUS_REPORT = b'?'
+CMD_CYCLE_START = b'~'
+CMD_FEED_HOLD = b'!'
+CMD_SAFETY_DOOR = b'\x84'
+CMD_JOG_CANCEL = b'\x85'
+CMD_FEED_OVR_RESET = b'\x90'
+CMD_FEED_OVR_COARSE_PLUS = b'\x91'
+CMD_FEED_OVR_COARSE_MINUS = b'\x92'
+CMD_FEED_OVR_FINE_PLUS = b'\x93'
+CMD_FEED_OVR_FINE_MINUS = b'\x94'
+CMD_RAPID_OVR_RESET = b'\x95'
+CMD_RAPID_OVR_MEDIUM = b'\x96'
+CMD_RAPID_OVR_LOW = b'\x97'
+
+
+class Ok:
+    __slots__ = ()
+
+    def __repr__(self):
+        return "<Ok>"
+
+
+OK = Ok()
+
+
+class Error:
+    __slots__ = ('code',)
+
+    def __init__(self, code):
+        self.code = code
+
+    def __repr__(self):
+        return "<Error %s>" % self.code
+
+
+class Alarm:
+    __slots__ = ('code',)
+
+    def __init__(self, code):
+        self.code = code
+
+    def __repr__(self):
+        return "<Alarm %s>" % self.code
+
+
+class Message:
+    """A bracketed feedback line: [MSG:...], [GC:...], [PRB:...], ..."""
+    __slots__ = ('kind', 'text')
+
+    def __init__(self, kind, text):
+        self.kind = kind
+        self.text = text
+
+    def __repr__(self):
+        return "<Message %s:%s>" % (self.kind, self.text)
+
+
+class Setting:
+    """A $n=value line from a $$ settings dump."""
+    __slots__ = ('number', 'value')
+
+    def __init__(self, number, value):
+        self.number = number
+        self.value = value
+
+    def __repr__(self):
+        return "<Setting $%d=%s>" % (self.number, self.value)
+
+
+class Welcome:
+    __slots__ = ('version',)
+
+    def __init__(self, version):
+        self.version = version
+
+    def __repr__(self):
+        return "<Welcome %s>" % self.version
+
+
+class Other:
+    __slots__ = ('text',)
+
+    def __init__(self, text):
+        self.text = text
+
+    def __repr__(self):
+        return "<Other %r>" % self.text
+
+
+class StatusReport:
+    """A <...> realtime status report.
+
+    Positions are tuples of floats.  Grbl sends either MPos or WPos, and WCO
+    only every so often; GrblParser fills in the other one from the last WCO
+    it saw.  Fields Grbl didn't report are None.
+
+    Only the state and positions are decoded up front; the rest (feed,
+    buffers, pins, overrides) are kept as text and decoded when read, as
+    nothing on the polling path looks at them.  A garbled one reads as None.
+    """
+    __slots__ = ('state', 'substate', 'mpos', 'wpos', 'wco', 'received', 'fields')
+
+    def __init__(self):
+        self.state = None
+        self.substate = None
+        self.mpos = None
+        self.wpos = None
+        self.wco = None
+        self.received = None
+        # Undecoded fields, name: text.
+        self.fields = {}
+
+    def _field(self, name, index, convert):
+        value = self.fields.get(name)
+        if value is None:
+            return None
+        try:
+            return convert(value.split(',')[index])
+        except (ValueError, IndexError):
+            return None
+
+    @property
+    def feed(self):
+        if 'FS' in self.fields:
+            return self._field('FS', 0, float)
+        return self._field('F', 0, float)
+
+    @property
+    def spindle(self):
+        return self._field('FS', 1, float)
+
+    @property
+    def planner_blocks(self):
+        return self._field('Bf', 0, int)
+
+    @property
+    def rx_bytes(self):
+        return self._field('Bf', 1, int)
+
+    @property
+    def pins(self):
+        return self.fields.get('Pn', '')
+
+    @property
+    def line_number(self):
+        return self._field('Ln', 0, int)
+
+    @property
+    def overrides(self):
+        value = self.fields.get('Ov')
+        if value is None:
+            return None
+        try:
+            return tuple(int(v) for v in value.split(','))
+        except ValueError:
+            return None
+
+    def __repr__(self):
+        return "<StatusReport %s mpos=%s wpos=%s>" % (self.state, self.mpos, self.wpos)
+
+
+def _floats(text):
+    return tuple(map(float, text.split(',')))
+
+
+def parse_status(line):
+    report = StatusReport()
+    fields = line[1:-1].split('|')
+    state, _, substate = fields[0].partition(':')
+    report.state = state
+    report.substate = int(substate) if substate else None
+    for field in fields[1:]:
+        name, _, value = field.partition(':')
+        if name == 'MPos':
+            report.mpos = _floats(value)
+        elif name == 'WPos':
+            report.wpos = _floats(value)
+        elif name == 'WCO':
+            report.wco = _floats(value)
+        else:
+            report.fields[name] = value
+    return report
+
+
+def parse_line(line):
+    """Turn one response line (without line ending) into a record; garbled
+    lines come back as Other."""
+    if line == 'ok':
+        return OK
+    first = line[:1]
+    if first == '<' and line.endswith('>'):
+        try:
+            return parse_status(line)
+        except (ValueError, IndexError):
+            return Other(line)
+    if first == '[' and line.endswith(']'):
+        kind, _, text = line[1:-1].partition(':')
+        return Message(kind, text)
+    if line.startswith('error:'):
+        return Error(int(line[6:]) if line[6:].isdigit() else line[6:])
+    if line.startswith('ALARM:'):
+        return Alarm(int(line[6:]) if line[6:].isdigit() else line[6:])
+    if first == '$':
+        number, sep, value = line[1:].partition('=')
+        if sep and number.isdigit():
+            return Setting(int(number), value)
+    if line.startswith('Grbl '):
+        return Welcome(line[5:].split(' ', 1)[0])
+    return Other(line)
+
+
+class LineBuffer:
+    """Reassembles lines from arbitrarily split chunks of a text stream."""
+
+    def __init__(self):
+        self.partial = ''
+
+    def feed(self, data):
+        if isinstance(data, (bytes, bytearray)):
+            data = data.decode('ascii', 'replace')
+        lines = (self.partial + data).split('\n')
+        self.partial = lines.pop()
+        return [line.rstrip('\r') for line in lines if line.strip('\r')]
+
+
+class GrblParser:
+    """Stateful parser: remembers the last work coordinate offset so every
+    status report has both machine and work positions."""
+
+    def __init__(self):
+        self.lines = LineBuffer()
+        self.wco = None
+        self.status = None
+
+    def parse_line(self, line):
+        record = parse_line(line)
+        if isinstance(record, StatusReport):
+            record.received = time.monotonic()
+            if record.wco is not None:
+                self.wco = record.wco
+            elif self.wco is not None:
+                record.wco = self.wco
+            if record.wco is not None:
+                if record.wpos is None and record.mpos is not None:
+                    record.wpos = tuple(m - o for m, o in zip(record.mpos, record.wco))
+                elif record.mpos is None and record.wpos is not None:
+                    record.mpos = tuple(w + o for w, o in zip(record.wpos, record.wco))
+            self.status = record
+        return record
+
+    def feed(self, data):
+        """Parse a chunk of the response stream, returning (line, record) pairs
+        for every line completed by it."""
+        return [(line, self.parse_line(line)) for line in self.lines.feed(data)]
+
+
+def _split_status(line):
+    # The hand-rolled parsing StateMachine.gotLine in full_app.py used to do.
+    s = line[1:-1].split("|")
+    state = s[0]
+    mpos = s[1]
+    ps = mpos.split(":")
+    xpos, ypos, zpos = ps[1].split(",")
+    sw = s[2]
+    return state, xpos, ypos
+
+
+def _split_status_floats(line):
+    # The same, with the numbers the tracking and jog code need.
+    state, xpos, ypos = _split_status(line)
+    return state, float(xpos), float(ypos)
+
+
+def _fuzz_line_buffer(rounds=2000, seed=1):
+    """Feed LineBuffer randomly fragmented and coalesced response streams,
+    as the ESP32's WebSocket frames arrive, and check every line comes out
+    whole, once and in order."""
+    import random
+    rng = random.Random(seed)
+    samples = ["ok", "error:9", "ALARM:3", "[MSG:'$H'|'$X' to unlock]", "$110=500.000",
+               "Grbl 1.1h ['$' for help]",
+               "<Idle|MPos:-1.000,-1.000,0.000|Bf:15,128|FS:0,0|WCO:-1.000,-1.000,0.000>"]
+    for i in range(rounds):
+        lines = [rng.choice(samples) for j in range(rng.randint(1, 20))]
+        stream = b''.join(line.encode('ascii') + rng.choice((b'\r\n', b'\n')) for line in lines)
+        cuts = sorted(rng.randint(0, len(stream)) for j in range(rng.randint(0, 12)))
+        buffer = LineBuffer()
+        got = []
+        for start, end in zip([0] + cuts, cuts + [len(stream)]):
+            got.extend(buffer.feed(stream[start:end]))
+        assert got == lines, (stream, cuts, got)
+        assert buffer.partial == ''
+
+
+if __name__ == '__main__':
+    _fuzz_line_buffer()
+    print("line reassembly fuzz: ok")
+    # A corrupted byte in a status report mustn't raise out of a Qt slot.
+    for garbled in ("<Idle|MPos:-1.0#0,-1.000,0.000|FS:0,0>", "<Idle:x|MPos:0,0,0>"):
+        assert isinstance(GrblParser().parse_line(garbled), Other), garbled
+    # Garbled fields decoded on demand read as None.
+    report = parse_line("<Run|MPos:1,2,3|FS:5|Bf:1x,2|Ov:100,1o0,100>")
+    assert (report.feed, report.spindle, report.planner_blocks, report.rx_bytes, report.overrides) == \
+        (5.0, None, None, 2, None)
+    report = parse_line("<Jog|WPos:1,2,3|Bf:15,128|FS:500,0|Pn:XY|Ln:7|Ov:100,50,100>")
+    assert (report.feed, report.spindle, report.planner_blocks, report.rx_bytes, report.pins,
+            report.line_number, report.overrides, report.wpos) == \
+        (500.0, 0.0, 15, 128, 'XY', 7, (100, 50, 100), (1.0, 2.0, 3.0))
+    assert parse_line("<Idle|MPos:0,0,0|F:250>").feed == 250.0
+
+    line = "<Jog|MPos:-95.125,-40.500,0.000|Bf:14,112|FS:500,0|Pn:X|WCO:-2.000,1.000,0.000>"
+    per_day = 20 * 86400  # status reports a day when polling at 20 Hz
+    n = 100000
+
+    t0 = time.perf_counter()
+    for i in range(n):
+        _split_status(line)
+    split = (time.perf_counter() - t0) / n
+
+    t0 = time.perf_counter()
+    for i in range(n):
+        _split_status_floats(line)
+    split_floats = (time.perf_counter() - t0) / n
+
+    parser = GrblParser()
+    t0 = time.perf_counter()
+    for i in range(n):
+        parser.parse_line(line)
+    typed = (time.perf_counter() - t0) / n
+
+    # Whole stream path: chunks off the serial port through the line buffer.
+    chunk = (line + "\r\nok\r\n") * 10
+    t0 = time.perf_counter()
+    for i in range(n // 10):
+        parser.feed(chunk)
+    streamed = (time.perf_counter() - t0) / n
+
+    for name, cost in (("split", split), ("split+float", split_floats), ("typed", typed),
+                       ("typed+stream", streamed)):
+        print("%-13s %6.2f us/status, %5.1f s CPU per day at 20 Hz" % (name, cost * 1e6, cost * per_day))
+    print(parser.status)
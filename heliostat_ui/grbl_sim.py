@@ -0,0 +1,794 @@
+# A simulated Grbl 1.1 controller, so the host side can be run and measured
+# without a board.
+#
+# GrblSim is the controller itself: feed it bytes with receive(), call
+# update() as time passes and it writes responses through write(bytes).  It
+# models the serial RX buffer, the planner queue, acceleration-limited motion
+# (stepped at ACCELERATION_TICKS_PER_SECOND like the real stepper), homing,
+# jogging, feed hold, overrides and status reports, using the limits from
+# grbl/config.h and the DEFAULTS_GENERIC settings it selects.  Simplification:
+# speed is only carried through junctions where the path continues in a
+# straight line; every corner comes to a stop (no junction deviation).
+#
+# Run as a script it serves the simulator on a pty (for QSerialPort clients
+# like QGrblTerminal and QRAMPSObject) and/or over HTTP + WebSocket the way
+# Grbl_ESP32 does (for GRBLESP32Client):
+#
+#   python grbl_sim.py --pty /tmp/grblserial
+#   python grbl_sim.py --http-port 8080 --ws-port 8081
+import argparse
+import collections
+import math
+import os
+import re
+import sys
+import time
+import tty
+import urllib.parse
+
+from PyQt5 import QtCore, QtNetwork, QtWebSockets
+
+# From grbl/config.h (and the serial.h/planner.h/protocol.h defaults it
+# doesn't override).
+BAUD_RATE = 115200
+RX_BUFFER_SIZE = 128
+BLOCK_BUFFER_SIZE = 16
+LINE_BUFFER_SIZE = 80
+ACCELERATION_TICKS_PER_SECOND = 100
+N_HOMING_LOCATE_CYCLE = 1
+HOMING_CYCLE_0 = (0, 1)
+REPORT_OVR_REFRESH_BUSY_COUNT = 20
+REPORT_OVR_REFRESH_IDLE_COUNT = 10
+REPORT_WCO_REFRESH_BUSY_COUNT = 30
+REPORT_WCO_REFRESH_IDLE_COUNT = 10
+MIN_FEED_RATE_OVERRIDE = 10
+MAX_FEED_RATE_OVERRIDE = 200
+FEED_OVERRIDE_COARSE_INCREMENT = 10
+FEED_OVERRIDE_FINE_INCREMENT = 1
+RAPID_OVERRIDE_MEDIUM = 50
+RAPID_OVERRIDE_LOW = 25
+MIN_SPINDLE_SPEED_OVERRIDE = 10
+MAX_SPINDLE_SPEED_OVERRIDE = 200
+
+CMD_RESET = 0x18
+CMD_STATUS_REPORT = ord('?')
+CMD_CYCLE_START = ord('~')
+CMD_FEED_HOLD = ord('!')
+CMD_JOG_CANCEL = 0x85
+CMD_FEED_OVR_RESET = 0x90
+CMD_FEED_OVR_COARSE_PLUS = 0x91
+CMD_FEED_OVR_COARSE_MINUS = 0x92
+CMD_FEED_OVR_FINE_PLUS = 0x93
+CMD_FEED_OVR_FINE_MINUS = 0x94
+CMD_RAPID_OVR_RESET = 0x95
+CMD_RAPID_OVR_MEDIUM = 0x96
+CMD_RAPID_OVR_LOW = 0x97
+CMD_SPINDLE_OVR_RESET = 0x99
+CMD_SPINDLE_OVR_COARSE_PLUS = 0x9A
+CMD_SPINDLE_OVR_COARSE_MINUS = 0x9B
+CMD_SPINDLE_OVR_FINE_PLUS = 0x9C
+CMD_SPINDLE_OVR_FINE_MINUS = 0x9D
+
+VERSION = "1.1h"
+# How often (ms) the server advances the simulation and moves bytes.
+TICK_INTERVAL = 1
+AXES = 'XYZ'
+
+# defaults.h DEFAULTS_GENERIC, except homing is enabled ($22=1) because both
+# heliostats home on startup.
+DEFAULT_SETTINGS = {
+    0: 10, 1: 25, 2: 0, 3: 0, 4: 0, 5: 0, 6: 0,
+    10: 1, 11: 0.010, 12: 0.002, 13: 0,
+    20: 0, 21: 0, 22: 1, 23: 0, 24: 25.0, 25: 500.0, 26: 250, 27: 1.0,
+    30: 1000.0, 31: 0.0, 32: 0,
+    100: 250.0, 101: 250.0, 102: 250.0,
+    110: 500.0, 111: 500.0, 112: 500.0,
+    120: 10.0, 121: 10.0, 122: 10.0,
+    130: 200.0, 131: 200.0, 132: 200.0,
+}
+INTEGER_SETTINGS = (0, 1, 2, 3, 4, 5, 6, 10, 13, 20, 21, 22, 23, 26, 32)
+
+# Status codes (error:N) from report.h.
+STATUS_EXPECTED_COMMAND_LETTER = 1
+STATUS_BAD_NUMBER_FORMAT = 2
+STATUS_INVALID_STATEMENT = 3
+STATUS_SETTING_DISABLED = 5
+STATUS_IDLE_ERROR = 8
+STATUS_SYSTEM_GC_LOCK = 9
+STATUS_OVERFLOW = 11
+STATUS_GCODE_UNSUPPORTED_COMMAND = 20
+STATUS_GCODE_UNDEFINED_FEED_RATE = 22
+STATUS_GCODE_NO_AXIS_WORDS = 26
+
+ALARM_ABORT_CYCLE = 3
+
+_WORD = re.compile(r'([A-Z])([-+]?(?:\d+\.?\d*|\.\d+))')
+
+
+class Block:
+    """One planned move: a straight line from start to target."""
+    __slots__ = ('start', 'target', 'length', 'unit', 'rate', 'accel', 'rapid', 'jog', 'done')
+
+    def __init__(self, start, target, rate, settings, rapid=False, jog=False):
+        self.start = start
+        self.target = target
+        delta = [t - s for s, t in zip(start, target)]
+        self.length = math.sqrt(sum(d * d for d in delta))
+        self.unit = [d / self.length for d in delta]
+        # Limit speed and acceleration so no single axis exceeds its own.
+        self.rate = rate
+        self.accel = float('inf')
+        for i, u in enumerate(self.unit):
+            if u:
+                self.rate = min(self.rate, settings[110 + i] / 60.0 / abs(u))
+                self.accel = min(self.accel, settings[120 + i] / abs(u))
+        self.rapid = rapid
+        self.jog = jog
+        self.done = 0.0
+
+    def position(self):
+        return [s + u * self.done for s, u in zip(self.start, self.unit)]
+
+    def continues(self, other):
+        """Whether other carries on in the same straight line."""
+        return self.jog == other.jog and sum(a * b for a, b in zip(self.unit, other.unit)) > 1 - 1e-9
+
+
+class GrblSim:
+    def __init__(self, write, settings=None, home_offset=(40.0, 25.0, 0.0),
+                 line_time=0.001, clock=time.monotonic):
+        # write(bytes) sends Grbl's output back to the host.
+        self.write = write
+        self.settings = dict(DEFAULT_SETTINGS)
+        if settings:
+            self.settings.update(settings)
+        # Where the homing switches are, in power-on machine coordinates.
+        self.switch = list(home_offset)
+        # Time to parse and plan one line.
+        self.line_time = line_time
+        self.clock = clock
+        self.time = clock()
+        self.pos = [0.0, 0.0, 0.0]
+        self.g54 = [0.0, 0.0, 0.0]
+        self.alarm = False
+        self.overflows = 0
+        self.lines = 0
+        self.reset(power_on=True)
+
+    # Host interface.
+
+    def receive(self, data):
+        """Bytes arriving on the serial line.  Realtime commands are acted on
+        straight away, like Grbl's serial interrupt does; everything else goes
+        into the RX buffer, or is lost if it is full."""
+        for c in bytes(data):
+            if c == CMD_STATUS_REPORT or c == CMD_FEED_HOLD or c == CMD_CYCLE_START or \
+                    c == CMD_RESET or c >= 0x80:
+                self.realtime(c)
+            elif len(self.rx) < RX_BUFFER_SIZE - 1:
+                self.rx.append(c)
+            else:
+                self.overflows += 1
+
+    def realtime(self, c):
+        if c == CMD_RESET:
+            self.soft_reset()
+        elif c == CMD_STATUS_REPORT:
+            self.send(self.status_report())
+        elif c == CMD_FEED_HOLD:
+            if self.planner and not self.homing:
+                self.holding = True
+                # A feed hold during a jog cancels it.
+                self.cancel_jog = self.planner[0].jog
+        elif c == CMD_CYCLE_START:
+            if self.holding and self.speed == 0:
+                self.holding = False
+        elif c == CMD_JOG_CANCEL:
+            if self.planner and self.planner[0].jog:
+                self.holding = True
+                self.cancel_jog = True
+        elif CMD_FEED_OVR_RESET <= c <= CMD_FEED_OVR_FINE_MINUS:
+            self.feed_override = {
+                CMD_FEED_OVR_RESET: 100,
+                CMD_FEED_OVR_COARSE_PLUS: self.feed_override + FEED_OVERRIDE_COARSE_INCREMENT,
+                CMD_FEED_OVR_COARSE_MINUS: self.feed_override - FEED_OVERRIDE_COARSE_INCREMENT,
+                CMD_FEED_OVR_FINE_PLUS: self.feed_override + FEED_OVERRIDE_FINE_INCREMENT,
+                CMD_FEED_OVR_FINE_MINUS: self.feed_override - FEED_OVERRIDE_FINE_INCREMENT,
+            }[c]
+            self.feed_override = max(MIN_FEED_RATE_OVERRIDE, min(MAX_FEED_RATE_OVERRIDE, self.feed_override))
+            self.report_ovr_counter = 0
+        elif CMD_RAPID_OVR_RESET <= c <= CMD_RAPID_OVR_LOW:
+            self.rapid_override = {CMD_RAPID_OVR_RESET: 100, CMD_RAPID_OVR_MEDIUM: RAPID_OVERRIDE_MEDIUM,
+                                   CMD_RAPID_OVR_LOW: RAPID_OVERRIDE_LOW}[c]
+            self.report_ovr_counter = 0
+        elif CMD_SPINDLE_OVR_RESET <= c <= CMD_SPINDLE_OVR_FINE_MINUS:
+            step = {CMD_SPINDLE_OVR_RESET: 100 - self.spindle_override, CMD_SPINDLE_OVR_COARSE_PLUS: 10,
+                    CMD_SPINDLE_OVR_COARSE_MINUS: -10, CMD_SPINDLE_OVR_FINE_PLUS: 1,
+                    CMD_SPINDLE_OVR_FINE_MINUS: -1}[c]
+            self.spindle_override = max(MIN_SPINDLE_SPEED_OVERRIDE,
+                                        min(MAX_SPINDLE_SPEED_OVERRIDE, self.spindle_override + step))
+            self.report_ovr_counter = 0
+
+    def update(self, now=None):
+        """Run the controller up to now (a clock() time)."""
+        if now is None:
+            now = self.clock()
+        tick = 1.0 / ACCELERATION_TICKS_PER_SECOND
+        while self.time < now:
+            dt = min(tick, now - self.time)
+            self.time += dt
+            self.process_lines(dt)
+            self.step_motion(dt)
+
+    # Controller.
+
+    def send(self, line):
+        self.write((line + '\r\n').encode('ascii'))
+
+    def reset(self, power_on=False):
+        self.rx = bytearray()
+        self.planner = collections.deque()
+        self.plan_pos = list(self.pos)
+        self.speed = 0.0
+        self.holding = False
+        self.cancel_jog = False
+        self.homing = False
+        self.waiting = None
+        self.then = None
+        self.blocked = None
+        self.next_line = self.time
+        self.g92 = [0.0, 0.0, 0.0]
+        self.absolute = True
+        self.inches = False
+        self.motion = 0
+        self.feed = 0.0
+        self.spindle = 0.0
+        self.feed_override = 100
+        self.rapid_override = 100
+        self.spindle_override = 100
+        self.report_wco_counter = 0
+        self.report_ovr_counter = 0
+        if power_on and self.settings[22]:
+            # HOMING_INIT_LOCK: start in alarm until homed or unlocked.
+            self.alarm = True
+        self.send("")
+        self.send("Grbl %s ['$' for help]" % VERSION)
+        if self.alarm:
+            self.send("[MSG:'$H'|'$X' to unlock]")
+
+    def soft_reset(self):
+        if self.speed > 0 or self.homing:
+            # Stopping dead loses steps, so the position can't be trusted.
+            self.alarm = True
+            self.send("ALARM:%d" % ALARM_ABORT_CYCLE)
+        self.reset()
+
+    def idle(self):
+        return not self.planner
+
+    def state(self):
+        if self.alarm:
+            return 'Alarm'
+        if self.homing:
+            return 'Home'
+        if self.holding and not self.cancel_jog:
+            return 'Hold:1' if self.speed > 0 else 'Hold:0'
+        if self.planner:
+            return 'Jog' if self.planner[0].jog else 'Run'
+        return 'Idle'
+
+    def wco(self):
+        return [a + b for a, b in zip(self.g54, self.g92)]
+
+    def status_report(self):
+        mask = self.settings[10]
+        fields = [self.state()]
+        if mask & 1:
+            fields.append("MPos:%s" % ",".join("%.3f" % v for v in self.pos))
+        else:
+            fields.append("WPos:%s" % ",".join("%.3f" % (v - o) for v, o in zip(self.pos, self.wco())))
+        if mask & 2:
+            fields.append("Bf:%d,%d" % (BLOCK_BUFFER_SIZE - 1 - len(self.planner), RX_BUFFER_SIZE - len(self.rx)))
+        fields.append("FS:%d,%d" % (round(self.speed * 60), self.spindle))
+        busy = not self.idle() or self.homing
+        if self.report_ovr_counter > 0:
+            self.report_ovr_counter -= 1
+        else:
+            fields.append("Ov:%d,%d,%d" % (self.feed_override, self.rapid_override, self.spindle_override))
+            self.report_ovr_counter = REPORT_OVR_REFRESH_BUSY_COUNT if busy else REPORT_OVR_REFRESH_IDLE_COUNT
+        if self.report_wco_counter > 0:
+            self.report_wco_counter -= 1
+        else:
+            fields.append("WCO:%s" % ",".join("%.3f" % v for v in self.wco()))
+            self.report_wco_counter = REPORT_WCO_REFRESH_BUSY_COUNT if busy else REPORT_WCO_REFRESH_IDLE_COUNT
+            if self.report_ovr_counter == 0:
+                self.report_ovr_counter = 1
+        return "<%s>" % "|".join(fields)
+
+    def process_lines(self, dt):
+        start = max(self.next_line, self.time - dt)
+        while start <= self.time:
+            if self.waiting is not None:
+                if not self.waiting():
+                    return
+                self.waiting = None
+                then, self.then = self.then, None
+                then()
+                continue
+            if self.blocked is not None:
+                if len(self.planner) >= BLOCK_BUFFER_SIZE - 1:
+                    return
+                self.planner.append(self.blocked)
+                self.blocked = None
+                self.send("ok")
+                continue
+            end = self.rx.find(b'\n')
+            cr = self.rx.find(b'\r')
+            if end < 0 or 0 <= cr < end:
+                end = cr
+            if end < 0:
+                return
+            line = self.rx[:end].decode('ascii', 'replace')
+            del self.rx[:end + 1]
+            self.lines += 1
+            self.execute(line)
+            start += self.line_time
+            self.next_line = start
+
+    def execute(self, line):
+        if len(line) >= LINE_BUFFER_SIZE:
+            return self.error(STATUS_OVERFLOW)
+        # Grbl drops whitespace and comments and upper-cases the rest.
+        line = re.sub(r'\([^)]*\)|;.*', '', line)
+        line = ''.join(line.split()).upper()
+        if not line:
+            return self.send("ok")
+        if line[0] == '$':
+            return self.system_command(line)
+        if self.alarm:
+            return self.error(STATUS_SYSTEM_GC_LOCK)
+        self.gcode(line)
+
+    def error(self, code):
+        self.send("error:%d" % code)
+
+    def sync(self, then):
+        """Run then() once every planned move has finished, as Grbl does for
+        homing, dwells and coordinate changes."""
+        self.waiting = self.idle
+        self.then = then
+
+    def system_command(self, line):
+        state = self.state()
+        if line == '$':
+            self.send("[HLP:$$ $# $G $I $N $x=val $Nx=line $J=line $SLP $C $X $H ~ ! ? ctrl-x]")
+        elif line.startswith('$J='):
+            if state not in ('Idle', 'Jog'):
+                return self.error(STATUS_IDLE_ERROR)
+            return self.gcode(line[3:], jog=True)
+        elif state not in ('Idle', 'Alarm'):
+            return self.error(STATUS_IDLE_ERROR)
+        elif line == '$$':
+            for number, value in sorted(self.settings.items()):
+                if number in INTEGER_SETTINGS:
+                    self.send("$%d=%d" % (number, value))
+                else:
+                    self.send("$%d=%.3f" % (number, value))
+        elif line == '$G':
+            self.send("[GC:G%d G54 G17 G%d G%d G94 M5 M9 T0 F%d S%d]" % (
+                self.motion, 20 if self.inches else 21, 90 if self.absolute else 91, self.feed * 60,
+                self.spindle))
+        elif line == '$I':
+            self.send("[VER:%s.20190830:]" % VERSION)
+            self.send("[OPT:V,%d,%d]" % (BLOCK_BUFFER_SIZE - 1, RX_BUFFER_SIZE))
+        elif line == '$#':
+            self.send("[G54:%s]" % ",".join("%.3f" % v for v in self.g54))
+            self.send("[G92:%s]" % ",".join("%.3f" % v for v in self.g92))
+        elif line == '$X':
+            if self.alarm:
+                self.alarm = False
+                self.send("[MSG:Caution: Unlocked]")
+        elif line == '$H' or (len(line) == 3 and line[:2] == '$H' and line[2] in AXES):
+            # $HX/$HY (single axis homing) as Grbl_ESP32 accepts them.
+            if not self.settings[22]:
+                return self.error(STATUS_SETTING_DISABLED)
+            axes = HOMING_CYCLE_0 if line == '$H' else (AXES.index(line[2]),)
+            return self.home(axes)
+        else:
+            number, sep, value = line[1:].partition('=')
+            if not sep or not number.isdigit() or int(number) not in self.settings:
+                return self.error(STATUS_INVALID_STATEMENT)
+            try:
+                value = float(value)
+            except ValueError:
+                return self.error(STATUS_BAD_NUMBER_FORMAT)
+            number = int(number)
+            self.settings[number] = int(value) if number in INTEGER_SETTINGS else value
+        self.send("ok")
+
+    def home(self, axes):
+        # Seek the switches, pull off, approach again slowly, pull off.
+        seek = self.settings[25] / 60.0
+        locate = self.settings[24] / 60.0
+        pulloff = self.settings[27]
+        self.homing = True
+
+        def move(distances, rate):
+            target = list(self.plan_pos)
+            for axis, distance in distances.items():
+                target[axis] += distance
+            if target != self.plan_pos:
+                self.planner.append(Block(self.plan_pos, target, rate, self.settings))
+                self.plan_pos = target
+
+        def start():
+            move(dict((axis, self.switch[axis] - self.pos[axis]) for axis in axes), seek)
+            for i in range(N_HOMING_LOCATE_CYCLE):
+                move(dict((axis, -pulloff) for axis in axes), seek)
+                move(dict((axis, pulloff) for axis in axes), locate)
+            move(dict((axis, -pulloff) for axis in axes), seek)
+            self.sync(done)
+
+        def done():
+            for axis in axes:
+                self.pos[axis] = -pulloff
+                self.switch[axis] = 0.0
+            self.plan_pos = list(self.pos)
+            self.homing = False
+            self.alarm = False
+            self.send("ok")
+
+        self.sync(start)
+
+    def gcode(self, line, jog=False):
+        words = []
+        i = 0
+        while i < len(line):
+            match = _WORD.match(line, i)
+            if match is None:
+                if not line[i].isalpha():
+                    return self.error(STATUS_EXPECTED_COMMAND_LETTER)
+                return self.error(STATUS_BAD_NUMBER_FORMAT)
+            words.append((match.group(1), float(match.group(2))))
+            i = match.end()
+
+        motion = self.motion
+        absolute = self.absolute
+        inches = self.inches
+        feed = None
+        axes = {}
+        dwell = None
+        set_offset = None
+        l_word = p_word = None
+        for letter, value in words:
+            if letter == 'G':
+                if value in (0, 1):
+                    motion = int(value)
+                elif value == 4:
+                    dwell = True
+                elif value in (10, 92):
+                    set_offset = int(value)
+                elif value in (90, 91):
+                    absolute = value == 90
+                elif value in (20, 21):
+                    inches = value == 20
+                elif value not in (17, 54, 94):
+                    return self.error(STATUS_GCODE_UNSUPPORTED_COMMAND)
+            elif letter == 'M':
+                if value not in (0, 1, 2, 3, 4, 5, 8, 9, 30):
+                    return self.error(STATUS_GCODE_UNSUPPORTED_COMMAND)
+                if value == 5:
+                    self.spindle = 0.0
+            elif letter in AXES:
+                axes[AXES.index(letter)] = value * (25.4 if inches else 1.0)
+            elif letter == 'F':
+                feed = value * (25.4 if inches else 1.0) / 60.0
+            elif letter == 'S':
+                self.spindle = value
+            elif letter == 'P':
+                p_word = value
+            elif letter == 'L':
+                l_word = value
+            elif letter != 'T':
+                return self.error(STATUS_GCODE_UNSUPPORTED_COMMAND)
+
+        if jog:
+            # Jogs don't change the modal state and always need a feed rate.
+            if feed is None:
+                return self.error(STATUS_GCODE_UNDEFINED_FEED_RATE)
+            if not axes:
+                return self.error(STATUS_GCODE_NO_AXIS_WORDS)
+            return self.plan(self.target(axes, absolute), feed, jog=True)
+
+        self.motion = motion
+        self.absolute = absolute
+        self.inches = inches
+        if feed is not None:
+            self.feed = feed
+
+        if dwell:
+            seconds = p_word or 0.0
+
+            def wait():
+                end = self.time + seconds
+                self.waiting = lambda: self.time >= end
+                self.then = lambda: self.send("ok")
+
+            return self.sync(wait)
+        if set_offset is not None:
+            if set_offset == 10 and l_word != 20:
+                return self.error(STATUS_GCODE_UNSUPPORTED_COMMAND)
+
+            def apply():
+                offsets = self.g54 if set_offset == 10 else self.g92
+                other = self.g92 if set_offset == 10 else self.g54
+                for axis, value in axes.items():
+                    offsets[axis] = self.pos[axis] - other[axis] - value
+                self.report_wco_counter = 0
+                self.send("ok")
+
+            return self.sync(apply)
+        if axes:
+            if motion == 1 and not self.feed:
+                return self.error(STATUS_GCODE_UNDEFINED_FEED_RATE)
+            return self.plan(self.target(axes, absolute),
+                             self.feed if motion == 1 else float('inf'), rapid=motion == 0)
+        self.send("ok")
+
+    def target(self, axes, absolute):
+        target = list(self.plan_pos)
+        wco = self.wco()
+        for axis, value in axes.items():
+            target[axis] = value + wco[axis] if absolute else target[axis] + value
+        return target
+
+    def plan(self, target, rate, rapid=False, jog=False):
+        if target == self.plan_pos:
+            return self.send("ok")
+        block = Block(self.plan_pos, target, rate, self.settings, rapid, jog)
+        self.plan_pos = target
+        if len(self.planner) >= BLOCK_BUFFER_SIZE - 1:
+            # Grbl stops reading the RX buffer until a block finishes.
+            self.blocked = block
+            return
+        self.planner.append(block)
+        self.send("ok")
+
+    def exit_speed(self):
+        """Fastest the first block can finish at: full speed into a block
+        that continues straight on, as long as the planner can still stop
+        by the end of its last block."""
+        exit = 0.0
+        for i in range(len(self.planner) - 1, 0, -1):
+            prev, block = self.planner[i - 1], self.planner[i]
+            if prev.continues(block):
+                exit = min(prev.rate, block.rate, math.sqrt(exit * exit + 2 * block.accel * block.length))
+            else:
+                exit = 0.0
+        return exit
+
+    def step_motion(self, dt):
+        if not self.planner:
+            return
+        block = self.planner[0]
+        if self.holding:
+            target = 0.0
+        elif block.jog or self.homing:
+            target = block.rate
+        elif block.rapid:
+            target = block.rate * self.rapid_override / 100.0
+        else:
+            target = block.rate * self.feed_override / 100.0
+        remaining = block.length - block.done
+        exit = 0.0 if self.holding or self.homing else self.exit_speed()
+        speed = self.speed
+        if remaining <= (speed * speed - exit * exit) / (2 * block.accel) or speed > target:
+            speed = max(speed - block.accel * dt, 0.0)
+        elif speed < target:
+            speed = min(speed + block.accel * dt, target)
+        block.done = min(block.length, block.done + (self.speed + speed) / 2 * dt)
+        self.speed = speed
+        self.pos = block.position()
+        if speed == 0:
+            if self.cancel_jog:
+                # Jog cancel: stopped, so throw away the rest of the jog.
+                self.planner.clear()
+                if self.blocked is not None:
+                    self.blocked = None
+                    self.send("ok")
+                self.plan_pos = list(self.pos)
+                self.holding = False
+                self.cancel_jog = False
+            elif not self.holding:
+                # Decelerated to a stop at the end of the block.
+                self.pos = list(block.target)
+                self.planner.popleft()
+        elif block.done >= block.length:
+            # Straight on into the next block.
+            self.pos = list(block.target)
+            self.planner.popleft()
+            if not self.planner:
+                self.speed = 0.0
+
+
+class GrblSimServer(QtCore.QObject):
+    """Runs a GrblSim in real time and connects it to clients over a pty
+    and/or Grbl_ESP32-style HTTP commands plus a WebSocket for output."""
+
+    def __init__(self, baud_rate=BAUD_RATE, **kwargs):
+        super(GrblSimServer, self).__init__()
+        self.byte_time = 10.0 / baud_rate
+        self.master = None
+        self.wire_in = bytearray()
+        self.wire_out = bytearray()
+        self.ws_out = bytearray()
+        self.websockets = []
+        self.http_buffers = {}
+        self.credit_in = 0.0
+        self.credit_out = 0.0
+        self.overflows = 0
+        self.last = time.monotonic()
+        self.sim = GrblSim(self.output, **kwargs)
+        self.timer = QtCore.QTimer(self)
+        self.timer.setTimerType(QtCore.Qt.PreciseTimer)
+        self.timer.timeout.connect(self.tick)
+        self.timer.start(TICK_INTERVAL)
+
+    def output(self, data):
+        if self.master is not None:
+            self.wire_out += data
+        if self.websockets:
+            self.ws_out += data
+
+    def open_pty(self, link=None):
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.path = os.ttyname(self.slave)
+        if link:
+            if os.path.islink(link):
+                os.remove(link)
+            os.symlink(self.path, link)
+        self.notifier = QtCore.QSocketNotifier(self.master, QtCore.QSocketNotifier.Read, self)
+        self.notifier.activated.connect(self.on_pty_read)
+        return self.path
+
+    def on_pty_read(self, *args):
+        self.wire_in += os.read(self.master, 4096)
+
+    def listen(self, http_port=80, ws_port=81, ws_chunk=0):
+        self.client_id = 0
+        self.ws_chunk = ws_chunk
+        self.ws_server = QtWebSockets.QWebSocketServer("grbl_sim", QtWebSockets.QWebSocketServer.NonSecureMode, self)
+        self.ws_server.newConnection.connect(self.on_ws_connection)
+        self.http_server = QtNetwork.QTcpServer(self)
+        self.http_server.newConnection.connect(self.on_http_connection)
+        ok = self.ws_server.listen(QtNetwork.QHostAddress.Any, ws_port)
+        ok = self.http_server.listen(QtNetwork.QHostAddress.Any, http_port) and ok
+        self.ping_timer = QtCore.QTimer(self)
+        self.ping_timer.timeout.connect(self.ping)
+        self.ping_timer.start(10000)
+        return ok
+
+    def on_ws_connection(self):
+        socket = self.ws_server.nextPendingConnection()
+        self.client_id += 1
+        self.websockets.append(socket)
+        socket.disconnected.connect(lambda: self.websockets.remove(socket))
+        socket.sendTextMessage("CURRENT_ID:%d" % self.client_id)
+        socket.sendTextMessage("ACTIVE_ID:%d" % self.client_id)
+
+    def ping(self):
+        for socket in self.websockets:
+            socket.sendTextMessage("PING:%d" % self.client_id)
+
+    def on_http_connection(self):
+        socket = self.http_server.nextPendingConnection()
+        self.http_buffers[socket] = b''
+        socket.readyRead.connect(lambda: self.on_http_read(socket))
+        socket.disconnected.connect(lambda: self.http_buffers.pop(socket, None))
+        socket.disconnected.connect(socket.deleteLater)
+
+    def on_http_read(self, socket):
+        self.http_buffers[socket] += socket.readAll().data()
+        while b'\r\n\r\n' in self.http_buffers[socket]:
+            request, _, rest = self.http_buffers[socket].partition(b'\r\n\r\n')
+            self.http_buffers[socket] = rest
+            lines = request.decode('latin-1').split('\r\n')
+            method, target, version = (lines[0].split(' ') + ['', ''])[:3]
+            headers = dict((k.strip().lower(), v.strip()) for k, _, v in
+                           (line.partition(':') for line in lines[1:]))
+            url = urllib.parse.urlsplit(target)
+            if method == 'GET' and url.path == '/command':
+                # The firmware decodes %XX escapes to raw bytes.
+                text = urllib.parse.parse_qs(url.query, encoding='latin-1').get('commandText', [''])[0]
+                self.sim.update()
+                # Grbl_ESP32 runs a lone realtime character directly and
+                # queues anything else as a line.
+                if len(text) == 1 and (text in '?!~\x18' or ord(text) >= 0x80):
+                    self.sim.receive(text.encode('latin-1'))
+                else:
+                    self.sim.receive(text.encode('latin-1') + b'\n')
+                status = "200 OK"
+            else:
+                status = "404 Not Found"
+            close = headers.get('connection', '').lower() == 'close' or version == 'HTTP/1.0'
+            socket.write(("HTTP/1.1 %s\r\nContent-Type: text/plain\r\nContent-Length: 0\r\n"
+                          "Connection: %s\r\n\r\n" % (status, 'close' if close else 'keep-alive')).encode('ascii'))
+            if close:
+                socket.disconnectFromHost()
+                return
+
+    def tick(self):
+        now = time.monotonic()
+        elapsed = now - self.last
+        self.last = now
+        self.sim.update(now)
+        if self.master is not None:
+            # Pace both directions of the serial line at the baud rate; an
+            # idle line can't save up more than one tick's worth.
+            cap = TICK_INTERVAL / 1000.0 / self.byte_time
+            self.credit_in = min(self.credit_in + elapsed / self.byte_time, max(cap, len(self.wire_in)))
+            n = min(int(self.credit_in), len(self.wire_in))
+            if n:
+                self.sim.receive(self.wire_in[:n])
+                del self.wire_in[:n]
+                self.credit_in -= n
+            self.credit_out = min(self.credit_out + elapsed / self.byte_time, max(cap, len(self.wire_out)))
+            n = min(int(self.credit_out), len(self.wire_out))
+            if n:
+                os.write(self.master, bytes(self.wire_out[:n]))
+                del self.wire_out[:n]
+                self.credit_out -= n
+        if self.sim.overflows != self.overflows:
+            print("RX buffer overflow: %d bytes lost" % (self.sim.overflows - self.overflows))
+            self.overflows = self.sim.overflows
+        if self.ws_out:
+            # Whatever accumulated goes out as one frame, or as frames of at
+            # most ws_chunk bytes, which may split lines.
+            size = self.ws_chunk or len(self.ws_out)
+            for i in range(0, len(self.ws_out), size):
+                for socket in self.websockets:
+                    socket.sendBinaryMessage(QtCore.QByteArray(bytes(self.ws_out[i:i + size])))
+            self.ws_out = bytearray()
+
+
+def parse_settings(values):
+    # ['10=3', '$24=50'] -> {10: 3, 24: 50.0}
+    settings = {}
+    for value in values:
+        number, _, value = value.lstrip('$').partition('=')
+        number = int(number)
+        settings[number] = int(float(value)) if number in INTEGER_SETTINGS else float(value)
+    return settings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated Grbl 1.1 controller")
+    parser.add_argument('--pty', metavar='LINK', nargs='?', const='',
+                        help="serve on a pty, optionally symlinked to LINK (e.g. /tmp/grblserial)")
+    parser.add_argument('--http-port', type=int, help="serve Grbl_ESP32 style HTTP commands on this port")
+    parser.add_argument('--ws-port', type=int, default=81, help="WebSocket port for output (default 81)")
+    parser.add_argument('--ws-chunk', type=int, default=0, metavar='BYTES',
+                        help="split WebSocket output into frames of at most this many bytes")
+    parser.add_argument('--baud', type=int, default=BAUD_RATE)
+    parser.add_argument('--set', action='append', default=[], metavar='N=VALUE',
+                        help="override a $ setting, e.g. --set 10=3")
+    args = parser.parse_args()
+
+    app = QtCore.QCoreApplication(sys.argv)
+    server = GrblSimServer(args.baud, settings=parse_settings(args.set))
+    if args.pty is None and args.http_port is None:
+        args.pty = ''
+    if args.pty is not None:
+        print("Grbl simulator on", server.open_pty(args.pty), args.pty and "-> " + args.pty or "")
+    if args.http_port is not None:
+        if not server.listen(args.http_port, args.ws_port, args.ws_chunk):
+            print("Failed to listen on ports", args.http_port, args.ws_port)
+            return 1
+        print("Grbl simulator on http port", args.http_port, "websocket port", args.ws_port)
+    sys.stdout.flush()
+    return app.exec_()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
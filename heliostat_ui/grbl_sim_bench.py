@@ -0,0 +1,324 @@
+# Drives the real host-side clients (QRAMPSObject over a pty, GRBLESP32Client
+# over HTTP + WebSocket) against grbl_sim.py and reports command latency,
+# status round trips, homing time and streaming throughput.
+#
+#   cd heliostat_ui && python grbl_sim_bench.py
+import contextlib
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from PyQt5 import QtCore
+
+import grbl
+from grbl_stream import GrblStreamer
+from grblesp32_qobject import GRBLESP32Client
+from jog import Jogger
+from realtime import RealtimeControl
+from ramps_qobject import QRAMPSObject
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# Status reports with buffer state, and acceleration high enough that short
+# moves don't hide the protocol cost.
+SIM_SETTINGS = ['--set', '10=3', '--set', '120=1000', '--set', '121=1000']
+HTTP_PORT = 18080
+WS_PORT = 18081
+ROUND_TRIPS = 100
+STREAM_LINES = 300
+# Jog comparison: how long a button is held and the old auto-repeat
+# interval.  The axes are geared down to JOG_RATE units/min, slower than
+# auto-repeat's 1 unit per 150 ms (which is when its moves pile up), with the
+# default acceleration ($120/$121) so stopping takes real time.
+JOG_HOLD = 3.0
+AUTO_REPEAT = 0.15
+JOG_RATE = 200
+JOG_SETTINGS = ['--set', '110=%d' % JOG_RATE, '--set', '111=%d' % JOG_RATE,
+                '--set', '120=10', '--set', '121=10']
+JOG_TRIALS = 5
+POLL_HZ = 20
+
+
+def start_sim(*args):
+    proc = subprocess.Popen([sys.executable, 'grbl_sim.py'] + SIM_SETTINGS + list(args),
+                            stdout=subprocess.PIPE, cwd=HERE)
+    # It prints where it is listening once it is ready.
+    proc.stdout.readline()
+    return proc
+
+
+class Link:
+    """Collects parsed responses from a client, with arrival times."""
+
+    def __init__(self, app):
+        self.app = app
+        self.parser = grbl.GrblParser()
+        self.records = []
+        self.jogger = None
+        self.control = None
+
+    def on_line(self, line):
+        record = self.parser.parse_line(line)
+        self.records.append((time.perf_counter(), record))
+        if isinstance(record, grbl.StatusReport):
+            if self.jogger is not None:
+                self.jogger.on_status(record)
+            if self.control is not None:
+                self.control.on_status(record)
+
+    def wait(self, done, timeout=60.0):
+        end = time.monotonic() + timeout
+        while not done():
+            if time.monotonic() > end:
+                raise RuntimeError("timed out")
+            self.app.processEvents(QtCore.QEventLoop.AllEvents | QtCore.QEventLoop.WaitForMoreEvents)
+
+    def wait_for(self, kind, timeout=60.0):
+        """Wait for the next response of the given type; returns its time."""
+        start = len(self.records)
+
+        def found():
+            return any(isinstance(r, kind) for t, r in self.records[start:])
+        self.wait(found, timeout)
+        return next(t for t, r in self.records[start:] if isinstance(r, kind))
+
+    def wait_idle(self):
+        while True:
+            self.realtime(b'?')
+            self.wait_for(grbl.StatusReport)
+            if self.parser.status.state == 'Idle' and self.streamer.idle():
+                return
+
+    def wait_acked(self, count):
+        self.wait(lambda: self.streamer.acked >= count)
+
+    def sleep(self, seconds):
+        end = time.perf_counter() + seconds
+        self.wait(lambda: time.perf_counter() >= end)
+
+    def position(self):
+        self.realtime(b'?')
+        self.wait_for(grbl.StatusReport)
+        return self.parser.status.wpos or self.parser.status.mpos
+
+
+class SerialLink(Link):
+    def __init__(self, app, port):
+        super(SerialLink, self).__init__(app)
+        self.ramps = QRAMPSObject(port=port)
+        self.ramps.messageSignal.connect(self.on_line)
+        self.streamer = self.ramps.streamer
+
+    def send_line(self, line):
+        self.ramps.send_line(line)
+
+    def realtime(self, c):
+        self.ramps.send_realtime(c)
+
+    def close(self):
+        # The next sim opens the same pty path, which is exclusive.
+        self.ramps.serial.close()
+
+
+class ESP32Link(Link):
+    def __init__(self, app, hostname, http_port, ws_port):
+        super(ESP32Link, self).__init__(app)
+        self.client = GRBLESP32Client(hostname, http_port, ws_port)
+        self.client.messageSignal.connect(self.on_response)
+        # Counted the same way heliostat_ui.py does it.
+        self.streamer = GrblStreamer(lambda data: self.client.send_line(data.decode('ascii').strip()))
+        self.wait(lambda: self.client.current_id is not None)
+
+    def on_response(self, line):
+        self.streamer.on_line(line)
+        self.on_line(line)
+
+    def send_line(self, line):
+        self.streamer.send(line)
+
+    def realtime(self, c):
+        self.client.send_realtime(c)
+
+
+def stats(samples):
+    samples = sorted(samples)
+    return "mean %6.2f  p95 %6.2f  max %6.2f ms" % (
+        sum(samples) / len(samples) * 1e3, samples[int(len(samples) * 0.95)] * 1e3, samples[-1] * 1e3)
+
+
+def bench(link):
+    results = []
+    t0 = time.perf_counter()
+    link.send_line("$H")
+    link.wait_for(grbl.Ok)
+    results.append(("homing", "%.2f s" % (time.perf_counter() - t0)))
+    link.send_line("G91")
+    link.wait_for(grbl.Ok)
+
+    latencies = []
+    for i in range(ROUND_TRIPS):
+        t0 = time.perf_counter()
+        link.send_line("G21")
+        latencies.append(link.wait_for(grbl.Ok) - t0)
+    results.append(("command -> ok", stats(latencies)))
+
+    latencies = []
+    for i in range(ROUND_TRIPS):
+        t0 = time.perf_counter()
+        link.realtime(b'?')
+        latencies.append(link.wait_for(grbl.StatusReport) - t0)
+    results.append(("? -> status", stats(latencies)))
+
+    for label, line in (("non-motion lines", "G21 G91"), ("0.01 mm moves", "G1 X0.01 F3000")):
+        acked = link.streamer.acked
+        t0 = time.perf_counter()
+        for i in range(STREAM_LINES):
+            link.send_line(line)
+            link.wait_acked(acked + i + 1)
+        link.wait_idle()
+        waiting = time.perf_counter() - t0
+
+        acked = link.streamer.acked
+        t0 = time.perf_counter()
+        for i in range(STREAM_LINES):
+            link.send_line(line)
+        link.wait_acked(acked + STREAM_LINES)
+        link.wait_idle()
+        counting = time.perf_counter() - t0
+        results.append((label, "send/wait-ok %5.0f lines/s  character counting %5.0f lines/s" % (
+            STREAM_LINES / waiting, STREAM_LINES / counting)))
+    results.append(("streamer", link.streamer.summary()))
+    if isinstance(link, ESP32Link):
+        results.append(("http", link.client.commands.summary()))
+    return results
+
+
+def bench_poll(link):
+    """Status polls at POLL_HZ while a backlog of moves streams: sent the
+    old way, as a '?' line (StateMachine.tick, GRBLESP32Client.do_status),
+    and through send_realtime."""
+    results = []
+    # About 5 s of motion.
+    line = "G1 X0.1 F600"
+    for label in ("? as a line", "? realtime"):
+        acked = link.streamer.acked
+        for i in range(STREAM_LINES):
+            link.send_line(line)
+        latencies = []
+        control = None
+        if label == "? realtime":
+            control = link.control = RealtimeControl(link.realtime)
+            control.start(POLL_HZ)
+        while link.streamer.acked < acked + STREAM_LINES:
+            if control is None:
+                t0 = time.perf_counter()
+                if isinstance(link, ESP32Link):
+                    # The firmware runs a lone '?' as a realtime command
+                    # (no 'ok'), but it queued behind the HTTP commands.
+                    link.client.send_line("?")
+                else:
+                    link.send_line("?")
+                    acked += 1
+                latencies.append(link.wait_for(grbl.StatusReport) - t0)
+            link.sleep(1.0 / POLL_HZ)
+        if control is not None:
+            control.stop()
+            link.control = None
+            results.append((label, "%s; %s" % (control.summary(), link.streamer.summary())))
+        else:
+            results.append((label, stats(latencies)))
+        link.wait_idle()
+    return results
+
+
+def bench_jog(link):
+    """Hold a jog button for JOG_HOLD seconds, the old way (a relative G0 per
+    auto-repeat) and with $J= plus jog cancel; report how long the mount
+    keeps moving after release and how far it overshoots."""
+    results = []
+    link.send_line("$H")
+    link.wait_for(grbl.Ok)
+    link.send_line("G91")
+    link.wait_idle()
+
+    stops = []
+    overshoots = []
+    for trial in range(JOG_TRIALS):
+        end = time.perf_counter() + JOG_HOLD
+        while time.perf_counter() < end:
+            link.send_line("G0 Y1")
+            link.sleep(AUTO_REPEAT)
+        released = link.position()[1]
+        t0 = time.perf_counter()
+        link.wait_idle()
+        stops.append(time.perf_counter() - t0)
+        overshoots.append(link.parser.status.wpos[1] - released)
+    results.append(("auto-repeat G0", "stop %s, overshoot %.2f" % (stats(stops), max(overshoots))))
+
+    jogger = link.jogger = Jogger(link.streamer, link.realtime, rate=JOG_RATE)
+    overshoots = []
+    for trial in range(JOG_TRIALS):
+        jogger.start(y=-1)
+        link.sleep(JOG_HOLD)
+        released = link.position()[1]
+        jogger.stop()
+        link.wait(lambda: not jogger.released)
+        link.wait_idle()
+        overshoots.append(released - link.parser.status.wpos[1])
+    results.append(("$J + jog cancel", "stop %s, overshoot %.2f" % (stats(jogger.stop_latencies), max(overshoots))))
+    results.append(("jogger", jogger.summary()))
+    link.jogger = None
+    return results
+
+
+def show(name, results):
+    for label, value in results:
+        print("%-8s %-18s %s" % (name, label, value))
+
+
+def main():
+    app = QtCore.QCoreApplication(sys.argv)
+    # Keeps WaitForMoreEvents from sleeping forever.
+    heartbeat = QtCore.QTimer()
+    heartbeat.start(10)
+
+    link = os.path.join(tempfile.mkdtemp(), 'grblserial')
+    sim = start_sim('--pty', link)
+    serial = None
+    try:
+        serial = SerialLink(app, link)
+        show("serial", bench(serial))
+        show("serial", bench_poll(serial))
+    finally:
+        if serial is not None:
+            serial.close()
+        sim.terminate()
+        sim.wait()
+
+    sim = start_sim('--pty', link, *JOG_SETTINGS)
+    serial = None
+    try:
+        serial = SerialLink(app, link)
+        show("serial", bench_jog(serial))
+    finally:
+        if serial is not None:
+            serial.close()
+        sim.terminate()
+        sim.wait()
+
+    # Small frames, so responses arrive split across them as they can from
+    # the ESP32.
+    sim = start_sim('--http-port', str(HTTP_PORT), '--ws-port', str(WS_PORT), '--ws-chunk', '7')
+    try:
+        # GRBLESP32Client prints every message; keep the table readable.
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            esp32 = ESP32Link(app, "127.0.0.1", HTTP_PORT, WS_PORT)
+            results = bench(esp32) + bench_poll(esp32)
+        show("esp32", results)
+    finally:
+        sim.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+# Grbl's character-counting streaming protocol.
+#
+# Grbl acknowledges every line with 'ok' or 'error:N' once it has been taken
+# out of its serial RX buffer.  By remembering the length of every line that
+# hasn't been acknowledged yet, the host knows how full that buffer is and
+# can keep it topped up, instead of waiting a full round trip per line.
+import collections
+import heapq
+import time
+
+# Size of Grbl's serial receive buffer (RX_BUFFER_SIZE in serial.h; it is not
+# overridden in grbl/config.h).
+RX_BUFFER_SIZE = 128
+# Weight of the newest sample in the running send -> ok latency average.
+LATENCY_WEIGHT = 0.2
+
+
+class GrblStreamer:
+    def __init__(self, write, rx_buffer_size=RX_BUFFER_SIZE, is_open=None):
+        # write(bytes) puts data on the wire.  is_open(), if given, says
+        # whether it can; while it can't, send() refuses lines rather than
+        # queueing them for a port that may never open.
+        self.write = write
+        self.is_open = is_open
+        self.rx_buffer_size = rx_buffer_size
+        self.queue = collections.deque()
+        self.in_flight = collections.deque()
+        self.used = 0
+        self.sent = 0
+        self.acked = 0
+        self.errors = 0
+        self.max_queue = 0
+        self.refused = 0
+        # Running average of the time from writing a line to its 'ok', in
+        # seconds; None until the first one.
+        self.latency = None
+
+    def send(self, line):
+        """Queue line for sending; returns False if it was refused because the
+        port isn't open."""
+        if self.is_open is not None and not self.is_open():
+            self.refused += 1
+            if self.refused == 1:
+                print("Port not open, not sending", line.strip())
+            return False
+        self.queue.append((line.strip() + '\n').encode('ascii'))
+        self.max_queue = max(self.max_queue, len(self.queue))
+        self.pump()
+        return True
+
+    def pump(self):
+        while self.queue:
+            data = self.queue[0]
+            # Grbl's ring buffer holds one byte less than its size.  A line
+            # longer than that can still go once it is empty.
+            if self.in_flight and self.used + len(data) > self.rx_buffer_size - 1:
+                break
+            self.queue.popleft()
+            self.in_flight.append((len(data), time.perf_counter()))
+            self.used += len(data)
+            self.sent += 1
+            self.write(data)
+
+    def on_line(self, line):
+        """Feed every response line here; returns True if it acknowledged a
+        line that had been sent."""
+        if line == 'ok' or line.startswith('error:'):
+            if line != 'ok':
+                self.errors += 1
+            if self.in_flight:
+                size, sent = self.in_flight.popleft()
+                self.used -= size
+                self.acked += 1
+                latency = time.perf_counter() - sent
+                if self.latency is None:
+                    self.latency = latency
+                else:
+                    self.latency += LATENCY_WEIGHT * (latency - self.latency)
+            self.pump()
+            return True
+        if line.startswith('Grbl '):
+            # Grbl was reset and dropped whatever was in its buffer.
+            self.reset()
+        return False
+
+    def reset(self):
+        self.queue.clear()
+        self.in_flight.clear()
+        self.used = 0
+
+    def drop_in_flight(self):
+        """Forget lines whose responses were lost (e.g. the connection
+        dropped) and carry on as if Grbl had handled them."""
+        self.in_flight.clear()
+        self.used = 0
+        self.pump()
+
+    def idle(self):
+        return not self.queue and not self.in_flight
+
+    def summary(self):
+        return "%d sent, %d acked, %d errors, %d refused, %d queued, %d/%d bytes in flight, queue max %d, latency %s ms" % (
+            self.sent, self.acked, self.errors, self.refused, len(self.queue), self.used,
+            self.rx_buffer_size, self.max_queue,
+            "%.2f" % (self.latency * 1e3) if self.latency is not None else '-')
+
+
+def simulate(lines, streaming, baud_rate=115200, latency=0.002, parse_time=0.0005,
+             move_time=0.02, planner_blocks=15):
+    """Discrete-event model of a host driving Grbl over a serial link.
+
+    Returns the time taken from the first write until the last line has been
+    acknowledged.  streaming=False is the send-and-wait-for-ok approach.
+    """
+    byte_time = 10.0 / baud_rate
+    events = []
+    seq = [0]
+
+    def at(t, kind, data=None):
+        seq[0] += 1
+        heapq.heappush(events, (t, seq[0], kind, data))
+
+    now = [0.0]
+    link_free = [0.0]
+
+    def write(data):
+        start = max(now[0], link_free[0])
+        link_free[0] = start + len(data) * byte_time
+        at(link_free[0] + latency, 'rx', data)
+
+    rx = collections.deque()
+    planner = collections.deque()
+    busy = [False]
+    motion_done = [0.0]
+
+    if streaming:
+        streamer = GrblStreamer(write)
+        for line in lines:
+            streamer.send(line)
+    else:
+        pending = collections.deque(lines)
+        write((pending.popleft() + '\n').encode('ascii'))
+
+    def controller():
+        # Take the next line out of RX once there is room in the planner.
+        if busy[0] or not rx:
+            return
+        while planner and planner[0] <= now[0]:
+            planner.popleft()
+        if len(planner) >= planner_blocks:
+            at(planner[0], 'poll')
+            return
+        busy[0] = True
+        at(now[0] + parse_time, 'planned')
+
+    while events:
+        now[0], _, kind, data = heapq.heappop(events)
+        if kind == 'rx':
+            rx.append(data)
+            controller()
+        elif kind == 'poll':
+            controller()
+        elif kind == 'planned':
+            rx.popleft()
+            motion_done[0] = max(motion_done[0], now[0]) + move_time
+            planner.append(motion_done[0])
+            busy[0] = False
+            at(now[0] + latency + 3 * byte_time, 'ok')
+            controller()
+        elif kind == 'ok':
+            if streaming:
+                streamer.on_line('ok')
+            elif pending:
+                write((pending.popleft() + '\n').encode('ascii'))
+    return max(now[0], motion_done[0])
+
+
+if __name__ == '__main__':
+    moves = ["G1 X%.3f Y%.3f F3000" % (i * 0.1, -i * 0.05) for i in range(500)]
+    for move_time in (0.0, 0.005, 0.02):
+        waiting = simulate(moves, streaming=False, move_time=move_time)
+        counting = simulate(moves, streaming=True, move_time=move_time)
+        print("%d moves of %2.0f ms: send/wait-ok %6.2f s (%5.0f lines/s), "
+              "character counting %6.2f s (%5.0f lines/s)" % (
+                  len(moves), move_time * 1e3, waiting, len(moves) / waiting,
+                  counting, len(moves) / counting))
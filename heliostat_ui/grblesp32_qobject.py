@@ -1,43 +1,359 @@
+import collections
 import sys
+import time
+import urllib.parse
 
 from PyQt5 import QtCore, QtWebSockets, QtNetwork
 from PyQt5.QtCore import QUrl, QCoreApplication, QTimer
 
+import grbl
+
 HOSTNAME="grblesp.local"
+# Most /command requests written ahead of their responses.
+WINDOW = 4
+# How long a looked-up controller address is used before looking it up again;
+# mDNS lookups of grblesp.local can take hundreds of milliseconds.
+HOST_TTL = 300
+# Reconnect delays double from the first to the last after each failure.
+RECONNECT_MS = (250, 30000)
+# The WebSocket is pinged this often, and reopened if nothing has been heard
+# from the controller for PING_TIMEOUT pings.
+PING_MS = 5000
+PING_TIMEOUT = 3
+
+
+class Backoff:
+    def __init__(self, first=RECONNECT_MS[0], last=RECONNECT_MS[1]):
+        self.first = first
+        self.last = last
+        self.delay = first
+
+    def next(self):
+        delay = self.delay
+        self.delay = min(self.delay * 2, self.last)
+        return delay
+
+    def reset(self):
+        self.delay = self.first
+
+
+class HostCache(QtCore.QObject):
+    """Looks a hostname up without blocking the event loop and remembers the
+    address for HOST_TTL seconds.  resolvedSignal carries the address, or
+    an empty string if the lookup failed."""
+    resolvedSignal = QtCore.pyqtSignal(str)
+
+    def __init__(self, hostname, ttl=HOST_TTL, parent=None):
+        super(HostCache, self).__init__(parent)
+        self.hostname = hostname
+        self.ttl = ttl
+        self.cached = None
+        self.expires = 0.0
+        self.pending = False
+        self.lookups = 0
+        if not QtNetwork.QHostAddress(hostname).isNull():
+            # Already an address; nothing to look up.
+            self.cached = hostname
+            self.expires = float('inf')
+
+    def address(self):
+        if self.cached is not None and time.monotonic() < self.expires:
+            return self.cached
+        return None
+
+    def resolve(self):
+        address = self.address()
+        if address is not None:
+            self.resolvedSignal.emit(address)
+        elif not self.pending:
+            self.pending = True
+            self.lookups += 1
+            QtNetwork.QHostInfo.lookupHost(self.hostname, self.on_lookup)
+
+    def on_lookup(self, info):
+        self.pending = False
+        addresses = [a for a in info.addresses() if a.protocol() == QtNetwork.QAbstractSocket.IPv4Protocol] or \
+            info.addresses()
+        if info.error() != QtNetwork.QHostInfo.NoError or not addresses:
+            print("Failed to look up", self.hostname, info.errorString())
+            self.resolvedSignal.emit("")
+            return
+        self.cached = addresses[0].toString()
+        self.expires = time.monotonic() + self.ttl
+        self.resolvedSignal.emit(self.cached)
+
+    def invalidate(self):
+        if self.expires != float('inf'):
+            self.cached = None
+
+
+class CommandChannel(QtCore.QObject):
+    """Sends /command requests over one keep-alive HTTP connection.
+
+    Requests go out in the order they were queued, up to WINDOW of them
+    pipelined ahead of their responses, so a move costs one write on an open
+    socket rather than a lookup, TCP connect and round trip.  If the
+    connection drops, unanswered requests that never left the socket are sent
+    again first; ones that did may or may not have run, and as G-code isn't
+    safe to repeat (relative moves, jogs, resets) they go out on lostSignal
+    instead.  Urgent requests (realtime commands) go ahead of everything
+    still queued.
+    """
+    # Paths of requests that were written but never answered.
+    lostSignal = QtCore.pyqtSignal(list)
+
+    def __init__(self, host, port=80, window=WINDOW, parent=None):
+        super(CommandChannel, self).__init__(parent)
+        # A HostCache, so the name is only looked up when its address expires.
+        self.host = host
+        self.host.resolvedSignal.connect(self.on_resolved)
+        self.port = port
+        # Sent as PAGEID so output goes to our WebSocket.
+        self.page_id = None
+        # Requests queue up without being sent while paused.
+        self.paused = False
+        self.backoff = Backoff()
+        self.window = window
+        self.queue = collections.deque()
+        self.urgent = collections.deque()
+        self.in_flight = collections.deque()
+        self.buffer = b''
+        # Servers that close after every response get one request at a time;
+        # until the first response says which kind this is (None), so does
+        # this one, or the requests pipelined behind it would be lost.
+        self.keep_alive = None
+        # Bytes given to the socket and bytes it has handed to the network,
+        # on this connection.
+        self.queued_bytes = 0
+        self.written_bytes = 0
+        self.socket = QtNetwork.QTcpSocket(self)
+        self.socket.connected.connect(self.pump)
+        self.socket.readyRead.connect(self.on_ready_read)
+        self.socket.bytesWritten.connect(self.on_bytes_written)
+        self.socket.disconnected.connect(self.on_disconnected)
+        self.socket.error.connect(self.on_error)
+        self.sent = 0
+        self.answered = 0
+        self.resent = 0
+        self.lost = 0
+        self.connects = 0
+        self.max_in_flight = 0
+        self.latency_total = 0.0
+        self.latency_worst = 0.0
+
+    def send(self, path, urgent=False):
+        (self.urgent if urgent else self.queue).append((path, time.perf_counter()))
+        self.pump()
+
+    def pending(self):
+        return len(self.urgent) + len(self.queue)
+
+    def pump(self):
+        if self.paused:
+            return
+        state = self.socket.state()
+        if state == QtNetwork.QAbstractSocket.UnconnectedState:
+            if self.pending():
+                self.host.resolve()
+            return
+        if state != QtNetwork.QAbstractSocket.ConnectedState:
+            return
+        window = self.window if self.keep_alive else 1
+        while self.pending() and len(self.in_flight) < window:
+            path, queued = (self.urgent or self.queue).popleft()
+            target = path if self.page_id is None else path + "&PAGEID=" + self.page_id
+            request = ("GET %s HTTP/1.1\r\nHost: %s\r\n\r\n" % (target, self.host.hostname)).encode('ascii')
+            # Where the request starts in the connection's byte stream.
+            self.in_flight.append((path, queued, time.perf_counter(), self.queued_bytes))
+            self.queued_bytes += len(request)
+            self.socket.write(request)
+            self.sent += 1
+            self.max_in_flight = max(self.max_in_flight, len(self.in_flight))
+
+    def on_resolved(self, address):
+        if self.socket.state() != QtNetwork.QAbstractSocket.UnconnectedState or not self.pending():
+            return
+        if address:
+            self.connects += 1
+            self.socket.connectToHost(address, self.port)
+        else:
+            QTimer.singleShot(self.backoff.next(), self.pump)
+
+    def on_ready_read(self):
+        self.backoff.reset()
+        self.buffer += self.socket.readAll().data()
+        while b'\r\n\r\n' in self.buffer:
+            head, _, rest = self.buffer.partition(b'\r\n\r\n')
+            lines = head.decode('latin-1').split('\r\n')
+            headers = dict((k.strip().lower(), v.strip()) for k, _, v in
+                           (line.partition(':') for line in lines[1:]))
+            length = int(headers.get('content-length', 0))
+            if len(rest) < length:
+                return
+            self.buffer = rest[length:]
+            if headers.get('connection', '').lower() == 'close':
+                self.keep_alive = False
+            elif self.keep_alive is None:
+                self.keep_alive = True
+            if not lines[0].split(' ')[1:2] == ['200']:
+                print("command failed:", lines[0])
+            if self.in_flight:
+                path, queued, sent, start = self.in_flight.popleft()
+                latency = time.perf_counter() - queued
+                self.answered += 1
+                self.latency_total += latency
+                self.latency_worst = max(self.latency_worst, latency)
+        self.pump()
+
+    def on_bytes_written(self, count):
+        self.written_bytes += count
+
+    def on_disconnected(self):
+        self.buffer = b''
+        unsent = [(path, queued) for path, queued, sent, start in self.in_flight
+                  if start >= self.written_bytes]
+        lost = [path for path, queued, sent, start in self.in_flight if start < self.written_bytes]
+        self.in_flight.clear()
+        self.queued_bytes = 0
+        self.written_bytes = 0
+        if unsent:
+            self.resent += len(unsent)
+            self.queue.extendleft(reversed(unsent))
+        if lost:
+            self.lost += len(lost)
+            print("command channel dropped, %d sent commands unanswered" % len(lost))
+            self.lostSignal.emit(lost)
+        if self.pending():
+            QTimer.singleShot(0, self.pump)
+
+    def on_error(self, error):
+        if error == QtNetwork.QAbstractSocket.RemoteHostClosedError:
+            return
+        print("command channel error:", self.socket.errorString())
+        if error != QtNetwork.QAbstractSocket.ConnectionRefusedError:
+            # The controller may have come back on a different address.
+            self.host.invalidate()
+        if self.socket.state() == QtNetwork.QAbstractSocket.UnconnectedState and self.pending():
+            QTimer.singleShot(self.backoff.next(), self.pump)
+
+    def summary(self):
+        mean = self.latency_total / self.answered if self.answered else 0.0
+        return "%d sent, %d answered, %d resent, %d lost, %d connects, in flight max %d, latency %.2f/%.2f ms (mean/max)" % (
+            self.sent, self.answered, self.resent, self.lost, self.connects, self.max_in_flight,
+            mean * 1e3, self.latency_worst * 1e3)
+
 
 class GRBLESP32Client(QtCore.QObject):
+    # One complete response line (without line ending) per signal; the
+    # controller packs several into one frame or splits them across frames.
     messageSignal = QtCore.pyqtSignal(str)
-    def __init__(self):
+    # All the lines completed by one frame, for receivers that want them in
+    # one go.
+    linesSignal = QtCore.pyqtSignal(list)
+    # True once the WebSocket is open and the controller has said which
+    # client we are, False when it drops.  Responses to commands sent while
+    # it was down are lost.
+    connectionSignal = QtCore.pyqtSignal(bool)
+    # Command lines that were sent but may or may not have run because the
+    # connection dropped; the position should be taken from a status report.
+    lostSignal = QtCore.pyqtSignal(list)
+    def __init__(self, hostname=HOSTNAME, http_port=80, ws_port=81):
         super().__init__()
+        self.hostname = hostname
+        self.http_port = http_port
+        self.ws_port = ws_port
+        self.current_id = None
+        self.host = HostCache(hostname, parent=self)
+        self.host.resolvedSignal.connect(self.on_resolved)
+        self.backoff = Backoff()
+        self.opening = False
+        self.connected_at = None
+        self.started = time.monotonic()
+        self.uptime_total = 0.0
+        self.connects = 0
+        self.rtt = None
+        self.lines = grbl.LineBuffer()
 
         self.client =  QtWebSockets.QWebSocket("",QtWebSockets.QWebSocketProtocol.Version13,None)
         self.client.error.connect(self.error)
         self.client.connected.connect(self.connected)
+        self.client.disconnected.connect(self.disconnected)
 
-        self.client.open(QUrl(f"ws://{HOSTNAME}:81"))
         self.client.pong.connect(self.onPong)
         self.client.textMessageReceived.connect(self.onText)
         self.client.binaryMessageReceived.connect(self.onBinary)
 
-        self.request = QtNetwork.QNetworkRequest()
-        url = QtCore.QUrl(f"http://{HOSTNAME}/command?commandText=?")
-        self.request.setUrl(url)
-        self.manager = QtNetwork.QNetworkAccessManager()
+        self.ping_timer = QtCore.QTimer(self)
+        self.ping_timer.timeout.connect(self.do_ping)
+        self.last_heard = time.monotonic()
+
+        # Commands wait until the WebSocket is up, so their responses aren't lost.
+        self.commands = CommandChannel(self.host, self.http_port, parent=self)
+        self.commands.paused = True
+        self.commands.lostSignal.connect(self.on_lost)
+        self.open()
+
+    def open(self):
+        if not self.opening:
+            self.opening = True
+            self.host.resolve()
+
+    def on_resolved(self, address):
+        if not self.opening:
+            return
+        self.opening = False
+        if address:
+            self.client.open(QUrl(f"ws://{address}:{self.ws_port}"))
+        else:
+            QTimer.singleShot(self.backoff.next(), self.open)
 
     def connected(self):
         print("connected")
-        #self.ping_timer = QtCore.QTimer()
-        #self.ping_timer.timeout.connect(self.do_ping)
-        #self.ping_timer.start(5000)
+        self.backoff.reset()
+        self.connects += 1
+        self.connected_at = time.monotonic()
+        self.last_heard = self.connected_at
+        self.ping_timer.start(PING_MS)
 
         #self.status_timer = QtCore.QTimer()
         #self.status_timer.timeout.connect(self.do_status)
         #self.status_timer.start(1000)
 
+    def disconnected(self):
+        self.ping_timer.stop()
+        if self.connected_at is not None:
+            self.uptime_total += time.monotonic() - self.connected_at
+            self.connected_at = None
+        self.commands.paused = True
+        self.lines = grbl.LineBuffer()
+        if self.current_id is not None:
+            self.current_id = None
+            self.commands.page_id = None
+            self.connectionSignal.emit(False)
+        delay = self.backoff.next()
+        print("disconnected, reconnecting in %.2f s" % (delay / 1000.0))
+        QTimer.singleShot(delay, self.open)
+
+    def uptime(self):
+        """Seconds the current connection has been up (0 when down)."""
+        return time.monotonic() - self.connected_at if self.connected_at is not None else 0.0
+
+    def summary(self):
+        total = time.monotonic() - self.started
+        up = self.uptime_total + self.uptime()
+        return "connected %.1f s of %.1f s (%.0f%%), %d reconnects, %d host lookups, ping %s ms" % (
+            up, total, 100.0 * up / total if total else 0.0, max(self.connects - 1, 0),
+            self.host.lookups, self.rtt if self.rtt is not None else '-')
+
     def onText(self, message):
+        self.last_heard = time.monotonic()
         if message.startswith("CURRENT_ID"):
             self.current_id = message.split(':')[1]
             print("Current id is:", self.current_id)
+            self.commands.page_id = self.current_id
+            self.commands.paused = False
+            self.connectionSignal.emit(True)
+            self.commands.pump()
         elif message.startswith("ACTIVE_ID"):
             active_id = message.split(':')[1]
             if self.current_id != active_id:
@@ -48,31 +364,56 @@ class GRBLESP32Client(QtCore.QObject):
                 print("Warning: ping different active id.")
 
     def onBinary(self, message):
-        print("onBinary: message", message)
-        self.messageSignal.emit(str(message, 'ascii'))
+        self.last_heard = time.monotonic()
+        lines = self.lines.feed(bytes(message))
+        if lines:
+            self.linesSignal.emit(lines)
+            for line in lines:
+                self.messageSignal.emit(line)
         
     def do_ping(self):
-        pass
-        #self.client.ping(b"0")
+        if time.monotonic() - self.last_heard > PING_MS * PING_TIMEOUT / 1000.0:
+            print("controller stopped answering, reconnecting")
+            self.client.abort()
+            return
+        self.client.ping(b"0")
 
-    def do_status(self):        
-        self.replyObject = self.manager.get(self.request)
+    def do_status(self):
+        self.send_realtime(grbl.CMD_STATUS_REPORT)
 
 
     def send_line(self, line):
         print("client: send_line", line)
-        request = QtNetwork.QNetworkRequest()
-        url = QtCore.QUrl(f"http://{HOSTNAME}/command?commandText={line}")
-        request.setUrl(url)
-        self.manager.get(request)
+        self.commands.send("/command?commandText=" + urllib.parse.quote(line, safe=''))
+
+    def on_lost(self, paths):
+        lines = [urllib.parse.unquote(path.partition('commandText=')[2]) for path in paths]
+        print("lost commands:", lines)
+        self.lostSignal.emit(lines)
+
+    def send_realtime(self, data):
+        """Send realtime command bytes ahead of any queued lines.  The
+        firmware runs a /command that is a single realtime character
+        straight away, so each byte is its own request."""
+        if data == grbl.CMD_STATUS_REPORT and self.current_id is None:
+            # The report would have nowhere to go; the next poll will do.
+            return
+        for c in data:
+            self.commands.send("/command?commandText=" + urllib.parse.quote_from_bytes(bytes([c]), safe=''),
+                               urgent=True)
 
     def onPong(self, elapsedTime, payload):
-        print("onPong - time: {} ; payload: {}".format(elapsedTime, payload))
+        self.last_heard = time.monotonic()
+        self.rtt = elapsedTime
 
     def error(self, error_code):
         print("error code: {}".format(error_code))
         if error_code == 1:
             print(self.client.errorString())
+        if error_code not in (QtNetwork.QAbstractSocket.ConnectionRefusedError,
+                              QtNetwork.QAbstractSocket.RemoteHostClosedError):
+            # The controller may have come back on a different address.
+            self.host.invalidate()
 
     def close(self):
         self.client.close()
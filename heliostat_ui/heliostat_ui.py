@@ -1,17 +1,29 @@
+import startup_profile
+startup_profile.enable_from_argv()
+
 from PyQt5 import QtWidgets, QtCore, uic
 import sys 
 import os
+import grbl
 from grblesp32_qobject import GRBLESP32Client
-from gps_qobject import GPSQObject
-from sun_pos import getSunPos
-import pynmea2
+from grbl_stream import GrblStreamer
+from gps_qobject import PORT as GPS_PORT
+from gps_worker import GPSLatency, REPORT_EVERY, start_gps_thread
+import mirror
+from log_sink import LogSink
+from moves import MoveCoalescer
+import tracking
+
+# Direction (alt, az) of the receiver as seen from the mirror, for example
+# mirror.offset_to_altaz(east, north, up) of its position in metres.  None
+# points the mirror at the sun itself.
+TARGET = None
 
 STATE_INIT=0
 STATE_HOMED_X=1
 STATE_HOMED_Y=2
 STATE_SET_WORK=3
 STATE_READY=4
-STATE_SENDING_COMMAND=5
 STATE_ERROR=-1
 
 class MainWindow(QtWidgets.QMainWindow):
@@ -20,7 +32,8 @@ class MainWindow(QtWidgets.QMainWindow):
         super(MainWindow, self).__init__(*args, **kwargs)
 
         #Load the UI Page
-        uic.loadUi('heliostat_ui/heliostat.ui', self)
+        with startup_profile.section("loadUi"):
+            uic.loadUi('heliostat_ui/heliostat.ui', self)
         self.down_button.clicked.connect(self.down_button_clicked)
         self.up_button.clicked.connect(self.up_button_clicked)
         self.right_button.clicked.connect(self.right_button_clicked)
@@ -28,14 +41,32 @@ class MainWindow(QtWidgets.QMainWindow):
         self.home_x_button.clicked.connect(self.home_x_button_clicked)
         self.home_y_button.clicked.connect(self.home_y_button_clicked)
 
-        self.grblesp32 = GRBLESP32Client()
+        with startup_profile.section("GRBLESP32Client"):
+            self.grblesp32 = GRBLESP32Client()
         self.grblesp32.messageSignal.connect(self.on_ramps_read)
-
-        self.gps_qobject = GPSQObject()
+        # Moves are pipelined into the controller's buffer rather than sent
+        # one at a time waiting for each 'ok'.
+        self.streamer = GrblStreamer(self.write_ramps)
+        # While the buffer is full only the latest tracking/nudge target is
+        # kept, and moves below a step are dropped.
+        self.moves = MoveCoalescer(self.send_line, busy=lambda: self.streamer.queue, suffix=" F500")
+        self.grblesp32.connectionSignal.connect(self.on_ramps_connection)
+        self.grblesp32.lostSignal.connect(self.on_ramps_lost)
+
+        with startup_profile.section("GPSWorker"):
+            self.gps_latency = GPSLatency()
+            self.gps_thread, self.gps_worker = start_gps_thread(GPS_PORT, 4800)
 
         self.ramps_input.returnPressed.connect(self.line_entered)
+        self.log = LogSink(self.ramps_output, parent=self)
+
+        self.gps_worker.fixSignal.connect(self.on_gps_fix)
 
-        self.gps_qobject.messageSignal.connect(self.on_gps_read)
+        self.scheduler = tracking.TrackingScheduler(self.sun_to_axes, target=TARGET)
+        # Fires when the scheduler says the next tracking move is due.
+        self.track_timer = QtCore.QTimer()
+        self.track_timer.setSingleShot(True)
+        self.track_timer.timeout.connect(self.send_move_to_sun)
 
         self.state = STATE_INIT
         self.send_line("$HX")
@@ -46,12 +77,36 @@ class MainWindow(QtWidgets.QMainWindow):
         self.ramps_input.clear()
 
     def send_line(self, line):
-        self.ramps_output.insertPlainText("Sent: " + line)
-        self.ramps_output.insertPlainText("\n")
-        self.grblesp32.send_line(line)
+        self.log.add("Sent: " + line)
+        self.streamer.send(line)
+
+    def write_ramps(self, data):
+        self.grblesp32.send_line(data.decode('ascii').strip())
+
+    def on_ramps_connection(self, connected):
+        if connected:
+            # Responses to anything sent before the WebSocket dropped are gone.
+            self.streamer.drop_in_flight()
+        print("controller connection:", self.grblesp32.summary())
+
+    def on_ramps_lost(self, lines):
+        # They may have run or not, and their oks won't be counted either
+        # way.  Moves are absolute, so the next one is sent in full, and a
+        # status report shows where the axes actually are.
+        self.streamer.drop_in_flight()
+        self.moves.reset()
+        self.grblesp32.send_realtime(grbl.CMD_STATUS_REPORT)
 
     def on_ramps_read(self, data):
+        # data is one complete response line.
         d = data.strip()
+        self.streamer.on_line(d)
+        self.moves.flush()
+        self.log.add(data)
+        if d[:1] in ('<', '[') or not d or d.startswith('Grbl '):
+            # Status reports, messages and the welcome banner don't answer a
+            # command.
+            return
         if self.state == STATE_INIT:
             print("in STATE_INIT, got", d)
             if d == 'ok':
@@ -67,6 +122,8 @@ class MainWindow(QtWidgets.QMainWindow):
                 print("got ok")
                 self.state = STATE_HOMED_Y
                 self.send_line("G10 L20 P1 X0 Y0")
+                self.moves.reset()
+                self.scheduler.reset()
             else:
                 print("got unexpected data:", d)
                 self.state = STATE_ERROR
@@ -75,53 +132,43 @@ class MainWindow(QtWidgets.QMainWindow):
             if d == 'ok':
                 print("got ok")
                 self.state = STATE_READY
+                self.track_timer.start(0)
             else:
                 print("got unexpected data:", d)
                 self.state = STATE_ERROR    
-        elif self.state == STATE_SENDING_COMMAND:
-            print("in STATE_SENDING_COMMAND, got", d)
-            if d == 'ok':
-                print("got ok")
-                self.state = STATE_READY
-            else:
-                print("got unexpected data:", d)
-                self.state = STATE_ERROR  
-        self.ramps_output.insertPlainText(data)
-        self.ramps_output.verticalScrollBar().setValue(self.ramps_output.verticalScrollBar().maximum())
-
-
-    def on_gps_read(self, data):
-        try:
-            msg = pynmea2.parse(data)
-        except pynmea2.ParseError:
-            print("failed to parse")
-        else:
-            if (msg.sentence_type == 'RMC'):
-                if msg.latitude == 0 and msg.longitude == 0:
-                    print("Ignoring obviously wrong", msg)
-                    return
-                result = getSunPos(msg.latitude, msg.longitude, msg.datetime)
-                self.gps_location.setText(f"{msg.latitude:.2f} {msg.longitude:.2f}")
-                self.gps_time.setText(str(msg.datetime))
-                self.sun_position.setText(f"Alt: {result.alt.degree:.2f} Az: {result.az.degree:.2f}")
-                
-                self.xaz = result.az.degree
-                self.xalt = (90-result.alt.degree)
-                if self.state == STATE_READY:
-                    self.send_move_to_sun()
-                    
 
-    def send_move_to_sun(self):
-        if not self.tracking.checkState():
-            return
 
-        if self.state == STATE_READY:
-            
-            cmd = "G0 X%.3f Y%.3f F500\r\n" % (self.xaz+self.az_nudge.value(), self.xalt+self.alt_nudge.value())
-            self.state = STATE_SENDING_COMMAND
-            self.send_line(cmd)
-        else:
+    def on_gps_fix(self, fix):
+        self.gps_latency.add(fix)
+        if self.gps_latency.count % REPORT_EVERY == 0:
+            print("GPS latency:", self.gps_latency.summary())
+        self.gps_location.setText(f"{fix.latitude:.2f} {fix.longitude:.2f}")
+        self.gps_time.setText(str(fix.datetime))
+        self.sun_position.setText(f"Alt: {fix.alt:.2f} Az: {fix.az:.2f}")
+
+        self.scheduler.set_fix(fix.latitude, fix.longitude, fix.datetime)
+
+    def sun_to_axes(self, alt, az):
+        x, y = mirror.HELIOSTAT_UI_MOUNT.joints(alt, az)
+        return x + self.az_nudge.value(), y + self.alt_nudge.value()
+
+    def send_move_to_sun(self):
+        if self.state != STATE_READY:
             print("Ignoring command in STATE", self.state)
+            return
+        if not self.tracking.checkState() or not self.scheduler.ready():
+            # Not tracking or no fix yet; look again shortly.
+            self.track_timer.start(1000)
+            return
+        move = self.scheduler.plan(latency=self.streamer.latency)
+        if move is None:
+            print("No mirror direction for the sun and target, trying again")
+            self.track_timer.start(int(self.scheduler.min_interval * 1000))
+            return
+        self.moves.move_to(*move.target)
+        self.track_timer.start(int(move.interval * 1000))
+        if self.scheduler.moves % 60 == 0:
+            print("Moves:", self.moves.summary())
 
     def down_button_clicked(self):
         self.alt_nudge.setValue(self.alt_nudge.value() - 0.5)
@@ -151,8 +198,10 @@ class MainWindow(QtWidgets.QMainWindow):
 
 def main():
     app = QtWidgets.QApplication(sys.argv)
-    main = MainWindow()
+    with startup_profile.section("MainWindow"):
+        main = MainWindow()
     main.show()
+    QtCore.QTimer.singleShot(0, startup_profile.report)
     sys.exit(app.exec_())
 
 if __name__ == '__main__':      
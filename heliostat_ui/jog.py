@@ -0,0 +1,134 @@
+# Continuous jogging with Grbl's $J= jog commands.
+#
+# While a button is held, short jog segments are streamed one at a time, so
+# Grbl only ever has the next fraction of a second of motion queued.  Letting
+# go sends the jog-cancel realtime byte: Grbl decelerates straight away and
+# throws away whatever jog motion is left in the planner, instead of working
+# through a queue of G0 moves built up by auto-repeat.
+import time
+
+from PyQt5 import QtCore
+
+import grbl
+
+# Jog feed rate in units/min, the same as the $110/$111 rapid rate.
+JOG_RATE = 500
+# Motion per $J= segment, in seconds at JOG_RATE.
+SEGMENT_TIME = 0.1
+# A jog stops by itself if start() isn't repeated within this many seconds,
+# for callers that can lose the release, e.g. over MQTT.  None disables it.
+KEEPALIVE = None
+# Status poll interval while waiting for a cancelled jog to stop.
+POLL_MS = 20
+# Give up polling if Grbl hasn't reported the stop within this many seconds.
+STOP_TIMEOUT = 1.0
+
+
+class Jogger(QtCore.QObject):
+    # Seconds from stop() to Grbl reporting it has stopped.
+    stoppedSignal = QtCore.pyqtSignal(float)
+
+    def __init__(self, streamer, realtime, rate=JOG_RATE, segment_time=SEGMENT_TIME,
+                 keepalive=KEEPALIVE, stop_timeout=STOP_TIMEOUT, parent=None):
+        super(Jogger, self).__init__(parent)
+        # streamer is the GrblStreamer the transport sends lines through;
+        # realtime(data) writes realtime bytes straight to the controller.
+        self.streamer = streamer
+        self.realtime = realtime
+        self.rate = rate
+        self.segment_time = segment_time
+        self.keepalive = keepalive
+        self.stop_timeout = stop_timeout
+        self.direction = None
+        self.requested = None
+        self.released = None
+        self.segments = 0
+        self.jogs = 0
+        self.stop_latencies = []
+        # Stops never confirmed by a status report.
+        self.stop_timeouts = 0
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(int(segment_time * 1000))
+        self.timer.timeout.connect(self.top_up)
+        self.poll_timer = QtCore.QTimer(self)
+        self.poll_timer.setInterval(POLL_MS)
+        self.poll_timer.timeout.connect(self.poll)
+
+    def start(self, **direction):
+        """Jog until stop(), e.g. start(y=1) or start(x=-1).  Repeating the
+        same start() just refreshes the keepalive."""
+        self.requested = time.monotonic()
+        direction = dict((axis.upper(), step) for axis, step in direction.items())
+        if direction == self.direction:
+            return
+        if self.direction is not None:
+            self.stop()
+        self.direction = direction
+        self.released = None
+        self.poll_timer.stop()
+        self.jogs += 1
+        self.top_up()
+        self.timer.start()
+
+    def stop(self):
+        if self.direction is None:
+            return
+        self.direction = None
+        self.timer.stop()
+        self.realtime(grbl.CMD_JOG_CANCEL)
+        self.released = time.perf_counter()
+        self.poll_timer.start()
+
+    def jogging(self):
+        return self.direction is not None
+
+    def top_up(self):
+        if self.direction is None:
+            return
+        if self.keepalive is not None and time.monotonic() - self.requested > self.keepalive:
+            print("jog keepalive expired")
+            self.stop()
+            return
+        # One segment unacknowledged at a time, so a cancel never leaves more
+        # than one sitting in Grbl's receive buffer to run afterwards.
+        if not self.streamer.idle():
+            return
+        distance = self.rate / 60.0 * self.segment_time
+        words = " ".join("%s%.3f" % (axis, step * distance) for axis, step in sorted(self.direction.items()))
+        self.streamer.send("$J=G91 %s F%d" % (words, self.rate))
+        self.segments += 1
+
+    def poll(self):
+        if self.released is None:
+            self.poll_timer.stop()
+            return
+        lost = self.streamer.is_open is not None and not self.streamer.is_open()
+        waited = time.perf_counter() - self.released
+        if lost or waited > self.stop_timeout:
+            print("jog stop not confirmed: %s" % ("link lost" if lost else "no status after %.1f s" % waited))
+            self.released = None
+            self.poll_timer.stop()
+            self.stop_timeouts += 1
+            return
+        self.realtime(grbl.CMD_STATUS_REPORT)
+
+    def on_status(self, report):
+        """Feed status reports here; they tell when a cancelled jog has
+        stopped."""
+        if self.released is None or report.state == 'Jog':
+            return
+        latency = time.perf_counter() - self.released
+        self.released = None
+        self.poll_timer.stop()
+        self.stop_latencies.append(latency)
+        self.stoppedSignal.emit(latency)
+
+    def summary(self):
+        text = "%d jogs, %d segments" % (self.jogs, self.segments)
+        if self.stop_latencies:
+            text += ", stop latency mean %.0f max %.0f ms" % (
+                sum(self.stop_latencies) / len(self.stop_latencies) * 1e3, max(self.stop_latencies) * 1e3)
+        if self.stop_timeouts:
+            text += ", %d stops unconfirmed" % self.stop_timeouts
+        return text
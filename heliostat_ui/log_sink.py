@@ -0,0 +1,168 @@
+# Terminal log for a QPlainTextEdit that stays cheap over weeks of uptime:
+# lines are collected and appended in one batch per FLUSH_MS, the widget keeps
+# only the newest MAX_LINES, status reports are left out, and an optional
+# on-disk copy rotates at a fixed size.
+import collections
+import os
+import time
+
+from PyQt5 import QtCore
+
+MAX_LINES = 2000
+FLUSH_MS = 100
+# Status reports arrive several times a second and are shown elsewhere.
+QUIET_PREFIXES = ('<',)
+MAX_BYTES = 10 * 1024 * 1024
+BACKUP_COUNT = 5
+
+
+class RotatingFile:
+    """Appends lines to path, moving it to path.1 (path.1 to path.2, ...)
+    once it grows past max_bytes and keeping backup_count old files.  If the
+    disk fails it stops writing (self.file is None) rather than raising."""
+
+    def __init__(self, path, max_bytes=MAX_BYTES, backup_count=BACKUP_COUNT):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.file = None
+        try:
+            self.file = open(path, 'a')
+        except OSError as ex:
+            self.disable(ex)
+
+    def write(self, line):
+        if self.file is None:
+            return
+        try:
+            self.file.write(time.strftime('%Y-%m-%d %H:%M:%S ') + line + '\n')
+        except OSError as ex:
+            self.disable(ex)
+
+    def flush(self):
+        if self.file is None:
+            return
+        try:
+            self.file.flush()
+            if self.file.tell() >= self.max_bytes:
+                self.rotate()
+        except OSError as ex:
+            self.disable(ex)
+
+    def rotate(self):
+        self.file.close()
+        self.file = None
+        for i in range(self.backup_count - 1, 0, -1):
+            if os.path.exists("%s.%d" % (self.path, i)):
+                os.replace("%s.%d" % (self.path, i), "%s.%d" % (self.path, i + 1))
+        if self.backup_count:
+            os.replace(self.path, self.path + ".1")
+        else:
+            os.remove(self.path)
+        self.file = open(self.path, 'a')
+
+    def disable(self, ex):
+        print("Log file %s disabled:" % self.path, ex)
+        self.close()
+
+    def close(self):
+        if self.file is not None:
+            try:
+                self.file.close()
+            except OSError:
+                pass
+            self.file = None
+
+
+class LogSink(QtCore.QObject):
+    def __init__(self, widget, max_lines=MAX_LINES, flush_ms=FLUSH_MS, quiet=QUIET_PREFIXES,
+                 path=None, max_bytes=MAX_BYTES, backup_count=BACKUP_COUNT, parent=None):
+        super(LogSink, self).__init__(parent)
+        self.widget = widget
+        # The document drops its oldest lines itself past this.
+        self.widget.document().setMaximumBlockCount(max_lines)
+        self.quiet = tuple(quiet)
+        # Lines waiting for the next flush.  Bounded too: if more than a
+        # screenful arrives between flushes, the oldest would scroll straight
+        # out of the view anyway.
+        self.pending = collections.deque(maxlen=max_lines)
+        self.file = RotatingFile(path, max_bytes, backup_count) if path else None
+        self.lines = 0
+        self.filtered = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(flush_ms)
+        self.timer.timeout.connect(self.flush)
+
+    def add(self, line):
+        if line.startswith(self.quiet):
+            self.filtered += 1
+            return
+        self.lines += 1
+        if self.file is not None:
+            # Does nothing once the disk has failed; the view carries on.
+            self.file.write(line)
+        if len(self.pending) == self.pending.maxlen:
+            self.dropped += 1
+        self.pending.append(line)
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def flush(self):
+        if self.file is not None:
+            self.file.flush()
+        if not self.pending:
+            return
+        lines = list(self.pending)
+        self.pending.clear()
+        self.flushes += 1
+        scroll = self.widget.verticalScrollBar()
+        # Only follow the output if the view was already at the bottom.
+        follow = scroll.value() == scroll.maximum()
+        self.widget.appendPlainText('\n'.join(lines))
+        if follow:
+            scroll.setValue(scroll.maximum())
+
+    def summary(self):
+        return "%d lines in %d flushes, %d filtered, %d dropped, %d in view" % (
+            self.lines, self.flushes, self.filtered, self.dropped, self.widget.blockCount())
+
+
+if __name__ == '__main__':
+    import sys
+    import tempfile
+
+    from PyQt5 import QtWidgets
+
+    app = QtWidgets.QApplication(sys.argv)
+    text = QtWidgets.QPlainTextEdit()
+    text.show()
+    path = os.path.join(tempfile.mkdtemp(), 'grbl.log')
+    sink = LogSink(text, max_bytes=1024 * 1024, path=path)
+
+    # A day of 1 Hz polling and tracking, replayed as fast as possible.
+    n = 86400
+    t0 = time.perf_counter()
+    for i in range(n):
+        sink.add("<Idle|WPos:%.3f,%.3f,0.000|FS:0,0>" % (i * 0.001, i * 0.002))
+        sink.add("Sent: G0 X%.3f Y%.3f" % (i * 0.001, i * 0.002))
+        sink.add("ok")
+        if i % 100 == 0:
+            app.processEvents()
+    sink.flush()
+    batched = time.perf_counter() - t0
+    print("batched: %.2f s (%.1f us/line), %s, %d log files" % (
+        batched, batched / (3 * n) * 1e6, sink.summary(), len(os.listdir(os.path.dirname(path)))))
+
+    text = QtWidgets.QPlainTextEdit()
+    text.show()
+    n = 5000
+    t0 = time.perf_counter()
+    for i in range(n):
+        text.appendPlainText("Sent: G0 X%.3f Y%.3f" % (i * 0.001, i * 0.002))
+        text.appendPlainText("ok")
+        app.processEvents()
+    print("per line, unbounded: %.2f s for %d lines (%.0f us/line)" % (
+        time.perf_counter() - t0, 2 * n, (time.perf_counter() - t0) / (2 * n) * 1e6))
@@ -0,0 +1,185 @@
+# Heliostat geometry.
+#
+# A heliostat reflects the sun onto a fixed target, so its mirror has to face
+# the bisector of the sun and target directions, not the sun itself.  All
+# directions are (alt, az) in degrees, azimuth clockwise from north, and every
+# function takes numpy arrays (broadcast against each other) as well as
+# scalars, so a whole day can be solved in one call.
+import datetime
+import math
+
+import numpy as np
+
+
+def altaz_to_vector(alt, az):
+    """Unit (east, north, up) vectors for alt/az in degrees; shape (..., 3)."""
+    alt = np.radians(alt)
+    az = np.radians(az)
+    return np.stack(np.broadcast_arrays(np.cos(alt) * np.sin(az),
+                                        np.cos(alt) * np.cos(az),
+                                        np.sin(alt)), axis=-1)
+
+
+def vector_to_altaz(v):
+    """(alt, az) in degrees of (east, north, up) vectors; az is in [0, 360)."""
+    v = np.asarray(v, dtype=float)
+    e, n, u = v[..., 0], v[..., 1], v[..., 2]
+    alt = np.degrees(np.arctan2(u, np.hypot(e, n)))
+    az = np.degrees(np.arctan2(e, n)) % 360.0
+    return alt, az
+
+
+def offset_to_altaz(east, north, up):
+    """Direction (alt, az) from the mirror to a target east/north/up of it,
+    in any length unit."""
+    return vector_to_altaz(np.stack(np.broadcast_arrays(east, north, up), axis=-1))
+
+
+def mirror_normal(sun_alt, sun_az, target_alt, target_az):
+    """Mirror normal (alt, az) that reflects the sun onto the target.
+
+    The normal bisects the sun and target directions.  Where they are
+    opposite (the target is straight in front of the sun) there is no
+    solution and nan is returned.
+    """
+    s = altaz_to_vector(sun_alt, sun_az)
+    t = altaz_to_vector(target_alt, target_az)
+    h = s + t
+    norm = np.linalg.norm(h, axis=-1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        h = np.where(norm > 1e-9, h / norm, np.nan)
+    alt, az = vector_to_altaz(h)
+    if np.ndim(alt) == 0:
+        return float(alt), float(az)
+    return alt, az
+
+
+def reflect(normal_alt, normal_az, sun_alt, sun_az):
+    """Direction (alt, az) the sun is reflected to by a mirror facing
+    normal."""
+    n = altaz_to_vector(normal_alt, normal_az)
+    s = altaz_to_vector(sun_alt, sun_az)
+    r = 2 * np.sum(n * s, axis=-1, keepdims=True) * n - s
+    return vector_to_altaz(r)
+
+
+class Mount:
+    """Maps a pointing direction to the joint angles of an alt-az mount:
+    x = az_sign * az + az_offset, y = alt_sign * alt + alt_offset.
+
+    FULL_APP_MOUNT and HELIOSTAT_UI_MOUNT are the conventions those two apps
+    have always used.
+    """
+    __slots__ = ('az_sign', 'az_offset', 'alt_sign', 'alt_offset')
+
+    def __init__(self, az_sign=1, az_offset=0.0, alt_sign=-1, alt_offset=90.0):
+        self.az_sign = az_sign
+        self.az_offset = az_offset
+        self.alt_sign = alt_sign
+        self.alt_offset = alt_offset
+
+    def joints(self, alt, az):
+        return self.az_sign * az + self.az_offset, self.alt_sign * alt + self.alt_offset
+
+    def day_joints(self, alt, az):
+        """joints() for a time series, with the azimuth unwrapped so the
+        axis doesn't swing all the way round when the direction crosses
+        north (0/360)."""
+        az = np.degrees(np.unwrap(np.radians(az)))
+        return self.joints(np.asarray(alt), az)
+
+
+# x = -(90 + az), y = -(90 - alt)
+FULL_APP_MOUNT = Mount(-1, -90.0, 1, -90.0)
+# x = az, y = 90 - alt
+HELIOSTAT_UI_MOUNT = Mount(1, 0.0, -1, 90.0)
+
+
+def solve_day(latitude, longitude, date, target_alt, target_az, step=60, backend=None):
+    """Mirror normals for one UTC day, every step seconds.
+
+    Returns (times, sun_alt, sun_az, normal_alt, normal_az) as arrays, with
+    times as unix timestamps; the sun positions come from
+    sun_pos.get_sun_positions in one batch.
+    """
+    from sun_pos import get_sun_positions
+    start = datetime.datetime(date.year, date.month, date.day,
+                              tzinfo=datetime.timezone.utc).timestamp()
+    times = start + np.arange(0, 86400, step, dtype=float)
+    sun_alt, sun_az = get_sun_positions(latitude, longitude, times, backend=backend)
+    normal_alt, normal_az = mirror_normal(sun_alt, sun_az, target_alt, target_az)
+    return times, sun_alt, sun_az, normal_alt, normal_az
+
+
+def _close(a, b, tolerance=1e-9):
+    return np.allclose(a, b, atol=tolerance, rtol=0)
+
+
+def _angle_between(alt1, az1, alt2, az2):
+    # atan2 rather than arccos, which loses precision at small angles.
+    v1 = altaz_to_vector(alt1, az1)
+    v2 = altaz_to_vector(alt2, az2)
+    return np.degrees(np.arctan2(np.linalg.norm(np.cross(v1, v2), axis=-1), np.sum(v1 * v2, axis=-1)))
+
+
+def check(samples=10000, seed=0):
+    """Known-geometry checks; raises AssertionError on any failure."""
+    # Sun overhead, target on the northern horizon: the mirror faces
+    # halfway between them.
+    assert _close(mirror_normal(90.0, 0.0, 0.0, 0.0), (45.0, 0.0))
+    # Sun low in the east, target at the same height in the west: the
+    # mirror lies flat.
+    alt, az = mirror_normal(30.0, 90.0, 30.0, 270.0)
+    assert _close(alt, 90.0)
+    # Target straight up: the mirror faces halfway between the sun and the
+    # zenith, on the sun's azimuth.
+    assert _close(mirror_normal(20.0, 135.0, 90.0, 0.0), (55.0, 135.0))
+    # Target where the sun is: the mirror faces the sun (a sun tracker).
+    assert _close(mirror_normal(42.0, 200.0, 42.0, 200.0), (42.0, 200.0))
+    # Sun directly behind the target: no solution.
+    assert all(math.isnan(x) for x in mirror_normal(0.0, 180.0, 0.0, 0.0))
+    # Target 10 m south of and 5 m above the mirror.
+    assert _close(offset_to_altaz(0.0, -10.0, 5.0), (math.degrees(math.atan2(5, 10)), 180.0))
+    # Azimuth wrap: the normal of sun at 350 and target at 10 is at 0, not 180.
+    alt, az = mirror_normal(0.0, 350.0, 0.0, 10.0)
+    assert _close(alt, 0.0) and min(az, 360.0 - az) < 1e-9
+
+    # Law of reflection on random geometry: the normal reflects the sun onto
+    # the target, and makes equal angles with both.
+    rng = np.random.default_rng(seed)
+    sun_alt = rng.uniform(0, 90, samples)
+    sun_az = rng.uniform(0, 360, samples)
+    target_alt = rng.uniform(-10, 90, samples)
+    target_az = rng.uniform(0, 360, samples)
+    n_alt, n_az = mirror_normal(sun_alt, sun_az, target_alt, target_az)
+    ok = ~np.isnan(n_alt)
+    assert ok.sum() > samples * 0.99
+    r_alt, r_az = reflect(n_alt[ok], n_az[ok], sun_alt[ok], sun_az[ok])
+    assert np.max(_angle_between(r_alt, r_az, target_alt[ok], target_az[ok])) < 1e-9
+    incidence = _angle_between(n_alt, n_az, sun_alt, sun_az)[ok]
+    assert _close(incidence, _angle_between(n_alt, n_az, target_alt, target_az)[ok], 1e-6)
+
+    # Mount conventions.
+    assert _close(FULL_APP_MOUNT.joints(30.0, 180.0), (-270.0, -60.0))
+    assert _close(HELIOSTAT_UI_MOUNT.joints(30.0, 180.0), (180.0, 60.0))
+    x, y = HELIOSTAT_UI_MOUNT.day_joints([10.0, 10.0, 10.0], [350.0, 359.0, 5.0])
+    assert _close(x, [350.0, 359.0, 365.0])
+
+
+if __name__ == '__main__':
+    import time
+    check()
+    print("geometry checks passed")
+
+    # A day in San Francisco with the target 20 m due north, 3 m up.
+    target = offset_to_altaz(0.0, 20.0, 3.0)
+    t0 = time.perf_counter()
+    times, sun_alt, sun_az, n_alt, n_az = solve_day(37.77, -122.42, datetime.date(2021, 6, 21),
+                                                    target[0], target[1], step=60, backend='psa')
+    elapsed = time.perf_counter() - t0
+    day = sun_alt > 0
+    x, y = FULL_APP_MOUNT.day_joints(n_alt[day], n_az[day])
+    print("target alt %.2f az %.2f; %d samples solved in %.1f ms" % (
+        target[0], target[1], len(times), elapsed * 1e3))
+    print("daylight mirror normal alt %.1f..%.1f, joints x %.1f..%.1f y %.1f..%.1f" % (
+        n_alt[day].min(), n_alt[day].max(), x.min(), x.max(), y.min(), y.max()))
@@ -0,0 +1,118 @@
+# Sits between the tracker / jog buttons and the Grbl transport.  Axis updates
+# are merged into one G0 per move, changes smaller than a step are dropped,
+# and while the controller's buffer is full only the latest target is kept,
+# so a burst of jog clicks becomes a single move instead of a planner full of
+# stale ones.
+
+# Smallest change worth sending, in axis units: one step at 250 steps/unit
+# ($100/$101 in DEFAULTS_GENERIC).
+THRESHOLD = 1.0 / 250
+AXES = 'XY'
+
+
+class MoveCoalescer:
+    def __init__(self, send, busy=None, threshold=THRESHOLD, axes=AXES, suffix=''):
+        # send(line) writes a command; busy() says whether the transport still
+        # has lines queued, e.g. lambda: streamer.queue.
+        self.send = send
+        self.busy = busy
+        self.threshold = threshold
+        self.axes = axes
+        # Appended to every move, e.g. ' F500'.
+        self.suffix = suffix
+        # Last position sent, per axis.
+        self.target = {}
+        # Newer position waiting for the transport, per axis.
+        self.pending = {}
+        # Last reported position, the base for jogs before anything is sent.
+        self.reported = {}
+        self.requested = 0
+        self.sent = 0
+        self.suppressed = 0
+        self.collapsed = 0
+
+    def reset(self):
+        """Forget the commanded position, e.g. after homing or a G10/G92."""
+        self.target.clear()
+        self.pending.clear()
+
+    def set_position(self, position):
+        """Record a reported position (a sequence in axes order)."""
+        self.reported = dict(zip(self.axes, position))
+
+    def position(self, axis):
+        """Where the axis is heading: pending, sent or reported, in that order."""
+        for known in (self.pending, self.target, self.reported):
+            if axis in known:
+                return known[axis]
+        return None
+
+    def move_to(self, *position, **axes):
+        """Move to an absolute position, given in axes order and/or by name
+        (x=..., y=...).  Axes left out stay where they are."""
+        axes = dict((a.upper(), v) for a, v in axes.items())
+        axes.update(zip(self.axes, position))
+        self.requested += 1
+        if self.pending:
+            self.collapsed += 1
+        self.pending.update(axes)
+        self.flush()
+
+    def jog(self, **steps):
+        """Move relative to where the axes are heading (x=..., y=...).
+        Returns False if the position isn't known yet."""
+        axes = {}
+        for axis, step in steps.items():
+            axis = axis.upper()
+            base = self.position(axis)
+            if base is None:
+                return False
+            axes[axis] = base + step
+        self.move_to(**axes)
+        return True
+
+    def flush(self):
+        """Send the pending move if the transport has room; call again when
+        it drains."""
+        if not self.pending or (self.busy is not None and self.busy()):
+            return False
+        words = []
+        for axis in self.axes:
+            if axis not in self.pending:
+                continue
+            value = self.pending[axis]
+            current = self.target.get(axis)
+            if current is None or abs(value - current) >= self.threshold:
+                words.append("%s%.3f" % (axis, value))
+                self.target[axis] = value
+        self.pending.clear()
+        if not words:
+            self.suppressed += 1
+            return False
+        self.send("G0 " + " ".join(words) + self.suffix)
+        self.sent += 1
+        return True
+
+    def summary(self):
+        return "%d moves requested, %d sent, %d below threshold, %d collapsed" % (
+            self.requested, self.sent, self.suppressed, self.collapsed)
+
+
+if __name__ == '__main__':
+    lines = []
+    queue = []
+    moves = MoveCoalescer(lines.append, busy=lambda: queue)
+    # Tracking: one merged command, then nothing until a step's worth of change.
+    moves.move_to(10.0, 20.0)
+    moves.move_to(10.001, 20.0)
+    moves.move_to(10.01, 20.0)
+    assert lines == ["G0 X10.000 Y20.000", "G0 X10.010"], lines
+    # Jogs while the controller is busy collapse to the latest target.
+    queue.append(True)
+    for i in range(5):
+        moves.jog(y=1)
+    moves.jog(x=-1)
+    del queue[:]
+    moves.flush()
+    assert lines[-1] == "G0 X9.010 Y25.000", lines
+    print(moves.summary())
@@ -2,13 +2,17 @@ import sys
 from PyQt5.QtSerialPort import QSerialPort
 from PyQt5 import QtCore
 
+from grbl import LineBuffer
+from grbl_stream import GrblStreamer
+
+PORT = "COM12"
+
 class QRAMPSObject(QtCore.QObject):
     messageSignal = QtCore.pyqtSignal(str)
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, port=PORT, **kwargs):
         super(QtCore.QObject, self).__init__(*args, **kwargs)
 
         self.serial = QSerialPort()
-        port = "COM12"
         self.serial.setPortName(port)
         if self.serial.open(QtCore.QIODevice.ReadWrite):
             self.serial.setDataTerminalReady(True)
@@ -16,13 +20,18 @@ class QRAMPSObject(QtCore.QObject):
             self.serial.readyRead.connect(self.on_serial_read)
         else:
             print("Failed to open RAMPS serial port", port)
+        self.lines = LineBuffer()
+        self.streamer = GrblStreamer(self.serial.write, is_open=self.serial.isOpen)
 
-        
     def send_line(self, line):
-        b = bytearray(line + '\r', 'utf-8')
-        self.serial.writeData(b)
+        self.streamer.send(line)
+
+    def send_realtime(self, data):
+        # Realtime bytes bypass the streamer; Grbl doesn't count them
+        # against its receive buffer.
+        self.serial.write(data)
         
     def on_serial_read(self, *args):
-        data = self.serial.readLine()
-        decoded = data.data().decode('US_ASCII')
-        self.messageSignal.emit(decoded)
+        for line in self.lines.feed(self.serial.readAll().data()):
+            self.streamer.on_line(line)
+            self.messageSignal.emit(line)
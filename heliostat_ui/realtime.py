@@ -0,0 +1,110 @@
+# Grbl's realtime commands: single bytes the controller picks out of the
+# serial stream as soon as they arrive, ahead of any queued G-code and without
+# an 'ok'.  RealtimeControl sends them through a transport's send_realtime()
+# rather than its line queue, so status polls don't wait behind moves and
+# don't show up in the terminal log.
+import time
+
+from PyQt5 import QtCore
+
+import grbl
+
+# Status poll rate.  A report is ~60 bytes, so even 20 Hz is a few percent
+# of a 115200 baud link.
+POLL_HZ = 10
+# A poll with no report after this long is given up on and sent again, e.g.
+# when the report was lost across a reconnect.
+POLL_TIMEOUT = 1.0
+# Weight of the newest sample in the running poll latency average.
+LATENCY_WEIGHT = 0.2
+RAPID_OVERRIDES = {100: grbl.CMD_RAPID_OVR_RESET, 50: grbl.CMD_RAPID_OVR_MEDIUM, 25: grbl.CMD_RAPID_OVR_LOW}
+
+
+class RealtimeControl(QtCore.QObject):
+    def __init__(self, send_realtime, poll_hz=POLL_HZ, parent=None):
+        super(RealtimeControl, self).__init__(parent)
+        # send_realtime(data) writes bytes straight to the controller.
+        self.send_realtime = send_realtime
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self.poll)
+        self.poll_hz = poll_hz
+        self.polled = None
+        self.polls = 0
+        self.reports = 0
+        self.skipped = 0
+        self.latency = None
+        self.latency_worst = 0.0
+
+    def start(self, poll_hz=None):
+        """Poll for status reports at poll_hz (the last rate if not given)."""
+        if poll_hz is not None:
+            self.poll_hz = poll_hz
+        self.timer.start(int(1000 / self.poll_hz))
+
+    def stop(self):
+        self.timer.stop()
+
+    def poll(self):
+        now = time.perf_counter()
+        if self.polled is not None and now - self.polled < POLL_TIMEOUT:
+            # Still waiting for the last report; don't stack polls up behind
+            # a slow link.
+            self.skipped += 1
+            return
+        self.polled = now
+        self.polls += 1
+        self.send_realtime(grbl.CMD_STATUS_REPORT)
+
+    def on_status(self, report):
+        """Feed every status report here."""
+        self.reports += 1
+        if self.polled is None:
+            return
+        latency = time.perf_counter() - self.polled
+        self.polled = None
+        self.latency_worst = max(self.latency_worst, latency)
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += LATENCY_WEIGHT * (latency - self.latency)
+
+    def feed_hold(self):
+        self.send_realtime(grbl.CMD_FEED_HOLD)
+
+    def resume(self):
+        self.send_realtime(grbl.CMD_CYCLE_START)
+
+    def soft_reset(self):
+        self.send_realtime(grbl.CMD_RESET)
+
+    def jog_cancel(self):
+        self.send_realtime(grbl.CMD_JOG_CANCEL)
+
+    def feed_override(self, percent):
+        """Set the feed override to percent (10-200, as Grbl limits it)."""
+        self.send_realtime(feed_override_bytes(percent))
+
+    def rapid_override(self, percent):
+        """Set the rapid override to 100, 50 or 25 percent."""
+        if percent not in RAPID_OVERRIDES:
+            raise ValueError("rapid override must be one of %s" % sorted(RAPID_OVERRIDES))
+        self.send_realtime(RAPID_OVERRIDES[percent])
+
+    def summary(self):
+        return "%d polls, %d reports, %d skipped, latency %s/%.2f ms (mean/max)" % (
+            self.polls, self.reports, self.skipped,
+            "%.2f" % (self.latency * 1e3) if self.latency is not None else '-',
+            self.latency_worst * 1e3)
+
+
+def feed_override_bytes(percent):
+    """Realtime bytes that take the feed override to percent: a reset to
+    100%, then coarse (10%) and fine (1%) steps."""
+    percent = max(10, min(200, int(round(percent))))
+    difference = percent - 100
+    coarse, fine = divmod(abs(difference), 10)
+    if difference >= 0:
+        steps = grbl.CMD_FEED_OVR_COARSE_PLUS * coarse + grbl.CMD_FEED_OVR_FINE_PLUS * fine
+    else:
+        steps = grbl.CMD_FEED_OVR_COARSE_MINUS * coarse + grbl.CMD_FEED_OVR_FINE_MINUS * fine
+    return grbl.CMD_FEED_OVR_RESET + steps
@@ -0,0 +1,98 @@
+# Startup timing for the Qt apps, enabled with --profile-startup.
+#
+# Records how long each import and each widget construction takes, prints a
+# breakdown once the window has been shown, and afterwards reports any slow
+# import that only happens later (e.g. astropy on the first GPS fix), so
+# regressions in what gets loaded eagerly are easy to spot.
+import builtins
+import contextlib
+import sys
+import threading
+import time
+
+FLAG = '--profile-startup'
+# Later imports faster than this are not worth reporting.
+DEFERRED_THRESHOLD = 0.01
+TOP_IMPORTS = 15
+
+_enabled = False
+_start = time.perf_counter()
+_imports = []
+_sections = []
+# Import nesting depth, per thread: the GPS and camera threads import while
+# the GUI thread does.
+_local = threading.local()
+_reported = False
+_original_import = builtins.__import__
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    if level or (name in sys.modules and not fromlist):
+        return _original_import(name, globals, locals, fromlist, level)
+    depth = getattr(_local, 'depth', 0)
+    _local.depth = depth + 1
+    t0 = time.perf_counter()
+    try:
+        return _original_import(name, globals, locals, fromlist, level)
+    finally:
+        _local.depth = depth
+        elapsed = time.perf_counter() - t0
+        # Only imports made directly by our code; nested ones are already
+        # included in their parent's time.
+        if depth == 0:
+            thread = threading.current_thread()
+            if thread is not threading.main_thread():
+                name = "%s (%s)" % (name, thread.name)
+            _imports.append((name, elapsed, t0 - _start))
+            if _reported and elapsed >= DEFERRED_THRESHOLD:
+                print("startup: deferred import %-30s %7.1f ms at %.2f s" % (
+                    name, elapsed * 1e3, t0 - _start), file=sys.stderr)
+
+
+def enable_from_argv(argv=sys.argv):
+    """Turn profiling on if FLAG is in argv, removing it so Qt never sees it."""
+    if FLAG in argv:
+        argv.remove(FLAG)
+        enable()
+
+
+def enable():
+    global _enabled
+    _enabled = True
+    builtins.__import__ = _timed_import
+
+
+def enabled():
+    return _enabled
+
+
+@contextlib.contextmanager
+def section(name):
+    if not _enabled:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - t0
+        _sections.append((name, elapsed, t0 - _start))
+        if _reported:
+            print("startup: deferred %-37s %7.1f ms at %.2f s" % (
+                name, elapsed * 1e3, t0 - _start), file=sys.stderr)
+
+
+def report(file=sys.stderr):
+    global _reported
+    if not _enabled or _reported:
+        return
+    _reported = True
+    total = time.perf_counter() - _start
+    print("startup: first frame after %.1f ms" % (total * 1e3), file=file)
+    print("startup: slowest imports", file=file)
+    for name, elapsed, at in sorted(_imports, key=lambda i: -i[1])[:TOP_IMPORTS]:
+        print("  %-36s %8.1f ms  (at %7.1f ms)" % (name, elapsed * 1e3, at * 1e3), file=file)
+    print("  %-36s %8.1f ms" % ("all imports", sum(i[1] for i in _imports) * 1e3), file=file)
+    print("startup: widgets", file=file)
+    for name, elapsed, at in _sections:
+        print("  %-36s %8.1f ms  (at %7.1f ms)" % (name, elapsed * 1e3, at * 1e3), file=file)
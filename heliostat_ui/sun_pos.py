@@ -1,10 +1,53 @@
-import astropy.coordinates as coord
-from astropy.time import Time
-import astropy.units as u
+# astropy takes seconds to import on a Pi, so it is only loaded the first
+# time the 'astropy' backend is actually used.
+import numpy as np
 
 import datetime
+import os
 
-def getSunPos(latitude, longitude, t):
+import sun_algorithms
+
+# Selects the algorithm behind getSunPos and get_sun_positions: 'astropy' is
+# the reference, 'psa' the firmware's closed-form algorithm and 'spa' a
+# higher-precision closed-form one.  The last two only need numpy.
+BACKENDS = ('astropy', 'psa', 'spa')
+_NUMPY_BACKENDS = {
+    'psa': sun_algorithms.psa_sun_positions,
+    'spa': sun_algorithms.spa_sun_positions,
+}
+default_backend = os.environ.get('HELIOSTAT_SUN_BACKEND', 'astropy')
+
+def set_backend(name):
+    global default_backend
+    if name not in BACKENDS:
+        raise ValueError("unknown sun position backend %r, expected one of %s" % (name, BACKENDS))
+    default_backend = name
+
+class _Angle:
+    __slots__ = ('degree',)
+
+    def __init__(self, degree):
+        self.degree = degree
+
+class SunPosition:
+    """alt/az result of the numpy backends, shaped like the astropy AltAz result."""
+    __slots__ = ('alt', 'az')
+
+    def __init__(self, alt, az):
+        self.alt = _Angle(alt)
+        self.az = _Angle(az)
+
+    def __repr__(self):
+        return "<SunPosition alt=%.4f az=%.4f>" % (self.alt.degree, self.az.degree)
+
+def getSunPos(latitude, longitude, t, backend=None):
+    backend = backend or default_backend
+    if backend != 'astropy':
+        alt, az = _NUMPY_BACKENDS[backend](latitude, longitude, _as_unix(t))
+        return SunPosition(float(alt), float(az))
+    import astropy.coordinates as coord
+    from astropy.time import Time
+    import astropy.units as u
     loc = coord.EarthLocation(lon=longitude * u.deg,
                               lat=latitude * u.deg)
     now = Time(t)
@@ -13,5 +56,73 @@ def getSunPos(latitude, longitude, t):
     result = sun.transform_to(altaz)
     return result
 
+def _as_time(times):
+    from astropy.time import Time
+    if isinstance(times, Time):
+        return times
+    times = np.asarray(times)
+    if times.dtype.kind in 'iuf':
+        # Plain numbers are unix timestamps.
+        return Time(times, format='unix')
+    return Time(times)
+
+def _as_unix(times):
+    if hasattr(times, 'unix'):
+        # astropy Time
+        return times.unix
+    if isinstance(times, datetime.datetime):
+        if times.tzinfo is None:
+            times = times.replace(tzinfo=datetime.timezone.utc)
+        return times.timestamp()
+    times = np.asarray(times)
+    if times.dtype.kind == 'M':
+        return times.astype('datetime64[ns]').astype(np.int64) / 1e9
+    if times.dtype.kind == 'O':
+        return np.vectorize(_as_unix, otypes=[float])(times)
+    return times.astype(float)
+
+def get_sun_positions(lats, lons, times, backend=None):
+    """Sun (alt, az) in degrees for arrays of sites and times.
+
+    lats, lons and times are broadcast against each other numpy-style, so a
+    day for many sites is get_sun_positions(lats[:, None], lons[:, None],
+    times[None, :]).  times may be an astropy Time array, datetime64 values,
+    datetimes or unix timestamps.
+
+    Only the times go through astropy, in a single transform of the sun to
+    Earth-fixed (ITRS) coordinates; the per-site topocentric rotation is done
+    with broadcast numpy arithmetic and plain float arrays are returned.
+    The numpy backends skip astropy altogether.
+    """
+    backend = backend or default_backend
+    if backend != 'astropy':
+        return _NUMPY_BACKENDS[backend](lats, lons, _as_unix(times))
+    import astropy.coordinates as coord
+    import astropy.units as u
+    times = _as_time(times)
+    sun = coord.get_sun(times).transform_to(coord.ITRS(obstime=times))
+    sx = sun.cartesian.x.to_value(u.km)
+    sy = sun.cartesian.y.to_value(u.km)
+    sz = sun.cartesian.z.to_value(u.km)
+
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    site = coord.EarthLocation(lon=lons * u.deg, lat=lats * u.deg)
+    dx = sx - site.x.to_value(u.km)
+    dy = sy - site.y.to_value(u.km)
+    dz = sz - site.z.to_value(u.km)
+
+    lat = np.radians(lats)
+    lon = np.radians(lons)
+    sin_lat, cos_lat = np.sin(lat), np.cos(lat)
+    sin_lon, cos_lon = np.sin(lon), np.cos(lon)
+    east = -sin_lon * dx + cos_lon * dy
+    north = -sin_lat * cos_lon * dx - sin_lat * sin_lon * dy + cos_lat * dz
+    up = cos_lat * cos_lon * dx + cos_lat * sin_lon * dy + sin_lat * dz
+
+    alt = np.degrees(np.arctan2(up, np.hypot(east, north)))
+    az = np.degrees(np.arctan2(east, north)) % 360.0
+    return alt, az
+
 if __name__ == '__main__':
-    print(getSunPos(40, 40, datetime.datetime.now()))
\ No newline at end of file
+    print(getSunPos(40, 40, datetime.datetime.now()))
@@ -0,0 +1,92 @@
+import datetime
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from sun_pos import BACKENDS, getSunPos, get_sun_positions
+
+# The scalar loop is far too slow to run over a whole day, so its rate is
+# measured on this many calls and extrapolated.
+SCALAR_SAMPLES = 200
+
+
+def scalar_rate(lats, lons, times, backend='astropy'):
+    n = min(SCALAR_SAMPLES, len(times))
+    t0 = time.perf_counter()
+    for i in range(n):
+        getSunPos(lats[i % len(lats)], lons[i % len(lons)],
+                  datetime.datetime.fromtimestamp(times[i], datetime.timezone.utc),
+                  backend=backend)
+    return n / (time.perf_counter() - t0)
+
+
+def batch_rate(lats, lons, times, backend='astropy'):
+    t0 = time.perf_counter()
+    alt, az = get_sun_positions(lats[:, None], lons[:, None], times[None, :], backend=backend)
+    return alt.size / (time.perf_counter() - t0)
+
+
+def run(name, lats, lons, times):
+    total = len(lats) * len(times)
+    scalar = scalar_rate(lats, lons, times)
+    batch = batch_rate(lats, lons, times)
+    print("%-24s %9d positions  scalar %10.0f/s (%7.1f s)  batch %10.0f/s (%6.2f s)  x%.0f" % (
+        name, total, scalar, total / scalar, batch, total / batch, batch / scalar))
+
+
+def separation(alt1, az1, alt2, az2):
+    alt1, az1, alt2, az2 = map(np.radians, (alt1, az1, alt2, az2))
+    c = np.sin(alt1) * np.sin(alt2) + np.cos(alt1) * np.cos(alt2) * np.cos(az1 - az2)
+    return np.degrees(np.arccos(np.clip(c, -1.0, 1.0)))
+
+
+def import_time(backend):
+    # Fresh interpreter, so module caches don't hide the import cost.
+    code = ("import time; t0 = time.perf_counter(); import datetime, sun_pos; "
+            "sun_pos.getSunPos(0, 0, datetime.datetime(2021, 1, 1), backend=%r); "
+            "print(time.perf_counter() - t0)" % backend)
+    out = subprocess.run([sys.executable, '-W', 'ignore', '-c', code],
+                         cwd=os.path.dirname(os.path.abspath(__file__)),
+                         capture_output=True, text=True, check=True).stdout
+    return float(out.split()[-1])
+
+
+def compare_backends(n=10000):
+    rng = np.random.default_rng(1)
+    lats = rng.uniform(-65, 65, n)
+    lons = rng.uniform(-180, 180, n)
+    times = rng.uniform(datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc).timestamp(),
+                        datetime.datetime(2030, 1, 1, tzinfo=datetime.timezone.utc).timestamp(), n)
+    ref_alt, ref_az = get_sun_positions(lats, lons, times, backend='astropy')
+    print("%-8s %12s %12s %14s %14s %12s" % (
+        "backend", "max err \"", "mean err \"", "scalar /s", "batch /s", "first call s"))
+    for backend in BACKENDS:
+        alt, az = get_sun_positions(lats, lons, times, backend=backend)
+        err = separation(alt, az, ref_alt, ref_az) * 3600
+        scalar = scalar_rate(lats, lons, times, backend)
+        t0 = time.perf_counter()
+        get_sun_positions(lats, lons, times, backend=backend)
+        batch = n / (time.perf_counter() - t0)
+        print("%-8s %12.2f %12.2f %14.0f %14.0f %12.2f" % (
+            backend, err.max(), err.mean(), scalar, batch, import_time(backend)))
+
+
+if __name__ == '__main__':
+    start = datetime.datetime(2021, 6, 21, tzinfo=datetime.timezone.utc).timestamp()
+    # Warm up astropy (IERS tables, ephemeris) so neither side pays for it.
+    get_sun_positions(0.0, 0.0, start)
+
+    run("1 site x 86400 s",
+        np.array([37.77]), np.array([-122.42]),
+        start + np.arange(86400, dtype=float))
+
+    rng = np.random.default_rng(0)
+    run("100 sites x 1440 min",
+        rng.uniform(-60, 60, 100), rng.uniform(-180, 180, 100),
+        start + 60.0 * np.arange(1440))
+
+    print()
+    compare_backends()
@@ -0,0 +1,309 @@
+# Closed-loop tracking correction from the camera.
+#
+# SpotFinder finds the sun (or its reflection on the target) in a frame: the
+# brightest pixel of every STEP-th row and column, then an intensity-weighted
+# centroid of the pixels above THRESHOLD in a small window around it.  Once
+# it has a spot it only looks in a window around the last one, so a frame
+# costs a few thousand pixels of work whatever its size.  OffsetCorrector
+# turns the spot's distance from the aim point into a slow, bounded change
+# to the tracking offsets, so a misdetection can only drag the mirror a
+# little way.
+import math
+
+import numpy as np
+
+# Coarse search stride, in pixels.
+STEP = 4
+# Half-size of the centroid window, in pixels; it is doubled (up to the whole
+# frame) while the spot runs off its edge.
+WINDOW = 24
+# Pixels count towards the spot above this fraction of the way from the
+# window's mean to its peak.
+THRESHOLD = 0.5
+# A peak dimmer than this isn't the sun, e.g. it's behind cloud.
+MIN_PEAK = 64
+# Fewer pixels than this is a glint or noise.
+MIN_PIXELS = 4
+
+# Axis degrees per pixel of spot error, for the x and y axes from the image x
+# and y.  The signs depend on how the camera is mounted: jog one axis and
+# see which way the spot moves.
+DEG_PER_PIXEL = (-0.01, 0.01)
+# Fraction of the error corrected per update.
+GAIN = 0.5
+# Fastest the offsets may change, in axis degrees per second.
+MAX_RATE = 0.05
+# Errors within this many pixels are left alone.
+DEADBAND = 1.0
+# Largest total correction, in axis degrees.
+MAX_OFFSET = 5.0
+# Longest gap between spots that still counts towards the rate limit, so the
+# first spot after an outage can't make up for the whole outage at once.
+MAX_DT = 1.0
+
+
+class Spot:
+    """Centroid (x, y) in frame pixels, with the number of pixels above the
+    threshold, the peak value, the frame size and the frame's time."""
+    __slots__ = ('x', 'y', 'pixels', 'peak', 'width', 'height', 't')
+
+    def __init__(self, x, y, pixels, peak, width, height, t):
+        self.x = x
+        self.y = y
+        self.pixels = pixels
+        self.peak = peak
+        self.width = width
+        self.height = height
+        self.t = t
+
+    def __repr__(self):
+        return "<Spot %.2f,%.2f %d px peak %d>" % (self.x, self.y, self.pixels, self.peak)
+
+
+class SpotFinder:
+    def __init__(self, step=STEP, window=WINDOW, threshold=THRESHOLD, min_peak=MIN_PEAK,
+                 min_pixels=MIN_PIXELS):
+        self.step = step
+        self.window = window
+        self.threshold = threshold
+        self.min_peak = min_peak
+        self.min_pixels = min_pixels
+        self.last = None
+        self.frames = 0
+        self.found = 0
+        self.searches = 0
+
+    def find(self, frame, t=0.0):
+        """The spot in frame (a 2-D array, or colour with channels last, of
+        which the second, green, is used), or None."""
+        self.frames += 1
+        if frame.ndim == 3:
+            frame = frame[..., 1]
+        spot = None
+        if self.last is not None:
+            spot = self.centroid(frame, self.last.x, self.last.y, t)
+        if spot is None:
+            self.searches += 1
+            coarse = frame[::self.step, ::self.step]
+            y, x = np.unravel_index(np.argmax(coarse), coarse.shape)
+            if coarse[y, x] >= self.min_peak:
+                spot = self.centroid(frame, x * self.step, y * self.step, t)
+        self.last = spot
+        if spot is not None:
+            self.found += 1
+        return spot
+
+    def centroid(self, frame, cx, cy, t):
+        height, width = frame.shape
+        window = self.window
+        while True:
+            x0 = max(0, int(cx) - window)
+            x1 = min(width, int(cx) + window + 1)
+            y0 = max(0, int(cy) - window)
+            y1 = min(height, int(cy) + window + 1)
+            roi = frame[y0:y1, x0:x1]
+            peak = int(roi.max())
+            if peak < self.min_peak:
+                return None
+            level = roi.mean()
+            level += self.threshold * (peak - level)
+            weights = roi.astype(np.float32)
+            weights -= level
+            np.maximum(weights, 0, out=weights)
+            columns = weights.sum(axis=0)
+            rows = weights.sum(axis=1)
+            # Grow the window while the spot reaches its edge.
+            edge = ((x0 > 0 and columns[0] > 0) or (x1 < width and columns[-1] > 0) or
+                    (y0 > 0 and rows[0] > 0) or (y1 < height and rows[-1] > 0))
+            if not edge or (x1 - x0 >= width and y1 - y0 >= height):
+                break
+            window *= 2
+        total = columns.sum()
+        pixels = int(np.count_nonzero(weights))
+        if total <= 0 or pixels < self.min_pixels:
+            return None
+        x = float(columns @ np.arange(x0, x1)) / total
+        y = float(rows @ np.arange(y0, y1)) / total
+        return Spot(x, y, pixels, peak, width, height, t)
+
+    def summary(self):
+        return "%d frames, spot in %d, %d full searches" % (self.frames, self.found, self.searches)
+
+
+class OffsetCorrector:
+    def __init__(self, aim=None, deg_per_pixel=DEG_PER_PIXEL, gain=GAIN, max_rate=MAX_RATE,
+                 deadband=DEADBAND, max_offset=MAX_OFFSET):
+        # The pixel the spot should be at; None for the frame centre.
+        self.aim = aim
+        self.deg_per_pixel = deg_per_pixel
+        self.gain = gain
+        self.max_rate = max_rate
+        self.deadband = deadband
+        self.max_offset = max_offset
+        self.offset = [0.0, 0.0]
+        self.last = None
+        self.updates = 0
+        self.corrections = 0
+        self.limited = 0
+        self.error = None
+
+    def error_pixels(self, spot):
+        aim = self.aim if self.aim is not None else ((spot.width - 1) / 2.0, (spot.height - 1) / 2.0)
+        return spot.x - aim[0], spot.y - aim[1]
+
+    def update(self, spot):
+        """Move the offsets towards putting spot on the aim point; returns
+        True if they changed."""
+        self.updates += 1
+        dt = 0.0 if self.last is None else min(MAX_DT, max(0.0, spot.t - self.last))
+        self.last = spot.t
+        error = self.error_pixels(spot)
+        self.error = math.hypot(*error)
+        if self.error < self.deadband or dt <= 0:
+            return False
+        step = self.max_rate * dt
+        for axis in range(2):
+            delta = -self.gain * self.deg_per_pixel[axis] * error[axis]
+            if abs(delta) > step:
+                self.limited += 1
+                delta = math.copysign(step, delta)
+            self.offset[axis] = max(-self.max_offset, min(self.max_offset, self.offset[axis] + delta))
+        self.corrections += 1
+        return True
+
+    def reset(self):
+        self.offset = [0.0, 0.0]
+        self.last = None
+
+    def summary(self):
+        return "offset %.3f,%.3f, %d corrections in %d spots (%d rate limited), error %s px" % (
+            self.offset[0], self.offset[1], self.corrections, self.updates, self.limited,
+            "%.1f" % self.error if self.error is not None else '-')
+
+
+def synthetic_frame(width, height, x, y, radius, peak=255, background=20, noise=4.0,
+                    channels=None, rng=None):
+    """A uint8 frame with a sun disk of radius pixels centred on (x, y), a
+    soft edge, a background level and Gaussian noise."""
+    if rng is None:
+        rng = np.random.default_rng(0)
+    yy, xx = np.mgrid[0:height, 0:width]
+    r = np.hypot(xx - x, yy - y)
+    frame = background + (peak - background) * np.clip(radius + 0.5 - r, 0.0, 1.0)
+    frame = frame + rng.normal(0.0, noise, frame.shape)
+    frame = np.clip(frame, 0, 255).astype(np.uint8)
+    if channels is not None:
+        frame = np.repeat(frame[..., None], channels, axis=2)
+    return frame
+
+
+def check(samples=200, seed=1):
+    """Synthetic-frame checks; raises AssertionError on any failure."""
+    rng = np.random.default_rng(seed)
+    width, height = 682, 512
+    errors = []
+    for i in range(samples):
+        x = rng.uniform(20, width - 20)
+        y = rng.uniform(20, height - 20)
+        radius = rng.uniform(2, 12)
+        spot = SpotFinder().find(synthetic_frame(width, height, x, y, radius, rng=rng))
+        assert spot is not None, (x, y, radius)
+        errors.append(math.hypot(spot.x - x, spot.y - y))
+    assert max(errors) < 0.25, max(errors)
+
+    # A disk far bigger than the window, e.g. a defocused sun: still centred.
+    spot = SpotFinder().find(synthetic_frame(width, height, 300.3, 200.7, 90, rng=rng))
+    assert abs(spot.x - 300.3) < 0.25 and abs(spot.y - 200.7) < 0.25, spot
+    # Against an edge, the centroid is of the part that's visible.
+    spot = SpotFinder().find(synthetic_frame(width, height, 2.0, 250.0, 6, rng=rng))
+    assert spot is not None and spot.x < 4
+    # Nothing there, or only a dim blob (cloud): no spot.
+    assert SpotFinder().find(synthetic_frame(width, height, 0, 0, 0, peak=20, rng=rng)) is None
+    assert SpotFinder().find(synthetic_frame(width, height, 300, 200, 10, peak=50, rng=rng)) is None
+    # A single hot pixel is not a spot.
+    frame = synthetic_frame(width, height, 0, 0, 0, peak=20, rng=rng)
+    frame[100, 100] = 255
+    assert SpotFinder().find(frame) is None
+    # The brighter of two: the sun wins over a dimmer reflection.
+    frame = np.maximum(synthetic_frame(width, height, 100, 100, 6, peak=150, rng=rng),
+                       synthetic_frame(width, height, 500, 400, 6, rng=rng))
+    spot = SpotFinder().find(frame)
+    assert abs(spot.x - 500) < 0.5 and abs(spot.y - 400) < 0.5, spot
+    # Colour frames use the green channel.
+    spot = SpotFinder().find(synthetic_frame(width, height, 123.4, 321.0, 5, channels=4, rng=rng))
+    assert abs(spot.x - 123.4) < 0.25 and abs(spot.y - 321.0) < 0.25, spot
+    # Tracking a moving spot stays in the window, and finds it again after
+    # losing it.
+    finder = SpotFinder()
+    for i in range(20):
+        spot = finder.find(synthetic_frame(width, height, 200 + i * 3.0, 300 - i * 2.0, 6, rng=rng))
+        assert abs(spot.x - (200 + i * 3.0)) < 0.25
+    assert finder.searches == 1, finder.searches
+    assert finder.find(synthetic_frame(width, height, 0, 0, 0, peak=20, rng=rng)) is None
+    assert finder.find(synthetic_frame(width, height, 600, 100, 6, rng=rng)) is not None
+
+    # The corrector: nothing inside the deadband, never faster than
+    # max_rate, never beyond max_offset, and in the direction that
+    # reduces the error.
+    corrector = OffsetCorrector(deg_per_pixel=(0.01, 0.01), max_rate=0.05, max_offset=0.2)
+    centre = Spot((width - 1) / 2.0 + 0.5, (height - 1) / 2.0, 10, 255, width, height, 0.0)
+    assert not corrector.update(centre)
+    centre.t = 1.0
+    assert not corrector.update(centre)
+    far = Spot(width - 1.0, 0.0, 10, 255, width, height, 1.1)
+    assert corrector.update(far)
+    assert corrector.offset[0] < 0 < corrector.offset[1]
+    assert abs(corrector.offset[0]) <= 0.05 * 0.1 + 1e-12
+    for i in range(100):
+        far.t += 1.0
+        corrector.update(far)
+    assert corrector.offset == [-0.2, 0.2], corrector.offset
+
+
+if __name__ == '__main__':
+    import time
+
+    check()
+    print("sun spot checks passed")
+
+    # Cost per frame: a display-size PySpin frame and a Pi camera frame, with
+    # the spot moving a little each frame (the steady state) and in a new
+    # place every frame (a full search each time).
+    rng = np.random.default_rng(0)
+    for width, height, channels in ((682, 512, None), (800, 480, 4)):
+        frames = [synthetic_frame(width, height, 200 + i * 0.5, 200 + i * 0.3, 8,
+                                  channels=channels, rng=rng) for i in range(50)]
+        finder = SpotFinder()
+        t0 = time.perf_counter()
+        for frame in frames:
+            finder.find(frame)
+        locked = (time.perf_counter() - t0) / len(frames)
+        t0 = time.perf_counter()
+        for frame in frames:
+            SpotFinder().find(frame)
+        search = (time.perf_counter() - t0) / len(frames)
+        print("%dx%d%s: %.3f ms/frame tracking, %.3f ms/frame searching (%s)" % (
+            width, height, " colour" if channels else "", locked * 1e3, search * 1e3,
+            finder.summary()))
+
+    # Closed loop: the mount starts 0.5 and 0.3 degrees off and then drifts
+    # at the sun's rate (0.004 deg/s); the camera sees 100 pixels/degree at
+    # 2 frames a second.
+    fps = 2.0
+    drift = 0.004
+    px_per_deg = 100.0
+    width, height = 682, 512
+    corrector = OffsetCorrector(deg_per_pixel=(1 / px_per_deg, 1 / px_per_deg))
+    finder = SpotFinder()
+    worst = 0.0
+    for i in range(int(fps * 300)):
+        t = i / fps
+        error = (0.5 + drift * t + corrector.offset[0], -0.3 + corrector.offset[1])
+        spot = finder.find(synthetic_frame(width, height, (width - 1) / 2.0 + error[0] * px_per_deg,
+                                           (height - 1) / 2.0 + error[1] * px_per_deg, 8, rng=rng), t)
+        if spot is not None:
+            corrector.update(spot)
+        if t > 30:
+            worst = max(worst, max(abs(e) for e in error))
+    print("closed loop over 5 minutes: max pointing error after 30 s %.3f deg; %s" % (
+        worst, corrector.summary()))
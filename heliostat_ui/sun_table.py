@@ -0,0 +1,141 @@
+import collections
+import datetime
+import math
+import random
+import time
+
+import numpy as np
+
+from sun_pos import get_sun_positions
+
+# Default spacing between precomputed samples, in seconds.  The sun moves
+# ~0.25 degrees a minute, and interpolating the unit vector (rather than
+# alt/az) keeps the lookup well-behaved through the zenith and the 0/360
+# azimuth wrap.
+STEP_SECONDS = 60
+# Sites closer together than this (in degrees, ~1 km) share a table.
+SITE_ROUNDING = 2
+# Maximum angular error of a table lookup versus getSunPos, in degrees.
+MAX_ERROR_DEGREES = 0.02
+CACHE_SIZE = 4
+
+
+class SunTable:
+    """One UTC day of sun directions for a site, sampled every `step` seconds."""
+
+    def __init__(self, latitude, longitude, date, step=STEP_SECONDS):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.date = date
+        self.step = step
+        self.start = datetime.datetime(date.year, date.month, date.day,
+                                       tzinfo=datetime.timezone.utc).timestamp()
+
+        n = int(math.ceil(86400 / step)) + 1
+        alt, az = get_sun_positions(latitude, longitude, self.start + np.arange(n) * step)
+        alt = np.radians(alt)
+        az = np.radians(az)
+        # East, north, up components; plain lists are much faster than numpy
+        # scalars for the single-element lookups done per GPS fix.
+        self.e = (np.cos(alt) * np.sin(az)).tolist()
+        self.n = (np.cos(alt) * np.cos(az)).tolist()
+        self.u = np.sin(alt).tolist()
+
+    def lookup(self, t):
+        """Return (alt, az) in degrees for a UTC datetime or unix timestamp."""
+        if isinstance(t, datetime.datetime):
+            t = _timestamp(t)
+        x = (t - self.start) / self.step
+        i = int(x)
+        if i < 0 or i >= len(self.u) - 1:
+            raise ValueError("time %r is outside the table for %s" % (t, self.date))
+        f = x - i
+        g = 1.0 - f
+        e = g * self.e[i] + f * self.e[i + 1]
+        n = g * self.n[i] + f * self.n[i + 1]
+        up = g * self.u[i] + f * self.u[i + 1]
+        az = math.degrees(math.atan2(e, n)) % 360.0
+        alt = math.degrees(math.atan2(up, math.hypot(e, n)))
+        return alt, az
+
+
+def _timestamp(t):
+    # Naive datetimes (as produced by pynmea2 and datetime.utcnow()) are UTC.
+    if t.tzinfo is None:
+        t = t.replace(tzinfo=datetime.timezone.utc)
+    return t.timestamp()
+
+
+_tables = collections.OrderedDict()
+
+
+def get_table(latitude, longitude, date, step=STEP_SECONDS):
+    key = (round(latitude, SITE_ROUNDING), round(longitude, SITE_ROUNDING), date, step)
+    table = _tables.get(key)
+    if table is None:
+        table = SunTable(key[0], key[1], date, step)
+        _tables[key] = table
+        if len(_tables) > CACHE_SIZE:
+            _tables.popitem(last=False)
+    else:
+        _tables.move_to_end(key)
+    return table
+
+
+def getSunAltAz(latitude, longitude, t):
+    """Table-backed replacement for getSunPos returning (alt, az) in degrees.
+
+    The first call for a site and UTC day builds that day's table; later
+    calls are a couple of float interpolations.
+    """
+    if isinstance(t, datetime.datetime):
+        t = _timestamp(t)
+    date = datetime.datetime.fromtimestamp(t, datetime.timezone.utc).date()
+    return get_table(latitude, longitude, date).lookup(t)
+
+
+def separation(alt1, az1, alt2, az2):
+    """Great-circle angle between two alt/az directions, in degrees."""
+    alt1, az1, alt2, az2 = map(math.radians, (alt1, az1, alt2, az2))
+    c = (math.sin(alt1) * math.sin(alt2) +
+         math.cos(alt1) * math.cos(alt2) * math.cos(az1 - az2))
+    return math.degrees(math.acos(max(-1.0, min(1.0, c))))
+
+
+def check_accuracy(samples=200, seed=0):
+    """Compare table lookups against getSunPos at random sites and times.
+
+    Raises AssertionError if any sample is further than MAX_ERROR_DEGREES
+    from the astropy reference, otherwise returns the worst error seen.
+    """
+    from sun_pos import getSunPos
+    rng = random.Random(seed)
+    sites = [(37.77, -122.42), (0.0, 0.0), (-33.87, 151.21), (64.14, -21.94)]
+    worst = 0.0
+    for i in range(samples):
+        lat, lon = sites[i % len(sites)]
+        # Jitter within the rounding cell so the site rounding is covered too.
+        lat += rng.uniform(-0.005, 0.005)
+        lon += rng.uniform(-0.005, 0.005)
+        t = datetime.datetime(2021, 6, 21) + datetime.timedelta(seconds=rng.uniform(0, 86399))
+        ref = getSunPos(lat, lon, t, backend='astropy')
+        alt, az = getSunAltAz(lat, lon, t)
+        err = separation(alt, az, ref.alt.degree, ref.az.degree)
+        assert err < MAX_ERROR_DEGREES, (lat, lon, t, err)
+        worst = max(worst, err)
+    return worst
+
+
+if __name__ == '__main__':
+    t0 = time.perf_counter()
+    getSunAltAz(37.77, -122.42, datetime.datetime.utcnow())
+    print("table build: %.3f s" % (time.perf_counter() - t0))
+
+    n = 100000
+    now = time.time()
+    t0 = time.perf_counter()
+    for i in range(n):
+        getSunAltAz(37.77, -122.42, now + i * 0.01)
+    print("lookup: %.2f us" % ((time.perf_counter() - t0) / n * 1e6))
+
+    print("max error vs astropy: %.5f deg" % check_accuracy())
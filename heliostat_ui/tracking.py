@@ -0,0 +1,351 @@
+# Predictive sun tracking.
+#
+# Rather than polling once a second and sending wherever the sun is now,
+# TrackingScheduler works out when the next move is needed from how fast the
+# sun is moving on each axis, and aims each move at where the sun will be
+# halfway through the time the mirror will sit there, allowing for the
+# command latency and the time the move itself takes.  That halves the
+# worst-case error for a given number of moves.
+import datetime
+import math
+import os
+import time
+
+from mirror import mirror_normal
+from sun_table import getSunAltAz
+
+# Largest error (in axis degrees) to allow between moves; moves smaller than
+# one step can't be made anyway, so the larger of this and the step size is
+# used.
+TOLERANCE = 0.05
+# Axis step size: 1 / steps-per-unit ($100/$101, 250 in DEFAULTS_GENERIC).
+RESOLUTION = 1.0 / 250
+MIN_INTERVAL = 1.0
+MAX_INTERVAL = 120.0
+# G0 rate ($110/$111, 500 units/min) in axis degrees per second.
+AXIS_RATE = 500 / 60.0
+# Assumed send -> ok latency until one has been measured.
+LATENCY = 0.05
+# Time step for the finite-difference sun rate.
+RATE_STEP = 30.0
+# Azimuths (degrees) the axis may be sent to.  While the sun is up and
+# tracking is running the azimuth follows on from the last move across north
+# rather than swinging round; at night, or when tracking resumes after a
+# pause, it starts again from 0-360, so the joint can't wind up day after
+# day.  Anything that still ends up outside this range is brought back by
+# 360.
+AZ_RANGE = (-180.0, 540.0)
+
+
+class Move:
+    """A planned move: where to send the axes, when it should get there and
+    how long until the next one."""
+    __slots__ = ('target', 'sent', 'arrival', 'aim', 'interval')
+
+    def __init__(self, target, sent, arrival, aim, interval):
+        self.target = target
+        self.sent = sent
+        self.arrival = arrival
+        self.aim = aim
+        self.interval = interval
+
+    def __repr__(self):
+        return "<Move %.3f,%.3f in %.2f s, next in %.1f s>" % (
+            self.target[0], self.target[1], self.arrival - self.sent, self.interval)
+
+
+class TrackingScheduler:
+    def __init__(self, to_axes, tolerance=TOLERANCE, resolution=RESOLUTION,
+                 min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL, axis_rate=AXIS_RATE,
+                 log=None, target=None, az_range=AZ_RANGE):
+        # to_axes(alt, az) -> (x, y) maps a pointing direction to axis
+        # positions.  With a target (alt, az) the mirror is pointed at the
+        # bisector of the sun and the target, otherwise at the sun.
+        self.to_axes = to_axes
+        self.target = target
+        self.tolerance = max(tolerance, resolution)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.axis_rate = axis_rate
+        self.log = log
+        self.latitude = None
+        self.longitude = None
+        # GPS time minus the system clock; a Pi without network time can be
+        # far off.
+        self.clock_offset = 0.0
+        # Azimuth of the last move; later azimuths are taken within 180
+        # degrees of it so the axis doesn't swing all the way round when the
+        # direction crosses north.
+        self.az_reference = None
+        self.az_reference_time = None
+        self.az_range = az_range
+        # Added to every axis target, e.g. a correction from the camera
+        # (see sun_spot.OffsetCorrector).
+        self.offset = (0.0, 0.0)
+        self.moves = 0
+
+    def set_fix(self, latitude, longitude, fix_time=None):
+        self.latitude = latitude
+        self.longitude = longitude
+        if fix_time is not None:
+            if fix_time.tzinfo is None:
+                fix_time = fix_time.replace(tzinfo=datetime.timezone.utc)
+            self.clock_offset = fix_time.timestamp() - time.time()
+
+    def reset(self):
+        """Forget the last move's azimuth, e.g. after homing."""
+        self.az_reference = None
+
+    def ready(self):
+        return self.latitude is not None
+
+    def now(self):
+        return time.time() + self.clock_offset
+
+    def direction(self, t):
+        """Where the mirror should point at time t, as (alt, az); nan when
+        the sun is straight behind the target and there is no such
+        direction."""
+        sun_alt, az = getSunAltAz(self.latitude, self.longitude, t)
+        alt = sun_alt
+        if self.target is not None:
+            alt, az = mirror_normal(alt, az, *self.target)
+            if math.isnan(az):
+                return alt, az
+        if self.az_reference is not None and sun_alt > 0 and \
+                abs(t - self.az_reference_time) <= 2 * self.max_interval:
+            az += 360.0 * round((self.az_reference - az) / 360.0)
+        low, high = self.az_range
+        if not low <= az <= high:
+            az -= 360.0 * math.floor((az - low) / 360.0)
+        return alt, az
+
+    def axes(self, alt, az):
+        x, y = self.to_axes(alt, az)
+        return x + self.offset[0], y + self.offset[1]
+
+    def sun_axes(self, t):
+        return self.axes(*self.direction(t))
+
+    def rate(self, t):
+        """Fastest axis speed of the sun around time t, in degrees/second."""
+        before = self.sun_axes(t - RATE_STEP / 2)
+        after = self.sun_axes(t + RATE_STEP / 2)
+        return max(abs(b - a) for a, b in zip(before, after)) / RATE_STEP
+
+    def interval(self, t):
+        # Aiming at the middle of the interval, the error peaks at
+        # rate * interval / 2 at either end of it.
+        rate = self.rate(t)
+        if rate <= 0:
+            return self.max_interval
+        return min(self.max_interval, max(self.min_interval, 2 * self.tolerance / rate))
+
+    def plan(self, current=None, latency=None, now=None):
+        """Plan the next move from the axes' current position (if known).
+
+        latency is the measured send -> ok time, e.g. GrblStreamer.latency.
+        Returns None if there is no mirror direction at the time aimed for
+        (see direction()); try again after min_interval.
+        """
+        if now is None:
+            now = self.now()
+        if latency is None:
+            latency = LATENCY
+        interval = self.interval(now)
+        arrival = now + latency
+        # The move time depends on the target and vice versa; two rounds
+        # are plenty at tracking speeds.
+        for i in range(2):
+            aim = arrival + interval / 2
+            alt, az = self.direction(aim)
+            target = self.axes(alt, az)
+            move_time = 0.0
+            if current is not None:
+                move_time = max(abs(t - c) for t, c in zip(target, current)) / self.axis_rate
+            arrival = now + latency + move_time
+        if math.isnan(az) or any(math.isnan(v) for v in target):
+            return None
+        self.az_reference = az
+        self.az_reference_time = aim
+        self.moves += 1
+        return Move(target, now, arrival, aim, interval)
+
+    def observe(self, position, now=None):
+        """Record where the axes actually are, for the tracking error log."""
+        if not self.ready():
+            return None
+        if now is None:
+            now = self.now()
+        sun = self.sun_axes(now)
+        if any(math.isnan(s) for s in sun):
+            return None
+        error = max(abs(p - s) for p, s in zip(position, sun))
+        if self.log is not None:
+            self.log.add(now, sun, position, error)
+        return error
+
+
+class TrackingLog:
+    """Tracking error samples, appended to one CSV file per UTC day in
+    directory (if given, and created if need be), with running statistics.
+    Samples closer than interval seconds to the last one kept are dropped.
+    If the file can't be written, CSV output is turned off rather than
+    raising into the caller."""
+
+    def __init__(self, directory=None, interval=0.0):
+        self.directory = directory
+        self.interval = interval
+        self.last = None
+        self.file = None
+        self.date = None
+        self.count = 0
+        self.total = 0.0
+        self.squares = 0.0
+        self.worst = 0.0
+
+    def add(self, t, sun, position, error):
+        if self.last is not None and t - self.last < self.interval:
+            return
+        self.last = t
+        self.count += 1
+        self.total += error
+        self.squares += error * error
+        self.worst = max(self.worst, error)
+        if self.directory is None:
+            return
+        date = datetime.datetime.fromtimestamp(t, datetime.timezone.utc).date()
+        try:
+            if date != self.date:
+                if self.file is not None:
+                    self.file.close()
+                    self.file = None
+                os.makedirs(self.directory, exist_ok=True)
+                path = os.path.join(self.directory, "tracking-%s.csv" % date.isoformat())
+                new = not os.path.exists(path)
+                self.file = open(path, 'a')
+                if new:
+                    self.file.write("time,sun_x,sun_y,x,y,error\n")
+                self.date = date
+            self.file.write("%.1f,%.4f,%.4f,%.4f,%.4f,%.4f\n" % ((t,) + tuple(sun) + tuple(position) + (error,)))
+            self.file.flush()
+        except OSError as ex:
+            print("Tracking log disabled:", ex)
+            self.close()
+            self.directory = None
+
+    def close(self):
+        if self.file is not None:
+            try:
+                self.file.close()
+            except OSError:
+                pass
+            self.file = None
+        self.date = None
+
+    def summary(self):
+        if not self.count:
+            return "no samples"
+        return "%d samples, error mean %.4f rms %.4f max %.4f degrees" % (
+            self.count, self.total / self.count, math.sqrt(self.squares / self.count), self.worst)
+
+
+def simulate_day(latitude, longitude, date, to_axes, mode='predictive', latency=0.05,
+                 axis_rate=AXIS_RATE, step=1.0, target=None):
+    """Track the sun through a day's daylight with a model of the mount: each
+    move starts latency after it is sent and runs at axis_rate.  The mount
+    is assumed to be parked on the sun before sunrise.  Returns (moves, log).
+
+    mode is 'poll', the old behaviour (every second, send wherever the sun
+    is right now), 'adaptive' (the scheduler's interval but no look-ahead)
+    or 'predictive'.
+    """
+    scheduler = TrackingScheduler(to_axes, axis_rate=axis_rate, target=target)
+    scheduler.set_fix(latitude, longitude)
+    log = TrackingLog()
+    start = datetime.datetime(date.year, date.month, date.day, tzinfo=datetime.timezone.utc).timestamp()
+    moves = 0
+    move = None
+    position = None
+    next_move = start
+    for t in range(int(86400 / step)):
+        t = start + t * step
+        alt, az = getSunAltAz(latitude, longitude, t)
+        if alt <= 0:
+            position = move = None
+            continue
+        sun = scheduler.sun_axes(t)
+        if any(math.isnan(s) for s in sun):
+            continue
+        if t >= next_move:
+            if mode == 'predictive':
+                planned = scheduler.plan(position, latency, now=t)
+                target, next_move = planned.target, t + planned.interval
+            elif mode == 'adaptive':
+                target, next_move = sun, t + scheduler.interval(t)
+            else:
+                target, next_move = sun, t + 1.0
+            begin = t + latency
+            duration = 0.0 if position is None else \
+                max(abs(a - b) for a, b in zip(target, position)) / axis_rate
+            move = (begin, duration, position or target, target)
+            position = target
+            moves += 1
+        begin, duration, frm, to = move
+        f = 1.0 if duration == 0 else min(max((t - begin) / duration, 0.0), 1.0)
+        actual = [a + (b - a) * f for a, b in zip(frm, to)]
+        log.add(t, sun, actual, max(abs(a - b) for a, b in zip(actual, sun)))
+    return moves, log
+
+
+def check():
+    """Azimuth wind-up check; raises AssertionError on failure."""
+    from mirror import FULL_APP_MOUNT, offset_to_altaz
+    # Planning every 2 minutes for a week, around the clock as full_app does
+    # or only in daylight, the joints cover the same range every day instead
+    # of gaining 360 degrees a day.
+    start = datetime.datetime(2021, 6, 21, tzinfo=datetime.timezone.utc).timestamp()
+    for (lat, lon), daylight in (((37.77, -122.42), False), ((37.77, -122.42), True),
+                                 ((-33.87, 151.21), True), ((1.35, 103.82), False)):
+        for target in (None, offset_to_altaz(0.0, 20.0, 3.0)):
+            scheduler = TrackingScheduler(FULL_APP_MOUNT.joints, target=target)
+            scheduler.set_fix(lat, lon)
+            days = []
+            for day in range(7):
+                times = [start + day * 86400 + i * 120.0 for i in range(720)]
+                if daylight:
+                    times = [t for t in times if getSunAltAz(lat, lon, t)[0] > 0]
+                xs = [scheduler.plan(now=t).target[0] for t in times]
+                assert all(AZ_RANGE[0] <= -90.0 - x <= AZ_RANGE[1] for x in xs), (lat, target, day)
+                days.append((min(xs), max(xs)))
+            assert max(d[1] for d in days) - min(d[0] for d in days) < 720.0, (lat, target, days)
+            assert abs(days[-1][0] - days[1][0]) < 5.0, (lat, target, days)
+    scheduler.reset()
+    assert scheduler.az_reference is None
+    # With the target straight opposite the sun there is no mirror
+    # direction: nan, and no move, rather than an exception.
+    t = start + 20 * 3600
+    sun_alt, sun_az = getSunAltAz(37.77, -122.42, t)
+    scheduler = TrackingScheduler(FULL_APP_MOUNT.joints, target=(-sun_alt, (sun_az + 180.0) % 360.0))
+    scheduler.set_fix(37.77, -122.42)
+    scheduler.az_reference, scheduler.az_reference_time = 100.0, t
+    assert all(math.isnan(v) for v in scheduler.direction(t))
+    assert scheduler.observe((0.0, 0.0), now=t) is None
+    scheduler.direction = lambda t: (float('nan'), float('nan'))
+    assert scheduler.plan(now=t) is None and scheduler.moves == 0
+
+
+if __name__ == '__main__':
+    from mirror import FULL_APP_MOUNT, offset_to_altaz
+
+    check()
+    print("azimuth wind-up check passed")
+    date = datetime.date(2021, 6, 21)
+    for name, (lat, lon) in (("San Francisco", (37.77, -122.42)), ("London", (51.51, -0.13))):
+        for mode in ('poll', 'adaptive', 'predictive'):
+            moves, log = simulate_day(lat, lon, date, FULL_APP_MOUNT.joints, mode)
+            print("%-14s %-11s %6d moves  %s" % (name, mode, moves, log.summary()))
+        # As a heliostat, with the target 20 m north of the mirror and 3 m up.
+        moves, log = simulate_day(lat, lon, date, FULL_APP_MOUNT.joints,
+                                  target=offset_to_altaz(0.0, 20.0, 3.0))
+        print("%-14s %-11s %6d moves  %s" % (name, 'heliostat', moves, log.summary()))
@@ -1,11 +1,13 @@
 import dateutil.parser
-import astropy.coordinates as coord
-from astropy.time import Time
-import astropy.units as u
+import os
+import sys
 import time
 import pynmea2
 import serial
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'heliostat_ui'))
+import nmea
+
 
 s = serial.Serial("COM6", 115200, timeout=1)
 msg = b"[MSG:'$H'|'$X' to unlock]\r\n"
@@ -30,6 +32,10 @@ while True:
     time.sleep(1)
 
 def getSunPos(latitude, longitude, t):
+    # Deferred so homing isn't held up by astropy's import time.
+    import astropy.coordinates as coord
+    from astropy.time import Time
+    import astropy.units as u
     loc = coord.EarthLocation(lon=longitude * u.deg,
                               lat=latitude * u.deg)
     now = Time(t)
@@ -47,11 +53,11 @@ while True:
     line = gpsserial.readline()
     decoded = line.decode('UTF-8')
     try:
-        msg = pynmea2.parse(decoded)
+        msg = nmea.parse(decoded)
     except pynmea2.ParseError:
         print("failed to parse")
     else:
-        if (msg.sentence_type == 'RMC'):
+        if msg.sentence_type == 'RMC' and msg.datetime is not None:
             result = getSunPos(msg.latitude, msg.longitude, msg.datetime)
             #print(msg.latitude, msg.longitude, msg.datetime, result.alt.degree, result.az.degree)
             
@@ -1,18 +1,37 @@
+import math
+import os
+import re
 import signal
+import sys
 import time
 from PyQt5 import QtCore
-from ramps_qobject import QRAMPSObject
+from ramps_qobject import QRAMPSObject, PORT
 from mqtt_qobject import MqttClient
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'heliostat_ui'))
+import grbl
+from jog import Jogger
+
+# ramps_gui.py repeats a jog message while its button is held; if they stop
+# arriving (a lost release), the jog stops by itself after this long.
+JOG_KEEPALIVE = 0.5
+# An axis and a direction, e.g. "Y1" or "x-1".  Only the sign is used: the
+# Jogger sets the speed, so "Y50" jogs as fast as "Y1".
+JOG_PAYLOAD = re.compile(r'^[XYZxyz][-+]?\d*\.?\d+$')
 
 class Tui(QtCore.QObject):
 
-    def __init__(self, app):
+    def __init__(self, app, port=PORT):
         super(Tui, self).__init__()
 
         self.app = app
 
-        self.ramps = QRAMPSObject()
+        self.ramps = QRAMPSObject(port=port)
         self.ramps.messageSignal.connect(self.on_serial_read)
+        self.ramps.lineSignal.connect(self.on_line)
+        self.parser = grbl.GrblParser()
+        self.jogger = Jogger(self.ramps.streamer, self.ramps.send_realtime,
+                             keepalive=JOG_KEEPALIVE, parent=self)
+        self.jogger.stoppedSignal.connect(self.on_jog_stopped)
         time.sleep(1.5)
         self.ramps.send_line("G91")
         time.sleep(0.1)
@@ -28,21 +47,38 @@ class Tui(QtCore.QObject):
     def on_serial_read(self, data):
         self.client.publish("heliostat/ramps/output", data)
 
+    def on_line(self, line):
+        record = self.parser.parse_line(line)
+        if isinstance(record, grbl.StatusReport):
+            self.jogger.on_status(record)
+
+    def on_jog_stopped(self, latency):
+        print("Jog stopped in %.0f ms (%s)" % (latency * 1e3, self.jogger.summary()))
+
 
     @QtCore.pyqtSlot(int)
     def on_stateChanged(self, state):
         if state == MqttClient.Connected:
             self.client.subscribe("heliostat/ramps/command")
+            self.client.subscribe("heliostat/ramps/jog")
 
     @QtCore.pyqtSlot(str, str)
     def on_messageSignal(self, topic, payload):
         if topic == 'heliostat/ramps/command':
             self.ramps.send_line(payload)
+        elif topic == 'heliostat/ramps/jog':
+            # "Y1", "X-1", ... while a button is held, then "stop".
+            if payload == 'stop':
+                self.jogger.stop()
+            elif not JOG_PAYLOAD.match(payload) or float(payload[1:]) == 0:
+                print("Ignoring jog message %r" % payload)
+            else:
+                self.jogger.start(**{payload[0]: math.copysign(1.0, float(payload[1:]))})
 
 if __name__ == "__main__":
-    import sys
     app = QtCore.QCoreApplication(sys.argv)
     signal.signal(signal.SIGINT, signal.SIG_DFL)
-    tui = Tui(app)
+    # An optional argument picks another serial port, e.g. a grbl_sim.py pty.
+    tui = Tui(app, *sys.argv[1:2])
     sys.exit(app.exec_())
 
@@ -1,17 +1,217 @@
 #!/usr/bin/python3
+# The camera thread writes each frame straight into one of three
+# preallocated buffers in a FrameStore, and the GUI takes the newest one when
+# it's ready for it.  A frame the GUI hasn't got to yet is overwritten by the
+# next, so a GUI that falls behind skips frames instead of queueing them
+# (which used to mean a 1.1 MB bytes object per frame, piling up in the event
+# queue).
+import os
+import resource
+import sys
+import threading
+import time
+
+import numpy as np
 from PyQt5.QtCore import QObject, pyqtSignal
-import picamera
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'heliostat_ui'))
+import camera_source
+
 RESOLUTION=800, 480
- 
+# Print frame store stats every this many frames shown.
+REPORT_EVERY = 250
+
+
+def padded_resolution(resolution):
+    # picamera pads unencoded captures to a multiple of 32 pixels wide and
+    # 16 high.
+    width, height = resolution
+    return (width + 31) // 32 * 32, (height + 15) // 16 * 16
+
+
+def frame_shape(resolution, fmt):
+    """Array shape of one picamera frame in fmt, padding included."""
+    width, height = padded_resolution(resolution)
+    if fmt == 'yuv':
+        # I420: a full-size Y plane and quarter-size U and V planes.
+        return height * 3 // 2, width
+    channels = camera_source.FORMATS[fmt][1]
+    return (height, width) if channels == 1 else (height, width, channels)
+
+
+class FrameStore:
+    """Triple buffer of frames shared by one writer and one reader thread.  The writer fills writing() and calls publish(); the
+    reader's take() returns the newest published frame, which stays the
+    reader's until its next take()."""
+
+    def __init__(self, resolution=RESOLUTION, fmt='bgr', count=3):
+        self.resolution = resolution
+        self.fmt = fmt
+        self.buffers = [np.zeros(frame_shape(resolution, fmt), dtype=np.uint8) for i in range(count)]
+        self.lock = threading.Lock()
+        self.writing_index = 0
+        self.ready = None
+        self.reading = None
+        self.free = list(range(1, count))
+        self.published = 0
+        self.taken = 0
+        self.dropped = 0
+
+    def writing(self):
+        return self.buffers[self.writing_index]
+
+    def publish(self):
+        """Make the frame in writing() the newest.  Returns True if the
+        reader had taken the previous one, i.e. it needs telling."""
+        with self.lock:
+            self.published += 1
+            replaced = self.ready
+            self.ready = self.writing_index
+            if replaced is not None:
+                # Drop the older unread frame and write the next over it.
+                self.dropped += 1
+                self.writing_index = replaced
+            else:
+                self.writing_index = self.free.pop()
+            return replaced is None
+
+    def take(self):
+        """The newest frame, or None if there's been nothing new since the
+        last take().  The array includes picamera's padding; the picture is
+        its top-left resolution.  (A cropped view isn't contiguous, which
+        QImage won't wrap.)"""
+        with self.lock:
+            if self.ready is None:
+                return None
+            if self.reading is not None:
+                self.free.append(self.reading)
+            self.reading = self.ready
+            self.ready = None
+            self.taken += 1
+            return self.buffers[self.reading]
+
+    def nbytes(self):
+        return sum(buffer.nbytes for buffer in self.buffers)
+
+    def summary(self):
+        return "%d frames, %d shown, %d dropped, %.1f MB of buffers, max RSS %.1f MB" % (
+            self.published, self.taken, self.dropped, self.nbytes() / 1e6,
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0)
+
+
+class FrameWriter:
+    """A picamera output that copies the frame data into the store's
+    writing buffer as it arrives, publishing each complete frame."""
+
+    def __init__(self, store, on_frame):
+        self.store = store
+        self.on_frame = on_frame
+        self.offset = 0
+        self.target = memoryview(store.writing()).cast('B')
+
+    def write(self, data):
+        data = memoryview(data).cast('B')
+        written = 0
+        while written < len(data):
+            n = min(len(data) - written, len(self.target) - self.offset)
+            self.target[self.offset:self.offset + n] = data[written:written + n]
+            self.offset += n
+            written += n
+            if self.offset == len(self.target):
+                if self.store.publish():
+                    self.on_frame()
+                self.offset = 0
+                self.target = memoryview(self.store.writing()).cast('B')
+        return len(data)
+
+    def flush(self):
+        pass
+
+
 class QPiCamera(QObject):
-    messageSignal = pyqtSignal(bytes)
+    # Emitted when a new frame is waiting in self.store, but only if the
+    # last one was taken: at most one is ever queued.
+    frameSignal = pyqtSignal()
 
-    def __init__(self, parent=None):
+    def __init__(self, fmt='bgr', parent=None):
         super(QPiCamera, self).__init__(parent)
-        
+        # Any of camera_source.PICAMERA_FORMATS, see camera_source.negotiate.
+        self.fmt = fmt
+        self.store = FrameStore(RESOLUTION, fmt)
+
     def loop(self):
+        import picamera
+        writer = FrameWriter(self.store, self.frameSignal.emit)
         with picamera.PiCamera(resolution=RESOLUTION, framerate=25) as camera:
-            with picamera.CircularIO(size=RESOLUTION[0]*RESOLUTION[1]*3) as stream:
-                for frame in camera.capture_continuous(stream, format='bgr'):
-                    stream.seek(0)
-                    self.messageSignal.emit(stream.read())
+            camera.start_recording(writer, format=self.fmt)
+            while True:
+                camera.wait_recording(1)
+
+
+if __name__ == '__main__':
+    # A 25 fps camera thread feeding a GUI that takes 100 ms per frame, the
+    # old way (a bytes object per frame through a queued signal) and through
+    # the FrameStore.
+    from PyQt5.QtCore import QCoreApplication, QThread
+
+    FPS = 25
+    DURATION = 3.0
+    GUI_TIME = 0.1
+    width, height = padded_resolution(RESOLUTION)
+    frame = np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8).tobytes()
+    app = QCoreApplication(sys.argv)
+
+    class Source(QObject):
+        bytesSignal = pyqtSignal(bytes)
+
+        def __init__(self, writer=None):
+            super(Source, self).__init__()
+            self.writer = writer
+
+        def loop(self):
+            # picamera hands frames over in chunks of a few rows.
+            chunk = width * 3 * 16
+            end = time.perf_counter() + DURATION
+            while time.perf_counter() < end:
+                if self.writer is None:
+                    self.bytesSignal.emit(frame)
+                else:
+                    for i in range(0, len(frame), chunk):
+                        self.writer.write(frame[i:i + chunk])
+                time.sleep(1.0 / FPS)
+
+    def run(source, connect):
+        thread = QThread()
+        source.moveToThread(thread)
+        thread.started.connect(source.loop)
+        connect()
+        thread.start()
+        end = time.perf_counter() + DURATION + 0.5
+        while time.perf_counter() < end:
+            app.processEvents()
+        thread.quit()
+        thread.wait()
+
+    handled = [0]
+
+    def on_bytes(img):
+        handled[0] += 1
+        time.sleep(GUI_TIME)
+
+    camera = QPiCamera()
+    store = camera.store
+
+    def on_frame():
+        if store.take() is not None:
+            time.sleep(GUI_TIME)
+
+    source = Source(FrameWriter(store, camera.frameSignal.emit))
+    run(source, lambda: camera.frameSignal.connect(on_frame))
+    print("frame store: %s" % store.summary())
+    assert store.published == store.taken + store.dropped + (store.ready is not None)
+
+    source = Source()
+    run(source, lambda: source.bytesSignal.connect(on_bytes))
+    print("bytes signal: %d frames handled in %.1f s, %d still queued (%.0f MB)" % (
+        handled[0], DURATION + 0.5, FPS * DURATION - handled[0],
+        (FPS * DURATION - handled[0]) * len(frame) / 1e6))
@@ -1,15 +1,21 @@
 #!/usr/bin/python3
 import time
 import io
+import os
 import sys
 from PyQt5.QtWidgets import QApplication, QLabel, QMainWindow, QWidget, QVBoxLayout, QPushButton, QSizePolicy
 from PyQt5.QtCore import Qt, QTimer, QRect, QObject, pyqtSignal, QThread
-from PyQt5.QtGui import QImage, QPixmap
+from PyQt5.QtGui import QPixmap
 from PyQt5.QtCore import pyqtSlot
-import picamera
 from mqtt_qobject import MqttClient
+import pi_camera_qobject
 from pi_camera_qobject import QPiCamera, RESOLUTION
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'heliostat_ui'))
+import camera_source
 TIMER_TICK=1
+# How often a held jog button repeats its jog message; headless_ramps.py
+# stops the jog if they stop arriving.
+JOG_REPEAT_MS = 150
 
 
 
@@ -26,72 +32,97 @@ class Window(QMainWindow):
                                 
         self.label = QLabel(parent=self)
         self.label.show()
-        self.qimage = QImage(RESOLUTION[0], RESOLUTION[1], QImage.Format_RGB888)
-        self.label.resize(self.qimage.size())
+        self.label.resize(*RESOLUTION)
 
         up_button = QPushButton("Up", parent=self)
-        up_button.setAutoRepeat(True)
-        up_button.setAutoRepeatInterval(150)
         up_button.move(400, 10)
         up_button.setFixedSize(120,60)
         up_button.show()
-        up_button.clicked.connect(self.on_up_button)
+        up_button.pressed.connect(self.on_up_button)
+        up_button.released.connect(self.on_jog_released)
 
         down_button = QPushButton("Down", parent=self)
-        down_button.setAutoRepeat(True)
-        down_button.setAutoRepeatInterval(150)
         down_button.move(400, 400)
         down_button.setFixedSize(120,60)
         down_button.show()
-        down_button.clicked.connect(self.on_down_button)
+        down_button.pressed.connect(self.on_down_button)
+        down_button.released.connect(self.on_jog_released)
 
         left_button = QPushButton("Left", parent=self)
-        left_button.setAutoRepeat(True)
-        down_button.setAutoRepeatInterval(150)
         left_button.move(10, 240)
         left_button.setFixedSize(120,60)
         left_button.show()
-        left_button.clicked.connect(self.on_left_button)
+        left_button.pressed.connect(self.on_left_button)
+        left_button.released.connect(self.on_jog_released)
 
         right_button = QPushButton("Right", parent=self)
-        right_button.setAutoRepeat(True)
-        right_button.setAutoRepeatInterval(150)
         right_button.move(675, 240)
         right_button.setFixedSize(120,60)
         right_button.show()
-        right_button.clicked.connect(self.on_right_button)
+        right_button.pressed.connect(self.on_right_button)
+        right_button.released.connect(self.on_jog_released)
 
         
+        self.jog = None
+        self.jog_timer = QTimer(self)
+        self.jog_timer.timeout.connect(self.repeat_jog)
+
         self.qpicamera_thread = QThread()
-        self.qpicamera = QPiCamera()
-        self.qpicamera.messageSignal.connect(self.on_qpicameraSignal)
+        # The camera delivers frames in a format the QImage can wrap as is
+        # (bgra, painted as RGB32, on any current Qt).
+        capture, self.display_fmt, self.convert = camera_source.negotiate(camera_source.PICAMERA_FORMATS)
+        self.converted = None
+        print("camera format", capture, "displayed as", self.display_fmt)
+        self.qpicamera = QPiCamera(capture)
+        self.qpicamera.frameSignal.connect(self.on_qpicameraSignal)
         self.qpicamera.moveToThread(self.qpicamera_thread)
         self.qpicamera_thread.started.connect(self.qpicamera.loop)
         self.qpicamera_thread.start()
 
     def on_up_button(self):
-        p = self.label.pos()
-        self.client.publish("heliostat/ramps/command", "G0 Y1")
+        self.start_jog("Y1")
 
     def on_down_button(self):
-        p = self.label.pos()
-        self.client.publish("heliostat/ramps/command", "G0 Y-1")
+        self.start_jog("Y-1")
 
     def on_left_button(self):
-        p = self.label.pos()
-        self.client.publish("heliostat/ramps/command", "G0 X-1")
+        self.start_jog("X-1")
 
     def on_right_button(self):
-        p = self.label.pos()
-        self.client.publish("heliostat/ramps/command", "G0 X1")
-
-    @pyqtSlot(bytes)
-    def on_qpicameraSignal(self, img):
-        b = self.qimage.bits()
-        b.setsize(RESOLUTION[0] * RESOLUTION[1] * 3)
-        b[:] = img
-        pixmap = QPixmap(self.qimage)
-        self.label.setPixmap(pixmap)
+        self.start_jog("X1")
+
+    def start_jog(self, jog):
+        # Jogs while the button is held and stops as soon as it's released,
+        # rather than queueing a relative G0 per auto-repeat.
+        self.jog = jog
+        self.repeat_jog()
+        self.jog_timer.start(JOG_REPEAT_MS)
+
+    def repeat_jog(self):
+        self.client.publish("heliostat/ramps/jog", self.jog)
+
+    def on_jog_released(self):
+        self.jog_timer.stop()
+        self.client.publish("heliostat/ramps/jog", "stop")
+
+    @pyqtSlot()
+    def on_qpicameraSignal(self):
+        store = self.qpicamera.store
+        frame = store.take()
+        if frame is None:
+            return
+        if self.convert is not None:
+            # A new array; kept until the next one replaces it, as an RGB32
+            # pixmap shares it rather than copying.
+            frame = self.converted = self.convert(frame)
+        # The frame stays ours until the next take(), so the QImage (and an
+        # RGB32 pixmap, which shares it rather than copying) can use it as
+        # is.  take() hands the previous frame back to the camera, but the
+        # label lets go of it below, before anything is repainted.
+        qimage = camera_source.to_qimage(frame, self.display_fmt, *RESOLUTION)
+        self.label.setPixmap(QPixmap.fromImage(qimage))
+        if store.taken % pi_camera_qobject.REPORT_EVERY == 0:
+            print("camera:", store.summary())
 
 def main(): 
     app = QApplication(sys.argv)
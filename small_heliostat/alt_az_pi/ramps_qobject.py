@@ -1,14 +1,22 @@
+import os
 import sys
 from PyQt5.QtSerialPort import QSerialPort
 from PyQt5 import QtCore
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'heliostat_ui'))
+from grbl import LineBuffer
+from grbl_stream import GrblStreamer
+
+PORT = "/dev/ttyUSB0"
+
 class QRAMPSObject(QtCore.QObject):
     messageSignal = QtCore.pyqtSignal(str)
-    def __init__(self, *args, **kwargs):
+    # One complete response line at a time, unlike messageSignal's raw reads.
+    lineSignal = QtCore.pyqtSignal(str)
+    def __init__(self, *args, port=PORT, **kwargs):
         super(QtCore.QObject, self).__init__(*args, **kwargs)
 
         self.serial = QSerialPort()
-        port = "/dev/ttyUSB0"
         self.serial.setPortName(port)
         if self.serial.open(QtCore.QIODevice.ReadWrite):
             self.serial.setDataTerminalReady(True)
@@ -16,13 +24,21 @@ class QRAMPSObject(QtCore.QObject):
             self.serial.readyRead.connect(self.on_serial_read)
         else:
             print("Failed to open serial port")
+        self.lines = LineBuffer()
+        self.streamer = GrblStreamer(self.serial.write, is_open=self.serial.isOpen)
 
-        
     def send_line(self, line):
-        b = bytearray(line + '\r', 'utf-8')
-        self.serial.writeData(b)
+        self.streamer.send(line)
+
+    def send_realtime(self, data):
+        # Realtime bytes bypass the streamer; Grbl doesn't count them
+        # against its receive buffer.
+        self.serial.write(data)
         
     def on_serial_read(self, *args):
         data = self.serial.readAll()
         decoded = data.data().decode('US_ASCII')
+        for line in self.lines.feed(decoded):
+            self.streamer.on_line(line)
+            self.lineSignal.emit(line)
         self.messageSignal.emit(decoded)